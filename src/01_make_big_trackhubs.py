@@ -3,18 +3,38 @@
 from __future__ import print_function
 
 import sys
+import copy
 import json
 import os
 import re
+import time
 import argparse
+import shutil
 import requests
 from collections import OrderedDict, defaultdict
-from multiprocessing import Process, Value, Lock, Manager, Pool
-from joblib import Parallel, delayed
+from multiprocessing import Process, Pool
 
 from helpers.tracks import Tracks, Parent
 import helpers.helpers as Helpers
-from paths import Host, BaseWwwDir, BaseWwwTmpDir
+from helpers.buildcache import BuildCache
+from helpers.selectioncache import SelectionCache
+from helpers.wscache import MetadataCache, Modes as MetadataCacheModes
+from helpers.registry import ExperimentRegistry
+from helpers.priority import PriorityPlanner, ShardPriorityPlanner
+from helpers.scheduler import TaskGraph
+from helpers.release import Releases, Current
+from helpers.shards import ShardWriter
+from helpers.precompress import Precompressor, brotli
+from helpers.urlcheck import UrlCache, UrlChecker, checkRelease
+from helpers.localfiles import LocalFiles
+from helpers.viewlimits import ViewLimitsCache, numpy
+from helpers.profiler import Profile
+from helpers.listscache import ListsCache
+from paths import Host, BaseWwwDir, BaseWwwTmpDir, BuildCacheDir, MetadataCacheDir
+from paths import SelectionCacheDir, ProfileDir, ListsCacheDir, UrlCacheDir, FilesHost
+from paths import ViewLimitsCacheDir
+from paths import RunID, WwwReleasesDir
+from assemblies import Assemblies
 from byBiosampleType import TrackhubDbBiosampleType
 from byAssayByBiosampleType import TrackhubDbByAssayByBiosampleType
 from byAssayByFactor import TrackhubDbByAssayByFactor
@@ -26,56 +46,39 @@ from files_and_paths import Dirs, Urls, Datasets
 from utils import Utils, eprint, AddPath, printt, printWroteNumLines
 from metadataws import MetadataWS
 
-class Counter(object):
-    # https://github.com/davidheryanto/etc/blob/master/python-recipes/parallel-joblib-counter.py
-    def __init__(self, manager, initval=0):
-        self.val = manager.Value('i', initval)
-        self.lock = manager.Lock()
-
-    def increment(self, val = 1):
-        return self.add_pre(val)
-
-    # pre-fix add a given val
-    def add_pre(self, val = 1):
-        with self.lock:
-            self.val.value += val
-            return self.val.value
-
-    # post-fix add a given val
-    def add_post(self, val = 1):
-        with self.lock:
-            ret = self.val.value
-            self.val.value += val
-            return ret
-
-    def value(self):
-        with self.lock:
-            return self.val.value
-
-
 class MegaTrackHub:
-    def __init__(self, args, assembly, globalData, priority):
+    def __init__(self, args, assembly, globalData, priority, mw=None):
         self.args = args
         self.assembly = assembly
         self.globalData = globalData
         self.priority = priority
 
         dataset = Datasets.byAssembly(assembly)
-        self.mw = MetadataWS(dataset=dataset, host=Host)
+        self.wsCache = MetadataCache(MetadataCacheDir, Host, args.wsCache,
+                                     args.wsCacheTtl * 3600)
+        if mw is None:
+            mw = MetadataWS(dataset=dataset, host=Host)
+        self.mw = self.wsCache.wrap(mw, assembly)
+        self.localFiles = None
+        if args.mirror:
+            limitsCache = None
+            if args.viewLimits:
+                limitsCache = ViewLimitsCache(ViewLimitsCacheDir)
+            self.localFiles = LocalFiles(args.mirror, assembly, globalData["chromLens"],
+                                         args.j, limitsCache)
+        self.registry = ExperimentRegistry(self.mw, self.localFiles and self.localFiles.filter)
+        self.cache = BuildCache(BuildCacheDir, args.cache)
+        # every view picks files for the same experiments; workers inherit this
+        Helpers.SelectionMemo = SelectionCache(SelectionCacheDir, args.cache)
 
     def run(self):
-        self._makeHub()
-
         args = {"args": self.args,
                 "assembly": self.assembly,
                 "globalData": self.globalData,
                 "mw": self.mw,
-                "priority": self.priority}
-
-        def runner(arg, klass):
-            if not arg:
-                return ""
-            return klass(**args).run()
+                "registry": self.registry,
+                "priority": self.priority,
+                "cache": self.cache}
 
         self.typs = [("ccREs", TrackhubDbByCcREs),
                      ("organSlim", TrackhubDbByOrganSlim),
@@ -83,24 +86,54 @@ class MegaTrackHub:
                      ("assay", TrackhubDbByAssayByBiosampleType),
                      ("biosample", TrackhubDbBiosampleType)]
 
-        self.out = {}
-        for typ, f in self.typs:
-            self.out[typ] = runner(getattr(self.args, typ), f)
+        self.builders = []
+        for typ, klass in self.typs:
+            if getattr(self.args, typ):
+                self.builders.append((typ, klass(**args)))
+
+        try:
+            TaskGraph(self.args.j).run([b for typ, b in self.builders])
+        finally:
+            if self.localFiles:
+                self.localFiles.close()
+        Helpers.SelectionMemo.save()
 
-        self.makeMainTrackDb()
+        if self.args.shard:
+            self.makeShardedTrackDb()
+        else:
+            self.makeMainTrackDb()
+
+    def makeShardedTrackDb(self):
+        # shards matching the published release are linked, not rewritten
+        current = Releases(WwwReleasesDir).target(Current)
+        previousDir = None
+        if current:
+            previousDir = os.path.join(WwwReleasesDir, current, self.assembly)
+        with Profile.stage(self.assembly + " makeShardedTrackDb"):
+            ShardWriter(os.path.join(BaseWwwDir, self.assembly),
+                        previousDir).write(self.builders)
 
     def makeMainTrackDb(self):
+        # streamed straight from the composite files, so memory use does not
+        #  grow with the size of the trackDb
         fnp = os.path.join(BaseWwwDir, self.assembly, 'trackDb.txt')
         Utils.ensureDir(fnp)
-        with open(fnp, 'w') as f:
-            for typ, _ in self.typs:
-                f.write(self.out[typ])
+        with Profile.stage(self.assembly + " makeMainTrackDb"):
+            with Helpers.atomicOpen(fnp) as f:
+                for typ, b in self.builders:
+                    f.write(b.superTracks())
+                    for compositeFnp in b.composites():
+                        with open(compositeFnp, 'rb') as c:
+                            shutil.copyfileobj(c, f, 1024 * 1024)
+                        f.write('\n')
+        Profile.count("bytes written", os.path.getsize(fnp))
         printWroteNumLines(fnp)
 
-    def _makeHub(self):
-        fnp = os.path.join(BaseWwwDir, 'hub.txt')
-        with open(fnp, 'w') as f:
-            f.write("""
+def outputHub():
+    fnp = os.path.join(BaseWwwDir, 'hub.txt')
+    Utils.ensureDir(fnp)
+    with open(fnp, 'w') as f:
+        f.write("""
 hub ENCODE
 shortLabel ENCODE Trackhub Test6
 longLabel ENCODE Trackhub Test6
@@ -108,17 +141,14 @@ genomesFile genomes.txt
 email zhiping.weng@umassmed.edu
 descriptionUrl http://encodeproject.org/
 """)
-        printWroteNumLines(fnp)
+    printWroteNumLines(fnp)
 
 def outputGenomes(assemblies):
     fnp = os.path.join(BaseWwwDir, 'genomes.txt')
 
-    defaultPoses = {"hg19": "chr12:121374959-121481905",
-                    "mm10": "chr2:163423234-163655010"}
-
     with open(fnp, 'w') as f:
         for assembly in assemblies:
-            defaultPos = defaultPoses.get(assembly, "")
+            defaultPos = Assemblies[assembly]["defaultPos"]
 
             f.write("""
 genome {assembly}
@@ -129,17 +159,31 @@ defaultPos {defaultPos}
     printWroteNumLines(fnp)
 
 
+def checkUrls(args):
+    checker = UrlChecker(UrlCache(UrlCacheDir), args.urlCheckJ, args.urlCheckRate,
+                         ttl=args.urlCheckTtl * 3600, host=FilesHost,
+                         direct=args.directUrls)
+    dead = checkRelease(BaseWwwDir, checker, args.directUrls)
+    if 0 <= args.maxDeadUrls < len(dead):
+        raise Exception("%d dead bigDataUrls (at most %d allowed)" %
+                        (len(dead), args.maxDeadUrls))
+
 def testHub():
     printt("checking hub...")
     cmds = ["/data/common/tools/ucsc.v350/hubCheck",
             "-noTracks",
             os.path.join(BaseWwwDir, 'hub.txt')]
-    printt(Utils.runCmds(cmds))
+    with Profile.stage("testHub"):
+        printt(Utils.runCmds(cmds))
 
-def parse_args():
+def parse_args(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('-j', type=int, default=4)
-    parser.add_argument("--assembly", type=str, default="")
+    parser.add_argument("--assembly", type=str, default="",
+                        help="comma-separated; defaults to every registered assembly")
+    parser.add_argument('--parallel-assemblies', dest='parallelAssemblies',
+                        action='store_true', default=False,
+                        help="build all assemblies at once, sharing the -j budget")
 
     assay_parser = parser.add_mutually_exclusive_group(required=False)
     assay_parser.add_argument('--assay', dest='assay', action='store_true')
@@ -166,37 +210,174 @@ def parse_args():
     organSlim_parser.add_argument('--no-organSlim', dest='organSlim', action='store_false')
     parser.set_defaults(organSlim=True)
 
-    return parser.parse_args()
-
+    # reuse rendered composites whose inputs are unchanged since the last run
+    cache_parser = parser.add_mutually_exclusive_group(required=False)
+    cache_parser.add_argument('--cache', dest='cache', action='store_true')
+    cache_parser.add_argument('--no-cache', dest='cache', action='store_false')
+    parser.set_defaults(cache=True)
+
+    # on-disk MetadataWS responses; "replay" builds without any network access
+    parser.add_argument('--ws-cache', dest='wsCache', type=str, default="cache",
+                        choices=MetadataCacheModes)
+    parser.add_argument('--ws-cache-ttl', dest='wsCacheTtl', type=float, default=24,
+                        help="hours before a cached response is fetched again in full")
+
+    # builds stage under www-releases/.staging/<run id> and are swapped in
+    #  as www-releases/current only once complete
+    publish_parser = parser.add_mutually_exclusive_group(required=False)
+    publish_parser.add_argument('--publish', dest='publish', action='store_true')
+    publish_parser.add_argument('--no-publish', dest='publish', action='store_false')
+    parser.set_defaults(publish=True)
+    parser.add_argument('--rollback', action='store_true', default=False,
+                        help="point current back at the previous release and exit")
+
+    # trackDb.txt as include lines over one file per super track
+    shard_parser = parser.add_mutually_exclusive_group(required=False)
+    shard_parser.add_argument('--shard', dest='shard', action='store_true')
+    shard_parser.add_argument('--no-shard', dest='shard', action='store_false')
+    parser.set_defaults(shard=False)
+
+    parser.add_argument('--mirror', type=str, default="",
+                        help="local copies of the bigWigs/bigBeds, named as their urls end; "
+                        "files whose copy is broken or off-assembly are left out")
+    parser.add_argument('--view-limits', dest='viewLimits', action='store_true', default=False,
+                        help="fixed viewLimits for mirrored bigWigs from their coarsest zoom level "
+                        "(needs --mirror and numpy)")
+
+    # fetch every bigDataUrl before publishing; results are kept in url-cache/
+    parser.add_argument('--check-urls', dest='checkUrls', action='store_true', default=False,
+                        help="check every bigDataUrl before publishing")
+    parser.add_argument('--direct-urls', dest='directUrls', action='store_true', default=False,
+                        help="check, then point bigDataUrls at where they redirect, skipping ?proxy=true")
+    parser.add_argument('--url-check-j', dest='urlCheckJ', type=int, default=16)
+    parser.add_argument('--url-check-rate', dest='urlCheckRate', type=float, default=20,
+                        help="requests per second, across all threads")
+    parser.add_argument('--url-check-ttl', dest='urlCheckTtl', type=float, default=7 * 24,
+                        help="hours before a live url is checked again")
+    parser.add_argument('--max-dead-urls', dest='maxDeadUrls', type=int, default=-1,
+                        help="fail the build, unpublished, past this many dead urls")
+
+    # .gz siblings for nginx's gzip_static, and manifest.json of content hashes
+    precompress_parser = parser.add_mutually_exclusive_group(required=False)
+    precompress_parser.add_argument('--precompress', dest='precompress', action='store_true')
+    precompress_parser.add_argument('--no-precompress', dest='precompress', action='store_false')
+    parser.set_defaults(precompress=True)
+    parser.add_argument('--brotli', action='store_true', default=False,
+                        help="also write .br siblings (needs the brotli module)")
+
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help="write per-stage times and counters to profiles/<run id>.json")
+
+    args = parser.parse_args(argv)
+    if args.brotli and not brotli:
+        parser.error("--brotli needs the brotli module")
+    if args.viewLimits and not (args.mirror and numpy):
+        parser.error("--view-limits needs --mirror and the numpy module")
+    return args
+
+
+def buildAssembly(args, assembly):
+    printt("************************", assembly)
+
+    if 0:
+        printt("loading globalData from API...")
+        globalDataUrl = "http://api.wenglab.org/screenv10_python/globalData/0/" + assembly
+        ws = requests.get(globalDataUrl)
+        globalData = ws.json()
+    else:
+        printt("loading globalData from disk...")
+        with Profile.stage(assembly + " globalData"):
+            globalData = ListsCache(ListsCacheDir).globalData(assembly)
+    printt("done")
+
+    # priorities only need to be unique within one trackDb, so each assembly
+    #  numbers from 0 whether or not it is built alongside others
+    priority = PriorityPlanner()
+    if args.shard:
+        priority = ShardPriorityPlanner()
+    tdb = MegaTrackHub(args, assembly, globalData, priority)
+    tdb.run()
+
+def profileFnp(*parts):
+    return os.path.join(ProfileDir, '.'.join((RunID,) + parts + ("json",)))
+
+def buildAssemblyInChild(args, assembly):
+    buildAssembly(args, assembly)
+    if Profile.enabled:
+        # picked up and merged by the parent once we exit
+        Profile.save(profileFnp(assembly))
+
+def buildAssembliesInParallel(args, assemblies):
+    # one process per assembly, splitting the -j worker budget between them
+    procs = []
+    for idx, assembly in enumerate(assemblies):
+        asmArgs = copy.copy(args)
+        asmArgs.j = max(1, args.j // len(assemblies) +
+                        (1 if idx < args.j % len(assemblies) else 0))
+        p = Process(target=buildAssemblyInChild, args=(asmArgs, assembly))
+        p.start()
+        procs.append((assembly, p))
+
+    for assembly, p in procs:
+        p.join()
+        if p.exitcode:
+            raise Exception("build failed for " + assembly)
+        if Profile.enabled:
+            Profile.load(profileFnp(assembly))
+            os.remove(profileFnp(assembly))
+
+def build(args, releases, assemblies):
+    outputHub()
+    if args.parallelAssemblies and len(assemblies) > 1:
+        buildAssembliesInParallel(args, assemblies)
+    else:
+        for assembly in assemblies:
+            buildAssembly(args, assembly)
+    outputGenomes(assemblies)
+    if args.checkUrls or args.directUrls:
+        checkUrls(args)
+    testHub()
+    if args.precompress:
+        current = releases.target(Current)
+        Precompressor(BaseWwwDir, current and os.path.join(WwwReleasesDir, current),
+                      args.brotli).run()
 
 def main():
     args = parse_args()
+    start = time.time()
+    Profile.enabled = args.profile
 
-    manager = Manager()
-    result = manager.dict()
-    priority = Counter(manager, 0)
-
-    assemblies = ["hg19", "mm10"]
-    for assembly in assemblies:
-        printt("************************", assembly)
+    releases = Releases(WwwReleasesDir)
+    if args.rollback:
+        releases.rollback()
+        return
 
-        if 0:
-            printt("loading globalData from API...")
-            globalDataUrl = "http://api.wenglab.org/screenv10_python/globalData/0/" + assembly
-            ws = requests.get(globalDataUrl)
-            globalData = ws.json()
-        else:
-            printt("loading globalData from disk...")
-            fnp = os.path.join(os.path.dirname(__file__), "../lists",
-                               "globalData." + assembly + ".json")
-            with open(fnp) as f:
-                globalData = json.load(f)
-        printt("done")
-
-        tdb = MegaTrackHub(args, assembly, globalData, priority)
-        tdb.run()
-    outputGenomes(assemblies)
-    testHub()
+    assemblies = Assemblies.keys()
+    if args.assembly:
+        assemblies = args.assembly.split(',')
+        for assembly in assemblies:
+            if assembly not in Assemblies:
+                raise Exception("unknown assembly " + assembly)
+
+    try:
+        build(args, releases, assemblies)
+    except:
+        # nothing of a failed build is kept, staged or not
+        printt("build failed; discarding", BaseWwwDir)
+        releases.discard(RunID)
+        shutil.rmtree(BaseWwwTmpDir, ignore_errors=True)
+        raise
+
+    printt("run", RunID, "staged in", BaseWwwDir)
+    if args.publish:
+        releases.publish(RunID)
+        shutil.rmtree(BaseWwwTmpDir, ignore_errors=True)
+
+    if args.profile:
+        fnp = profileFnp()
+        Profile.save(fnp, runID=RunID, assemblies=assemblies, j=args.j,
+                     wall=time.time() - start)
+        printt("wrote profile", fnp)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,41 @@
+from __future__ import print_function
+
+import os
+from collections import OrderedDict
+
+ListsDir = os.path.join(os.path.dirname(__file__), '../lists')
+
+# everything that differs between assemblies; adding one (e.g. GRCh38) should
+#  only need a new entry here plus its files under lists/
+Assemblies = OrderedDict()
+
+Assemblies["hg19"] = {
+    "defaultPos": "chr12:121374959-121481905",
+    # appended to TrackhubDbByAssayByBiosampleType.expsByAssay
+    "extraAssays": [("RAMPAGE", "rampage",
+                     "RAMPAGE", True,
+                     "rampage_useful")],
+    "generalCres": [("5group", "ENCFF658MYW"),
+                    ("9state-H3K4me3", "ENCFF706MWD"),
+                    ("9state-H3K27ac", "ENCFF656QBL"),
+                    ("9state-CTCF", "ENCFF106AGR")],
+    "globalData": os.path.join(ListsDir, "globalData.hg19.json"),
+    "cellTypeToTissue": os.path.join(ListsDir, "cellTypeToTissue.hg19.json"),
+    "tissueAliases": {}
+}
+
+Assemblies["mm10"] = {
+    "defaultPos": "chr2:163423234-163655010",
+    "extraAssays": [("ATAC-seq", "atac_seq",
+                     "ATAC-seq", True,
+                     "atac_seq_useful")],
+    "generalCres": [("5group", "ENCFF318XQA"),
+                    ("9state-H3K4me3", "ENCFF549SJX"),
+                    ("9state-H3K27ac", "ENCFF776IAR"),
+                    ("9state-CTCF", "ENCFF506YHI")],
+    "globalData": os.path.join(ListsDir, "globalData.mm10.json"),
+    "cellTypeToTissue": os.path.join(ListsDir, "cellTypeToTissue.mm10.json"),
+    "tissueAliases": {"small intestine": "intestine",
+                      "large intestine": "intestine",
+                      "bone element": "bone"}
+}
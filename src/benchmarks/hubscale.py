@@ -0,0 +1,157 @@
+#!/usr/bin/env python2
+
+from __future__ import print_function
+
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import importlib
+import subprocess
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from assemblies import Assemblies
+from synthetic import SyntheticMetadataWS, scaleGlobalData
+
+# builds the hub from synthetic experiments at several multiples of today's
+#  volume, one view at a time and all together, entirely offline; every build
+#  runs in its own process with its own output root so peak RSS and bytes
+#  written are its alone
+
+Views = ["ccREs", "organSlim", "factor", "assay", "biosample"]
+RunID = "hubscale"
+
+def buildArgs(hub, views, j):
+    # the build's own parser, so every option it grows has its default here
+    argv = ["-j", str(j), "--no-cache", "--ws-cache", "off"]
+    for view in Views:
+        argv.append(("--" if view in views else "--no-") + view)
+    return hub.parse_args(argv)
+
+def runOne(args):
+    # child: paths.py has already picked up TRACKHUB_OUTPUT_ROOT from the env
+    hub = importlib.import_module("01_make_big_trackhubs")
+    from helpers.priority import PriorityPlanner
+
+    with open(Assemblies[args.assembly]["globalData"]) as f:
+        globalData = scaleGlobalData(json.load(f), args.scale)
+    mw = SyntheticMetadataWS(args.assembly, args.scale)
+    views = Views if "all" == args.one else [args.one]
+
+    start = time.time()
+    tdb = hub.MegaTrackHub(buildArgs(hub, views, args.j), args.assembly, globalData,
+                           PriorityPlanner(), mw)
+    tdb.run()
+    wall = time.time() - start
+
+    # ru_maxrss is in KB on Linux; the workers are reaped once run() returns
+    with open(args.result, 'w') as f:
+        json.dump({"wall": wall - mw.genSecs,
+                   "genSecs": mw.genSecs,
+                   "exps": mw.numExps(),
+                   "rssMain": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   "rssWorkers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss},
+                  f)
+
+def measureOutput(outputRoot, assembly):
+    numBytes = 0
+    for d in ["www-releases", "www-tmp"]:
+        for root, dirs, files in os.walk(os.path.join(outputRoot, d)):
+            for fn in files:
+                numBytes += os.path.getsize(os.path.join(root, fn))
+
+    stanzas = 0
+    fnp = os.path.join(outputRoot, "www-releases", ".staging", RunID, assembly, "trackDb.txt")
+    with open(fnp) as f:
+        for line in f:
+            if line.lstrip().startswith("track "):
+                stanzas += 1
+    return numBytes, stanzas
+
+def runScenario(args, scale, view):
+    outputRoot = tempfile.mkdtemp(prefix="hubscale-", dir=args.tmpdir)
+    env = dict(os.environ)
+    env["TRACKHUB_OUTPUT_ROOT"] = outputRoot
+    env["TRACKHUB_RUN_ID"] = RunID
+    resultFnp = os.path.join(outputRoot, "result.json")
+    logFnp = os.path.join(outputRoot, "build.log")
+    cmd = [sys.executable, os.path.abspath(__file__),
+           "--assembly", args.assembly, "-j", str(args.j),
+           "--one", view, "--scale", str(scale), "--result", resultFnp]
+    try:
+        with open(logFnp, 'w') as log:
+            ret = subprocess.call(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+        if ret:
+            with open(logFnp) as log:
+                sys.stderr.write(''.join(log.readlines()[-20:]))
+            raise Exception("build failed for %s at %dx (see above)" % (view, scale))
+        with open(resultFnp) as f:
+            result = json.load(f)
+        result["bytes"], result["stanzas"] = measureOutput(outputRoot, args.assembly)
+    finally:
+        if args.keep:
+            print("kept", outputRoot)
+        else:
+            shutil.rmtree(outputRoot, ignore_errors=True)
+    result.update({"scale": scale, "view": view,
+                   "stanzasPerSec": result["stanzas"] / max(result["wall"], 1e-9)})
+    return result
+
+def printRow(r):
+    print("%5sx %-10s %8d %9.2f %8.2f %9.1f %9.1f %9d %11.0f %10.1f" %
+          (r["scale"], r["view"], r["exps"], r["wall"], r["genSecs"],
+           r["rssMain"] / 1024.0, r["rssWorkers"] / 1024.0, r["stanzas"],
+           r["stanzasPerSec"], r["bytes"] / 1024.0 / 1024.0))
+    sys.stdout.flush()
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-j', type=int, default=4)
+    parser.add_argument("--assembly", type=str, default="hg19")
+    parser.add_argument("--scales", type=str, default="1,10,100",
+                        help="comma-separated multiples of today's volume")
+    parser.add_argument("--views", type=str, default=','.join(Views + ["all"]),
+                        help="comma-separated; 'all' builds every view together")
+    parser.add_argument("--tmpdir", type=str, default=None,
+                        help="where each build's output root is created")
+    parser.add_argument("--json", type=str, default="",
+                        help="also write the results here")
+    parser.add_argument('--keep', action='store_true', default=False,
+                        help="keep each build's output")
+
+    # internal: build a single scenario in this process
+    parser.add_argument("--one", type=str, default="", help=argparse.SUPPRESS)
+    parser.add_argument("--scale", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--result", type=str, default="", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.one:
+        return runOne(args)
+
+    views = args.views.split(',')
+    for view in views:
+        if view not in Views + ["all"]:
+            raise Exception("unknown view " + view)
+
+    print("%6s %-10s %8s %9s %8s %9s %9s %9s %11s %10s" %
+          ("scale", "view", "exps", "wall(s)", "synth(s)", "rss(MB)", "wrk(MB)",
+           "stanzas", "stanzas/s", "out(MB)"))
+    results = []
+    for scale in [int(s) for s in args.scales.split(',')]:
+        for view in views:
+            r = runScenario(args, scale, view)
+            printRow(r)
+            results.append(r)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python2
+
+from __future__ import print_function
+
+import sys
+import os
+import gc
+import json
+import time
+import argparse
+import platform
+from collections import OrderedDict, defaultdict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import helpers.helpers as Helpers
+from helpers.tracks import Parent, BigWigTrack, BigBedTrack, ccRETrack, Tracks
+from helpers.selection import FileSelector
+from assemblies import Assemblies
+from byCcREs import MockExp
+from synthetic import SyntheticMetadataWS, Collections
+
+# time per call and allocations per call of the functions every composite
+#  leans on, run over synthetic experiments so the inputs never change;
+#  compare against baselines/micro.json before and after a hot-path change.
+#  Times are taken cold, with the normalization memos cleared before every
+#  pass, and warm, with them filled: the memos would otherwise hide the
+#  functions they front
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BaselineFnp = os.path.join(os.path.dirname(__file__), "baselines", "micro.json")
+
+def sampleExps(assembly, n):
+    # the first n of every collection, so each kind of experiment is in there
+    mw = SyntheticMetadataWS(assembly, 1)
+    exps = []
+    for name in Collections:
+        exps += getattr(mw, name)()[:n]
+    return exps
+
+def sampleCcREExps(assembly, n):
+    # ccRE tracks hang off the ccRE view's own exps, built from globalData
+    with open(Assemblies[assembly]["globalData"]) as f:
+        globalData = json.load(f)
+    byCellType = globalData["byCellType"]
+    creBigBeds = globalData["creBigBedsByCellType"]
+    ret = []
+    for ctn in sorted(byCellType)[:n]:
+        for stateType, accession in sorted(creBigBeds.get(ctn, {}).iteritems()):
+            ret.append((MockExp(byCellType[ctn][0], assembly), stateType, accession))
+    return ret
+
+def makeCases(assembly, exps, ccREs):
+    # name -> (calls per pass, one pass)
+    selector = FileSelector(assembly)
+    picks = [(e, selector.bigWigs(e), selector.bigBeds(e)) for e in exps]
+    bigWigs = [(e, f) for e, bws, bbs in picks for f in bws]
+    bigBeds = [(e, f) for e, bws, bbs in picks for f in bbs]
+    parent = Parent("bench_parent", False)
+
+    labels = [e.biosample_summary for e in exps] + [e.biosample_term_name for e in exps]
+    groups = [{"donor": e.donor_id,
+               "assay": e.assay_term_name,
+               "label": e.tf,
+               "biosample": e.biosample_term_name,
+               "biosample_summary": e.biosample_summary,
+               "age": e.age_display,
+               "view": "bigWig"} for e in exps]
+
+    tracks = Tracks(assembly, parent, False)
+    for e in exps:
+        tracks.addExp(e, False, {})
+
+    def bigWigFilters():
+        for e in exps:
+            Helpers.bigWigFilters(assembly, e)
+
+    def bigBedFilters():
+        for e in exps:
+            Helpers.bigBedFilters(assembly, e)
+
+    def sanitize():
+        for s in labels:
+            Helpers.sanitize(s)
+
+    def unrollEquals():
+        for d in groups:
+            Helpers.unrollEquals(d)
+
+    def html_escape():
+        for s in labels:
+            Helpers.html_escape(s)
+
+    def bigWigTrack():
+        subGroups = defaultdict(set)
+        return [BigWigTrack(assembly, e, f, parent, False, subGroups) for e, f in bigWigs]
+
+    def bigBedTrack():
+        subGroups = defaultdict(set)
+        return [BigBedTrack(assembly, e, f, parent, False, subGroups) for e, f in bigBeds]
+
+    def ccRETrackF():
+        subGroups = defaultdict(set)
+        return [ccRETrack(assembly, e, stateType, accession, parent, False, subGroups)
+                for e, stateType, accession in ccREs]
+
+    def tracksAddExp():
+        t = Tracks(assembly, parent, False)
+        for e in exps:
+            t.addExp(e, False, {})
+        return t
+
+    def tracksRender():
+        return tracks.render()
+
+    def tracksSubgroups():
+        return tracks.subgroups()
+
+    return OrderedDict([("bigWigFilters", (len(exps), bigWigFilters)),
+                        ("bigBedFilters", (len(exps), bigBedFilters)),
+                        ("sanitize", (len(labels), sanitize)),
+                        ("unrollEquals", (len(groups), unrollEquals)),
+                        ("html_escape", (len(labels), html_escape)),
+                        ("BigWigTrack", (len(bigWigs), bigWigTrack)),
+                        ("BigBedTrack", (len(bigBeds), bigBedTrack)),
+                        ("ccRETrack", (len(ccREs), ccRETrackF)),
+                        ("Tracks.addExp", (len(exps), tracksAddExp)),
+                        ("Tracks.render", (1, tracksRender)),
+                        ("Tracks.subgroups", (1, tracksSubgroups))])
+
+def timePerCall(calls, f, passes, repeat=5, cold=False):
+    # best of repeat, with gc off like timeit; cold clears the memos before
+    #  each pass, outside the timed part
+    best = None
+    gc.disable()
+    try:
+        for r in xrange(repeat):
+            t = 0
+            for i in xrange(passes):
+                if cold:
+                    Helpers.clearMemos()
+                start = time.time()
+                f()
+                t += time.time() - start
+            if best is None or t < best:
+                best = t
+    finally:
+        gc.enable()
+    return best / (calls * passes) * 1e6
+
+def allocsPerCall(calls, f):
+    # blocks and bytes still held after one pass (its results plus whatever
+    #  memo it filled) and the pass's peak; without tracemalloc (python 2)
+    #  only new gc-tracked objects can be counted
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        ret = f()
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        diff = after.compare_to(before, 'filename')
+        blocks = sum(s.count_diff for s in diff)
+        size = sum(s.size_diff for s in diff)
+        return float(blocks) / calls, float(size) / calls, peak
+    before = len(gc.get_objects())
+    ret = f()
+    blocks = len(gc.get_objects()) - before
+    return float(blocks) / calls, None, None
+
+def run(args):
+    exps = sampleExps(args.assembly, args.exps)
+    cases = makeCases(args.assembly, exps, sampleCcREExps(args.assembly, args.exps))
+    results = OrderedDict()
+    for name, (calls, f) in cases.iteritems():
+        if args.only and name not in args.only.split(','):
+            continue
+        # allocations first, from cold memos, so they are what a build sees
+        Helpers.clearMemos()
+        blocks, size, peak = allocsPerCall(calls, f)
+        results[name] = {"calls": calls,
+                         "usPerCallCold": timePerCall(calls, f, args.n, cold=True),
+                         "usPerCall": timePerCall(calls, f, args.n),
+                         "blocksPerCall": blocks,
+                         "bytesPerCall": size,
+                         "peakBytes": peak}
+    return results
+
+def fmt(v, spec):
+    if v is None:
+        return "n/a"
+    return spec % v
+
+def ratio(r, baseline, name, k):
+    if name not in baseline or k not in baseline[name]:
+        return None
+    return r[k] / baseline[name][k]
+
+def report(results, baseline):
+    print("allocations:", "tracemalloc" if tracemalloc else "new gc objects (no tracemalloc)")
+    print("%-18s %7s %10s %8s %10s %8s %10s %12s %12s" %
+          ("", "calls", "cold us", "vs base", "warm us", "vs base", "blocks", "bytes", "peak"))
+    for name, r in results.iteritems():
+        print("%-18s %7d %10.2f %8s %10.2f %8s %10s %12s %12s" %
+              (name, r["calls"],
+               r["usPerCallCold"], fmt(ratio(r, baseline, name, "usPerCallCold"), "%.2fx"),
+               r["usPerCall"], fmt(ratio(r, baseline, name, "usPerCall"), "%.2fx"),
+               fmt(r["blocksPerCall"], "%.1f"), fmt(r["bytesPerCall"], "%.0f"),
+               fmt(r["peakBytes"], "%d")))
+
+def loadBaseline(fnp):
+    if not os.path.exists(fnp):
+        return {}
+    with open(fnp) as f:
+        return json.load(f)["results"]
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assembly", type=str, default="hg19")
+    parser.add_argument("--exps", type=int, default=50,
+                        help="synthetic experiments taken from each collection")
+    parser.add_argument('-n', type=int, default=20, help="timed passes per repeat")
+    parser.add_argument("--only", type=str, default="",
+                        help="comma-separated benchmark names")
+    parser.add_argument("--baseline", type=str, default=BaselineFnp)
+    parser.add_argument('--save', action='store_true', default=False,
+                        help="store these results as the new baseline")
+    parser.add_argument("--max-slowdown", dest="maxSlowdown", type=float, default=0,
+                        help="exit non-zero if any call is this many times slower than its baseline")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    baseline = loadBaseline(args.baseline)
+    results = run(args)
+    report(results, baseline)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({"python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "exps": args.exps,
+                       "results": results}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print("wrote", args.baseline)
+
+    if args.maxSlowdown:
+        slower = [name for name, r in results.iteritems()
+                  if any(ratio(r, baseline, name, k) > args.maxSlowdown
+                         for k in ("usPerCallCold", "usPerCall"))]
+        if slower:
+            print("slower than baseline:", ', '.join(slower))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python2
+
+from __future__ import print_function
+
+import sys
+import os
+import re
+import json
+import timeit
+import argparse
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import helpers.helpers as Helpers
+from assemblies import Assemblies
+
+# the helpers as they were before precompiled patterns and memoization
+def sanitize(s, replChar='_'):
+    return re.sub('[^0-9a-zA-Z]+', replChar, s)
+
+def unrollEquals(sUnsorted):
+    r = ''
+    s = OrderedDict(sorted(sUnsorted.items()))
+    for k, v in s.iteritems():
+        nk = k.replace(' ', '_')
+        nk = re.sub('[^0-9a-zA-Z_\-&#;]+', '', nk) # drop everything but alphanum and _-
+
+        nv = v.replace(' ', '_')
+        nv = re.sub('[^0-9a-zA-Z_\-&#;]+', '', nv) # drop everything but alphanum and _-
+
+        r += nk + '=' + nv + ' '
+    return r
+
+def html_escape(text):
+    return "".join(Helpers.html_escape_table.get(c,c) for c in text)
+
+def loadInfos(assembly):
+    with open(Assemblies[assembly]["globalData"]) as f:
+        globalData = json.load(f)
+    infos = []
+    for ct, assays in globalData["byCellType"].iteritems():
+        infos += assays
+    return infos
+
+def normalizeAll(infos, sanitizeF, unrollEqualsF, htmlEscapeF):
+    # roughly what BigWigTrack._subgroups/_metadata/_desc do per track
+    out = []
+    for info in infos:
+        summary = Helpers.getOrUnknown(info.get("biosample_summary"))
+        biosample = Helpers.getOrUnknown(info.get("cellTypeDesc"))
+        s = {"donor": "unknown",
+             "assay": Helpers.getOrUnknown(info.get("assay")),
+             "biosample": biosample,
+             "biosample_summary": summary,
+             "age": 'a' + sanitizeF(Helpers.getOrUnknown(info.get("tissue"))),
+             "view": "bigWig"}
+        out.append(unrollEqualsF(s))
+        out.append(unrollEqualsF({"description": sanitizeF(summary),
+                                  "accession": Helpers.getOrUnknown(info.get("expID")),
+                                  "view": "bigWig"}))
+        out.append(sanitizeF(summary.strip(), ' '))
+        out.append(htmlEscapeF(biosample))
+    return out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--assembly", type=str, default="hg19")
+    parser.add_argument('-n', type=int, default=5, help="timed passes over all infos")
+    args = parser.parse_args()
+
+    infos = loadInfos(args.assembly)
+
+    before = normalizeAll(infos, sanitize, unrollEquals, html_escape)
+    after = normalizeAll(infos, Helpers.sanitize, Helpers.unrollEquals, Helpers.html_escape)
+    if before != after:
+        raise Exception("normalization output changed")
+
+    tBefore = min(timeit.repeat(lambda: normalizeAll(infos, sanitize, unrollEquals, html_escape),
+                                number=args.n, repeat=3))
+    tAfter = min(timeit.repeat(lambda: normalizeAll(infos, Helpers.sanitize,
+                                                    Helpers.unrollEquals, Helpers.html_escape),
+                               number=args.n, repeat=3))
+    print("%d infos x %d passes" % (len(infos), args.n))
+    print("before: %.3fs" % tBefore)
+    print("after:  %.3fs" % tAfter)
+    print("speedup: %.1fx" % (tBefore / tAfter))
+
+if __name__ == '__main__':
+    main()
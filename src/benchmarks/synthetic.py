@@ -0,0 +1,320 @@
+from __future__ import print_function
+
+import sys
+import os
+import json
+import time
+import random
+import string
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from assemblies import Assemblies
+
+# Experiments and files shaped like what MetadataWS hands the builders, made
+#  up on the spot so the hub can be built at any volume without the network.
+#  Volume 1 is roughly hg19 as the hub is built today; everything else
+#  (biosamples, factors, globalData cell types) grows with it.
+
+# MetadataWS collection -> (experiments at volume 1, kind)
+Collections = OrderedDict([("dnases_useful", (700, "dnase")),
+                           ("chipseq_histones_useful", (1400, "histone")),
+                           ("transcription_useful", (600, "rna")),
+                           ("microRNAseq_useful", (120, "mirna")),
+                           ("chipseq_tfs_useful", (1500, "tf")),
+                           ("rampage_useful", (150, "rampage")),
+                           ("atac_seq_useful", (100, "atac"))])
+
+Assays = {"dnase": ("DNase-seq", "DNase-seq"),
+          "histone": ("ChIP-seq", "Histone ChIP-seq"),
+          "rna": ("RNA-seq", "total RNA-seq"),
+          "mirna": ("microRNA-seq", "microRNA-seq"),
+          "tf": ("ChIP-seq", "TF ChIP-seq"),
+          "rampage": ("RAMPAGE", "RAMPAGE"),
+          "atac": ("ATAC-seq", "ATAC-seq")}
+
+RnaLike = ["rna", "mirna", "rampage"]
+
+BiosampleTypes = ["cell line", "tissue", "primary cell",
+                  "in vitro differentiated cells", "induced pluripotent stem cell line"]
+
+HistoneMarks = ["H3K4me3", "H3K27ac", "H3K4me1", "H3K36me3", "H3K27me3",
+                "H3K9me3", "H2AFZ", "H3K79me2", "H3K9ac", "H4K20me1", "H3K4me2"]
+
+Factors = ["CTCF", "POLR2A", "EP300", "RAD21", "YY1", "MAX", "REST", "TAF1",
+           "ZNF143", "EZH2", "JUND", "FOS", "GABPA", "USF1", "SRF", "ELF1"]
+NumFactors = 160
+
+OrganSlims = ["liver", "blood", "brain", "skin of body", "lung", "heart",
+              "kidney", "intestine", "bone element", "muscle organ", "stomach"]
+
+Ages = ["", "unknown", "32 years", "54 years", "8 weeks", "76 days"]
+Sexes = ["", "male", "female", "mixed"]
+
+def accession(prefix, n):
+    # ENCSR123ABC-style, unique for the first 17.5M numbers
+    letters = ""
+    m = n // 1000
+    for i in xrange(3):
+        letters = string.ascii_uppercase[m % 26] + letters
+        m //= 26
+    return "%s%03d%s" % (prefix, n % 1000, letters)
+
+class File(object):
+    def __init__(self, exp, fileID, assembly, file_type, output_type,
+                 bio_rep, tech_rep, isPooled=False, genome_annotation="",
+                 submitted_file_name="", status="released"):
+        self.expID = exp.encodeID
+        self.fileID = fileID
+        self.assembly = assembly
+        self.file_type = file_type
+        self.output_type = output_type
+        self.bio_rep = bio_rep
+        self.tech_rep = tech_rep
+        self.isPooled = isPooled
+        self.genome_annotation = genome_annotation
+        self.submitted_file_name = submitted_file_name
+        self.status = status
+        ext = "bigWig" if "bigWig" == file_type else file_type.split()[0]
+        self.url = "https://www.encodeproject.org/files/{fileID}/@@download/{fileID}.{ext}".format(
+            fileID=fileID, ext=ext)
+
+    def isBigWig(self):
+        return "bigWig" == self.file_type
+
+    def isBigBed(self):
+        return self.file_type.startswith("bigBed")
+
+    def isBigBedNarrowPeak(self):
+        return "bigBed narrowPeak" == self.file_type
+
+    def isBigBedBroadPeak(self):
+        return "bigBed broadPeak" == self.file_type
+
+    def isReleased(self):
+        return "released" == self.status
+
+    def isRawSignal(self):
+        return "raw signal" == self.output_type
+
+    def isSignal(self):
+        return "signal" in self.output_type
+
+    def isReplicatedPeaks(self):
+        return "replicated peaks" == self.output_type
+
+    def isIDRoptimal(self):
+        return "optimal idr thresholded peaks" == self.output_type
+
+    def isIDR(self):
+        return "idr thresholded peaks" in self.output_type
+
+    def isPeaks(self):
+        return "peaks" in self.output_type
+
+    def __repr__(self):
+        return self.fileID
+
+class Exp(object):
+    def __init__(self, encodeID, kind, biosample_type, biosample_term_name,
+                 target, organ_slims, age_display, donor_sex, donor_id):
+        self.encodeID = encodeID
+        self.kind = kind
+        self.assay_term_name, self.assay_title = Assays[kind]
+        self.tf = target
+        self.label = target
+        self.target = target
+        self.biosample_type = biosample_type
+        self.biosample_term_name = biosample_term_name
+        self.biosample_summary = ' '.join([biosample_term_name, donor_sex, age_display]).strip()
+        self.description = ""
+        self.organ_slims = organ_slims
+        self.age_display = age_display
+        self.donor_sex = donor_sex
+        self.donor_id = donor_id
+        self.files = []
+
+    def isRnaSeqLike(self):
+        return self.kind in RnaLike
+
+    def isDNaseSeq(self):
+        return "dnase" == self.kind
+
+    def isChipSeq(self):
+        return self.kind in ("histone", "tf")
+
+    def isChipSeqTF(self):
+        return "tf" == self.kind
+
+    def isChipSeqHistoneMark(self):
+        return "histone" == self.kind
+
+    def __repr__(self):
+        return self.encodeID
+
+class SyntheticMetadataWS(object):
+    """MetadataWS stand-in serving made-up experiments at `scale` times today's volume.
+
+    Collections are generated the first time they are asked for, from a seed
+    per (assembly, collection), so every run and every view sees the same
+    experiments. `genSecs` is how long generating them took.
+    """
+    def __init__(self, assembly, scale, seed=0):
+        self.assembly = assembly
+        self.scale = scale
+        self.seed = seed
+        self.collections = {}
+        self.byAccession = {}
+        self.genSecs = 0
+
+        with open(Assemblies[assembly]["cellTypeToTissue"]) as f:
+            names = sorted(set(n.encode("ascii", "ignore") for n in json.load(f)))
+        self.biosamples = []
+        for copy in xrange(scale):
+            for name in names:
+                self.biosamples.append(name if not copy else "%s %d" % (name, copy))
+        self.factors = Factors + ["ZNF%d" % i
+                                  for i in xrange(NumFactors * scale - len(Factors))]
+        self.donors = [accession("ENCDO", i) for i in xrange(200 * scale)]
+
+    def _collection(self, name):
+        if name not in self.collections:
+            start = time.time()
+            self.collections[name] = self._generate(name)
+            for exp in self.collections[name]:
+                self.byAccession[exp.encodeID] = exp
+            self.genSecs += time.time() - start
+        return list(self.collections[name])
+
+    def _generate(self, name):
+        count, kind = Collections[name]
+        r = random.Random("%s-%s-%d" % (self.assembly, name, self.seed))
+        offset = Collections.keys().index(name) * 10 ** 6
+        exps = []
+        for i in xrange(count * self.scale):
+            n = offset + i
+            if "histone" == kind:
+                target = r.choice(HistoneMarks)
+            elif "tf" == kind:
+                target = r.choice(self.factors)
+            else:
+                target = ""
+            exp = Exp(accession("ENCSR", n), kind,
+                      r.choice(BiosampleTypes), r.choice(self.biosamples), target,
+                      r.sample(OrganSlims, r.randint(0, 2)),
+                      r.choice(Ages), r.choice(Sexes), r.choice(self.donors))
+            exp.files = self._files(r, exp, n)
+            exps.append(exp)
+        return exps
+
+    def _files(self, r, exp, n):
+        # per replicate: alignments, a signal and peaks; pooled/replicated
+        #  outputs on top, plus the odd file on another assembly or revoked
+        files = []
+        def add(*args, **kwargs):
+            fileID = accession("ENCFF", n * 64 + len(files))
+            files.append(File(exp, fileID, *args, **kwargs))
+
+        rna = exp.isRnaSeqLike()
+        numReps = r.randint(1, 2)
+        for rep in xrange(1, numReps + 1):
+            bio_rep = [rep]
+            tech_rep = ["%d_1" % rep]
+            add(self.assembly, "bam", "alignments", bio_rep, tech_rep)
+            if rna:
+                for strand in ["plus", "minus"]:
+                    for aligner in ["star", "tophat"][:r.randint(1, 2)]:
+                        add(self.assembly, "bigWig",
+                            "%s strand signal of unique reads" % strand,
+                            bio_rep, tech_rep, genome_annotation="V19",
+                            submitted_file_name="rep%d.%s.%s.bw" % (rep, aligner, strand))
+                continue
+            add(self.assembly, "bigWig", "signal of unique reads", bio_rep, tech_rep)
+            if exp.isChipSeq():
+                add(self.assembly, "bigWig", "fold change over control", bio_rep, tech_rep)
+                add(self.assembly, "bigWig", "signal p-value", bio_rep, tech_rep)
+            add(self.assembly, "bigBed narrowPeak", "peaks", bio_rep, tech_rep)
+
+        if exp.isChipSeq():
+            reps = range(1, numReps + 1)
+            add(self.assembly, "bigWig", "fold change over control", reps, [],
+                isPooled=True)
+            if exp.isChipSeqTF():
+                add(self.assembly, "bigBed narrowPeak", "optimal idr thresholded peaks",
+                    reps, [])
+                add(self.assembly, "bigBed narrowPeak", "conservative idr thresholded peaks",
+                    reps, [])
+            else:
+                add(self.assembly, "bigBed narrowPeak", "replicated peaks", reps, [])
+
+        if r.random() < 0.2:
+            add("GRCh38", "bigWig", "signal of unique reads", [1], ["1_1"])
+        if r.random() < 0.05:
+            add(self.assembly, "bigWig", "signal of unique reads", [1], ["1_1"],
+                status="revoked")
+        return files
+
+    def numExps(self):
+        return len(self.byAccession)
+
+    def dnases_useful(self):
+        return self._collection("dnases_useful")
+
+    def chipseq_histones_useful(self):
+        return self._collection("chipseq_histones_useful")
+
+    def transcription_useful(self):
+        return self._collection("transcription_useful")
+
+    def microRNAseq_useful(self):
+        return self._collection("microRNAseq_useful")
+
+    def chipseq_tfs_useful(self):
+        return self._collection("chipseq_tfs_useful")
+
+    def rampage_useful(self):
+        return self._collection("rampage_useful")
+
+    def atac_seq_useful(self):
+        return self._collection("atac_seq_useful")
+
+    def encodeByBiosampleTypeCustom(self, assembly):
+        byBiosample = OrderedDict()
+        for name in Collections:
+            for exp in self._collection(name):
+                k = (exp.biosample_type, exp.biosample_term_name)
+                byBiosample.setdefault(k, []).append(exp.encodeID)
+        return [[{"biosample_type": bt,
+                  "biosample_term_name": btn,
+                  "expIDs": expIDs}]
+                for (bt, btn), expIDs in sorted(byBiosample.iteritems())]
+
+    def exps(self, expIDs):
+        return [self.byAccession[expID] for expID in expIDs if expID in self.byAccession]
+
+def scaleGlobalData(globalData, scale):
+    # the per-cell-type experiments and ccREs the ccRE and biosample views
+    #  read, repeated under new cell type names and accessions
+    byCellType = globalData["byCellType"]
+    creBigBeds = globalData["creBigBedsByCellType"]
+    ret = dict(globalData)
+    ret["byCellType"] = {}
+    ret["creBigBedsByCellType"] = {}
+    n = 0
+    for copy in xrange(scale):
+        for ctn in sorted(byCellType):
+            newCtn = ctn if not copy else "%s_%d" % (ctn, copy)
+            infos = []
+            for info in byCellType[ctn]:
+                info = dict(info)
+                if copy:
+                    info["expID"] = accession("ENCSR", 9 * 10 ** 6 + n)
+                    info["fileID"] = accession("ENCFF", 9 * 10 ** 6 + n)
+                    info["cellTypeName"] = newCtn
+                    info["cellTypeDesc"] = "%s %d" % (info["cellTypeDesc"], copy)
+                    n += 1
+                infos.append(info)
+            ret["byCellType"][newCtn] = infos
+            if ctn in creBigBeds:
+                ret["creBigBedsByCellType"][newCtn] = creBigBeds[ctn]
+    return ret
@@ -0,0 +1,287 @@
+#!/usr/bin/env python2
+
+from __future__ import print_function
+
+import sys
+import os
+import json
+import time
+import random
+import re
+import socket
+import hashlib
+import urllib2
+import argparse
+import threading
+import BaseHTTPServer
+import SocketServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import helpers.helpers as Helpers
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils
+
+# A local stand-in for the metadata web service. "capture" sits between the
+#  builders and the real service and snapshots every response into a
+#  fixtures directory; "serve" answers from those fixtures alone, with
+#  optional latency, jitter and failures, so fetching can be exercised
+#  without the network. Point a build at it with
+#
+#    TRACKHUB_METADATA_HOST=http://localhost:9008/ ./01_make_big_trackhubs.py ...
+#
+#  It knows nothing about MetadataWS itself: a request is keyed by method,
+#  path, query and body, so whatever endpoints MetadataWS calls are covered.
+#
+#  With --files, "serve" also stands in for the portal's file downloads,
+#  for checking bigDataUrls (TRACKHUB_FILES_HOST=http://localhost:9008/
+#  with --check-urls): /files/<accession>/@@download/<name> redirects to a
+#  signed /s3/ url which answers range requests with a made-up size, and
+#  --dead-files of the accessions are gone.
+
+def fixtureKey(method, path, body):
+    h = hashlib.sha1()
+    h.update(method + ' ' + path + '\n')
+    h.update(body or '')
+    return h.hexdigest()
+
+class Fixtures(object):
+    def __init__(self, fixturesDir):
+        self.fixturesDir = fixturesDir
+
+    def _fnps(self, key):
+        base = os.path.join(self.fixturesDir, key[:2], key)
+        return base + ".json", base + ".body"
+
+    def load(self, method, path, body):
+        metaFnp, bodyFnp = self._fnps(fixtureKey(method, path, body))
+        if not os.path.exists(metaFnp):
+            return None
+        with open(metaFnp) as f:
+            meta = json.load(f)
+        with open(bodyFnp, 'rb') as f:
+            return meta, f.read()
+
+    def save(self, method, path, body, status, headers, data):
+        metaFnp, bodyFnp = self._fnps(fixtureKey(method, path, body))
+        Utils.ensureDir(metaFnp)
+        # body first, so a visible .json always has its body next to it
+        Helpers.atomicWrite(bodyFnp, data)
+        Helpers.atomicWrite(metaFnp, json.dumps({"method": method,
+                                                 "path": path,
+                                                 "status": status,
+                                                 "headers": headers,
+                                                 "captured": time.time()},
+                                                indent=2, sort_keys=True))
+
+FilesRe = re.compile(r'^/files/(\w+)/@@download/([^?]+)')
+S3Re = re.compile(r'^/s3/(\w+)/([^?]+)')
+
+def _fraction(s):
+    # a stable number in [0, 1) per string
+    return int(hashlib.sha1(s).hexdigest()[:8], 16) / float(16 ** 8)
+
+# response headers worth keeping; hop-by-hop and length ones are recomputed
+KeptHeaders = ["content-type", "content-encoding"]
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def do_HEAD(self):
+        self._handle()
+
+    def _body(self):
+        n = int(self.headers.getheader('content-length') or 0)
+        return self.rfile.read(n) if n else ''
+
+    def _handle(self):
+        server = self.server
+        body = self._body()
+        if "capture" == server.mode:
+            ret = self._forward(body)
+        else:
+            ret = self._replay(body)
+        if ret is None:
+            return
+        status, headers, data = ret
+        self.send_response(status)
+        for k, v in headers.iteritems():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if "HEAD" != self.command:
+            self.wfile.write(data)
+
+    def _forward(self, body):
+        server = self.server
+        url = server.upstream.rstrip('/') + self.path
+        req = urllib2.Request(url, body if "POST" == self.command else None)
+        if "HEAD" == self.command:
+            req.get_method = lambda: "HEAD"
+        ct = self.headers.getheader('content-type')
+        if ct:
+            req.add_header('Content-Type', ct)
+        try:
+            resp = urllib2.urlopen(req, timeout=server.upstreamTimeout)
+            status = resp.getcode()
+        except urllib2.HTTPError as e:
+            # errors are part of what the service does; keep them too
+            resp, status = e, e.code
+        data = resp.read()
+        headers = {k: resp.info().getheader(k) for k in KeptHeaders
+                   if resp.info().getheader(k)}
+        server.fixtures.save(self.command, self.path, body, status, headers, data)
+        server.count("captured")
+        return status, headers, data
+
+    def _replay(self, body):
+        server = self.server
+        delay = server.delay()
+        if delay:
+            time.sleep(delay)
+
+        failure = server.failure()
+        if "drop" == failure:
+            # as if the service died mid-request
+            server.count("dropped")
+            self.close_connection = 1
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return None
+        if failure:
+            server.count("failed")
+            return failure, {"Content-Type": "text/plain"}, "injected failure\n"
+
+        if server.files:
+            ret = self._file()
+            if ret:
+                return ret
+
+        stored = server.fixtures.load(self.command, self.path, body)
+        if stored is None:
+            server.count("missing")
+            return 404, {"Content-Type": "text/plain"}, "no fixture for %s %s\n" % (
+                self.command, self.path)
+        meta, data = stored
+        server.count("served")
+        return meta["status"], meta["headers"], data
+
+    def _file(self):
+        server = self.server
+        m = FilesRe.match(self.path)
+        if m:
+            accession, name = m.groups()
+            if _fraction(accession) < server.deadFiles:
+                server.count("dead files")
+                return 404, {"Content-Type": "text/plain"}, "gone\n"
+            server.count("file redirects")
+            location = "/s3/%s/%s?Signature=%s" % (accession, name, accession.lower())
+            return 307, {"Location": location}, ""
+        m = S3Re.match(self.path)
+        if not m:
+            return None
+        size = 1024 + int(_fraction(m.group(1)) * 10 ** 9)
+        rng = re.match(r'bytes=(\d+)-(\d*)$', self.headers.getheader('range') or '')
+        server.count("file reads")
+        if not rng:
+            # the whole file would be far too much; a body of zeros up to 64KB
+            return 200, {"Content-Type": "application/octet-stream"}, '\0' * min(size, 65536)
+        start = int(rng.group(1))
+        end = min(size - 1, int(rng.group(2) or size - 1), start + 65535)
+        return 206, {"Content-Type": "application/octet-stream",
+                     "Accept-Ranges": "bytes",
+                     "Content-Range": "bytes %d-%d/%d" % (start, end, size)}, '\0' * (end - start + 1)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, args):
+        BaseHTTPServer.HTTPServer.__init__(self, (args.bind, args.port), Handler)
+        self.mode = args.mode
+        self.fixtures = Fixtures(args.fixtures)
+        self.upstream = args.upstream
+        self.upstreamTimeout = args.timeout
+        self.latency = args.latency / 1000.0
+        self.jitter = args.jitter / 1000.0
+        self.failRate = args.failRate
+        self.failMode = args.failMode
+        self.files = args.files
+        self.deadFiles = args.deadFiles
+        self.verbose = args.verbose
+        self.random = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def delay(self):
+        with self.lock:
+            return max(0.0, self.random.gauss(self.latency, self.jitter))
+
+    def failure(self):
+        # None, "drop" or an HTTP status to answer with
+        with self.lock:
+            if self.random.random() >= self.failRate:
+                return None
+        if "drop" == self.failMode:
+            return "drop"
+        return int(self.failMode)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["serve", "capture"])
+    parser.add_argument("--fixtures", type=str,
+                        default=os.path.join(os.path.dirname(__file__), '../../ws-fixtures'))
+    parser.add_argument("--bind", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9008)
+    parser.add_argument("--upstream", type=str, default="",
+                        help="capture: the real service, e.g. paths.Host")
+    parser.add_argument("--timeout", type=float, default=600,
+                        help="capture: seconds to wait for the real service")
+    parser.add_argument("--latency", type=float, default=0, help="serve: mean ms per request")
+    parser.add_argument("--jitter", type=float, default=0, help="serve: ms standard deviation")
+    parser.add_argument("--fail-rate", dest="failRate", type=float, default=0,
+                        help="serve: fraction of requests that fail")
+    parser.add_argument("--fail-mode", dest="failMode", type=str, default="503",
+                        help="serve: an HTTP status to answer with, or 'drop' to close the connection")
+    parser.add_argument("--files", action='store_true', default=False,
+                        help="serve: also answer bigDataUrl checks like the portal's file downloads")
+    parser.add_argument("--dead-files", dest="deadFiles", type=float, default=0,
+                        help="serve: fraction of files that are gone")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument('-v', dest='verbose', action='store_true', default=False)
+    args = parser.parse_args()
+
+    if "capture" == args.mode and not args.upstream:
+        parser.error("capture needs --upstream")
+    if "drop" != args.failMode and not args.failMode.isdigit():
+        parser.error("--fail-mode is an HTTP status or 'drop'")
+    return args
+
+def main():
+    args = parse_args()
+    server = StandInServer(args)
+    print("%s on http://%s:%d/ fixtures %s" % (args.mode, args.bind, args.port,
+                                               os.path.abspath(args.fixtures)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.counters, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -8,12 +8,12 @@ import argparse
 import requests
 from itertools import groupby
 from collections import OrderedDict, defaultdict
-from joblib import Parallel, delayed
-import StringIO
 
 from helpers.tracks import Tracks, Parent, LookupActive
+from byAll import ResetTissueColors
 import helpers.helpers as Helpers
 from paths import Host, BaseWwwDir, BaseWwwTmpDir
+from assemblies import Assemblies
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../metadata/utils'))
 from files_and_paths import Dirs
@@ -35,37 +35,32 @@ def merge_two_dicts(x, y):
     return z
 
 class TrackhubDbByAssayByBiosampleType:
-    def __init__(self, args, assembly, globalData, mw, priority):
+    def __init__(self, args, assembly, globalData, mw, registry, priority, cache):
         self.args = args
         self.assembly = assembly
         self.globalData = globalData
         self.mw = mw
+        self.registry = registry
         self.priority = priority
+        self.cache = cache
 
         self.expsByAssay= [("DNase-seq", "dnase",
                             "DNase-seq", True,
-                            self.mw.dnases_useful),
+                            "dnases_useful"),
                            ("Histone by Biosample", "histone_modifications",
                             "Histone modifications and variants", False,
-                            self.mw.chipseq_histones_useful),
+                            "chipseq_histones_useful"),
                            ("RNA-seq", "transcription",
                             "RNA-seq", True,
-                            self.mw.transcription_useful),
+                            "transcription_useful"),
                            ("microRNA-seq", "microRNAseq",
                             "microRNA-seq", True,
-                            self.mw.microRNAseq_useful),
+                            "microRNAseq_useful"),
                            ("TFs by Biosample Type", "transcription_factors",
                             "Transcription Factors", False,
-                            self.mw.chipseq_tfs_useful)
+                            "chipseq_tfs_useful")
         ]
-        if "mm10" == assembly:
-            self.expsByAssay.append(("ATAC-seq", "atac_seq",
-                                     "ATAC-seq", True,
-                                     self.mw.atac_seq_useful))
-        if "hg19" == assembly:
-            self.expsByAssay.append(("RAMPAGE", "rampage",
-                                     "RAMPAGE", True,
-                                     self.mw.rampage_useful))
+        self.expsByAssay += Assemblies[assembly]["extraAssays"]
 
 
         # assay x biosamepleType x biosamplesView
@@ -76,11 +71,10 @@ class TrackhubDbByAssayByBiosampleType:
         self.btToNormal = {}
         self.lookupByExp = {}
 
-    def run(self):
-        for title, assayAbbr, longLabelBase, showAllTrack, expsF in self.expsByAssay:
-            exps = expsF()
+    def prepare(self):
+        for title, assayAbbr, longLabelBase, showAllTrack, collection in self.expsByAssay:
+            exps = self.registry.get(collection)
             self._build(title, assayAbbr, showAllTrack, exps, longLabelBase)
-        return self._makeMainTrackDb()
 
     def _build(self, assay_term_name, atn, showAllTrack, exps, longLabelBase):
         printt("building", assay_term_name, "...")
@@ -125,10 +119,7 @@ class TrackhubDbByAssayByBiosampleType:
                 "longLabelBase": longLabelBase
             }
 
-        printt("making tracks and subtracks...")
-        self._makeSubTracks()
-
-    def _makeSubTracks(self):
+    def jobs(self):
         jobs = []
         for atn, btAndInfo in self.byAssayBiosampleType.iteritems():
             for bt, info in btAndInfo.iteritems():
@@ -136,25 +127,32 @@ class TrackhubDbByAssayByBiosampleType:
                                             {"lookupByExp": self.lookupByExp,
                                              "idx": len(jobs) + 1,
                                              "total": len(self.byAssayBiosampleType)}))
+        return jobs
 
-        Parallel(n_jobs=self.args.j)(delayed(outputAllTracksByBiosampleType)
-                                     (self.priority, job) for job in jobs)
+    def worker(self):
+        return outputAllTracksByBiosampleType
 
-    def _makeMainTrackDb(self):
-        mainTrackDb = []
+    def superTrackOf(self, job):
+        return job["atn"]
 
-        for atn, btAndInfo in self.byAssayBiosampleType.iteritems():
-            pri = self.priority.increment(1)
+    def reserveSuperTracks(self):
+        # called right after this builder's composites got their priorities
+        self.superPriorities = {}
+        for atn in self.byAssayBiosampleType:
+            self.superPriorities[atn] = self.priority.increment(1)
 
-            totalExperiments = 0
-            for bt, info in btAndInfo.iteritems():
-                if "0_all" != bt:
-                    totalExperiments += len(info["exps"])
+    def superTrack(self, atn, btAndInfo):
+        pri = self.superPriorities[atn]
+
+        totalExperiments = 0
+        for bt, info in btAndInfo.iteritems():
+            if "0_all" != bt:
+                totalExperiments += len(info["exps"])
 
-            shortLabel = self.btToNormal[atn]
-            longLabel = info["longLabelBase"] + " (%s experiments)" % totalExperiments
+        shortLabel = self.btToNormal[atn]
+        longLabel = info["longLabelBase"] + " (%s experiments)" % totalExperiments
 
-            mainTrackDb.append("""
+        return """
 track super_{atn}
 superTrack on
 priority {priority}
@@ -163,27 +161,37 @@ longLabel {longL}
 """.format(atn = atn,
            priority = pri,
            shortL=shortLabel,
-           longL=Helpers.makeLongLabel(longLabel)))
-
-        outF = StringIO.StringIO()
-        outF.write('\n'.join(mainTrackDb))
-        for atn, btAndInfo in self.byAssayBiosampleType.iteritems():
-            for bt, info in btAndInfo.iteritems():
-                with open(info["fnp"]) as f:
-                    outF.write(f.read())
-                    outF.write('\n')
-        return outF.getvalue()
+           longL=Helpers.makeLongLabel(longLabel))
 
-def outputAllTracksByBiosampleType(priority, info):
-    subGroups = outputSubTrack(priority, **info)
-    info["subGroups"] = subGroups
-    outputCompositeTrackByBiosampleType(**info)
+    def superTracks(self):
+        return '\n'.join([self.superTrack(atn, btAndInfo)
+                          for atn, btAndInfo in self.byAssayBiosampleType.iteritems()])
 
-def outputCompositeTrackByBiosampleType(assembly, assay_term_name, atn, biosample_type, bt,
-                                        exps, fnp, idx, total, subGroups, lookupByExp, longLabelBase = None):
-    if not os.path.exists(fnp):
-        raise Exception("missing " + fnp)
+    def shards(self):
+        # (super track, its stanza, its composite files), in trackDb order
+        for atn, btAndInfo in self.byAssayBiosampleType.iteritems():
+            yield ("super_" + atn, self.superTrack(atn, btAndInfo),
+                   [info["fnp"] for info in btAndInfo.values()])
 
+    def composites(self):
+        # composite files, in trackDb order
+        for atn, btAndInfo in self.byAssayBiosampleType.iteritems():
+            for bt, info in btAndInfo.iteritems():
+                yield info["fnp"]
+
+def outputAllTracksByBiosampleType(cache, info):
+    fp = cache.fingerprint(info, [__file__])
+    restored = cache.restore(fp)
+    if restored:
+        return restored
+    tracks = makeTracks(**info)
+    info["subGroups"] = tracks.subgroups()
+    text = compositeTrackByBiosampleType(**info) + tracks.render()
+    cache.save(fp, text, tracks)
+    return tracks.count(), text
+
+def compositeTrackByBiosampleType(assembly, assay_term_name, atn, biosample_type, bt,
+                                  exps, fnp, idx, total, subGroups, lookupByExp, longLabelBase = None):
     subGroupsDict = {}
     for k in Helpers.SubGroupKeys:
         subGroupsDict[k] = {a[0]:a[1] for a in subGroups[k]}
@@ -216,9 +224,6 @@ def outputCompositeTrackByBiosampleType(assembly, assay_term_name, atn, biosampl
     subGroup2 = Helpers.unrollEquals(subGroupsDict[subGroup2key])
     subGroup3 = Helpers.unrollEquals(subGroupsDict[subGroup3key])
 
-    with open(fnp) as f:
-        subtracks = f.read()
-
     actives = []
     # for expID in expIDs:
     #     if expID in lookupByExp:
@@ -227,17 +232,17 @@ def outputCompositeTrackByBiosampleType(assembly, assay_term_name, atn, biosampl
     # if isActive:
     #     print("active biosample (composite):", btn)
 
-    with open(fnp, 'w') as f:
-        f.write("""
+    header = []
+    header.append("""
 track {atn}_{bt}
 parent super_{atn}
 compositeTrack on
 centerLabelsDense on
 """.format(atn=atn,
            bt=bt))
-        if isActive:
-            f.write("visibility full\n")
-        f.write("""shortLabel {shortL}
+    if isActive:
+        header.append("visibility full\n")
+    header.append("""shortLabel {shortL}
 longLabel {longL}
 type bigWig 9 +
 maxHeightPixels 64:12:8
@@ -259,12 +264,12 @@ darkerLabels on
            subGroup3key=subGroup3key,
            subGroup3=subGroup3
 ))
-        f.write('\n' + subtracks)
+    header.append('\n')
 
-    printWroteNumLines(fnp, idx, 'of', total)
+    return ''.join(header)
 
-def outputSubTrack(priority, assembly, assay_term_name, atn, biosample_type, bt,
-                   exps, fnp, idx, total, lookupByExp, longLabelBase = None):
+def makeTracks(assembly, assay_term_name, atn, biosample_type, bt,
+               exps, fnp, idx, total, lookupByExp, longLabelBase = None):
     actives = []
     # for expID in expIDs:
     #     if expID in lookupByExp:
@@ -276,6 +281,8 @@ def outputSubTrack(priority, assembly, assay_term_name, atn, biosample_type, bt,
     parent = Parent(atn + '_' + bt, isActive)
 
     tracks = Tracks(assembly, parent, "0_all" == bt)
+    if "0_all" == bt:
+        ResetTissueColors()
     for exp in exps:
         active = False
         expID = exp.encodeID
@@ -287,10 +294,4 @@ def outputSubTrack(priority, assembly, assay_term_name, atn, biosample_type, bt,
             tracks.addExpAll(exp, True, cREs)
         else:
             tracks.addExp(exp, True, cREs)
-
-    Utils.ensureDir(fnp)
-    with open(fnp, 'w') as f:
-        for line in tracks.lines(priority):
-            f.write(line)
-    printWroteNumLines(fnp, idx, 'of', total)
-    return tracks.subgroups()
+    return tracks
@@ -7,8 +7,6 @@ import re
 import argparse
 import requests
 from collections import OrderedDict, defaultdict
-from joblib import Parallel, delayed
-import StringIO
 from titlecase import titlecase
 
 from helpers.tracks import Tracks, Parent, LookupActive
@@ -35,21 +33,22 @@ def merge_two_dicts(x, y):
     return z
 
 class TrackhubDbBiosampleType:
-    def __init__(self, args, assembly, globalData, mw, priority):
+    def __init__(self, args, assembly, globalData, mw, registry, priority, cache):
         self.args = args
         self.assembly = assembly
         self.globalData = globalData
         self.mw = mw
+        self.registry = registry
         self.priority = priority
+        self.cache = cache
 
         self.byBiosampleTypeBiosample = defaultdict(lambda: defaultdict(dict))
         self.subGroups = defaultdict(lambda: defaultdict(lambda: defaultdict(set)))
 
-        printt("loading exps by biosample_type...")
-        self.inputData = self.mw.encodeByBiosampleTypeCustom(self.assembly)
+        self.inputData = []
         self.lookupByExp = {}
 
-    def _makeSubTracks(self):
+    def jobs(self):
         jobs = []
         for bt, btnInfo in self.byBiosampleTypeBiosample.iteritems():
             for btn, info in btnInfo.iteritems():
@@ -57,9 +56,19 @@ class TrackhubDbBiosampleType:
                                             {"lookupByExp": self.lookupByExp,
                                              "idx": len(jobs) + 1,
                                              "total": len(self.inputData)}))
+        return jobs
+
+    def worker(self):
+        return outputAllTracksByBiosampleType
 
-        Parallel(n_jobs=self.args.j)(delayed(outputAllTracksByBiosampleType)
-                                     (self.priority, job) for job in jobs)
+    def superTrackOf(self, job):
+        return job["bt"]
+
+    def reserveSuperTracks(self):
+        # called right after this builder's composites got their priorities
+        self.superPriorities = {}
+        for bt in self.byBiosampleTypeBiosample:
+            self.superPriorities[bt] = self.priority.increment(1)
 
     def _lookup(self):
         fnp = os.path.join(os.path.dirname(__file__), "lists",
@@ -82,7 +91,10 @@ class TrackhubDbBiosampleType:
                 self.lookupByExp[expID] = LookupActive(btid, btname, info, cREs)
         print(len(self.lookupByExp))
 
-    def run(self):
+    def prepare(self):
+        printt("loading exps by biosample_type...")
+        self.inputData = self.mw.encodeByBiosampleTypeCustom(self.assembly)
+
         printt("building lookup...")
         self._lookup()
 
@@ -108,29 +120,32 @@ class TrackhubDbBiosampleType:
                 "assembly": self.assembly
             }
 
-        printt("making tracks and subtracks...")
-        self._makeSubTracks()
-        return self._makeMainTrackDb()
-
-    def _makeMainTrackDb(self):
-        mainTrackDb = []
-
-        for bt, btnFnps in self.byBiosampleTypeBiosample.iteritems():
-            pri = self.priority.increment(1)
-            totalExperiments = sum([len(info["expIDs"]) for info in btnFnps.values()])
-            shortLabel = self.btToNormal[bt]
-            longLabel = self.btToNormal[bt] + " (%s experiments)" % totalExperiments
-
-            if shortLabel == "induced pluripotent stem cell line":
-                shortLabel = "IPSC"
-
-            shortLabel = titlecase(shortLabel)
-            shortLabel = shortLabel.replace('Ipsc', 'IPSC')
-            shortLabel = shortLabel.replace('In Vitro Differentiated Cell',
-                                            'in vitro Diff Cell')
-            shortLabel = shortLabel + ' Experiments'
-
-            mainTrackDb.append("""
+        printt("loading exps...")
+        allExpIDs = set()
+        for btnInfo in self.byBiosampleTypeBiosample.values():
+            for info in btnInfo.values():
+                allExpIDs.update(info["expIDs"])
+        exps = self.registry.hydrate(allExpIDs)
+        for btnInfo in self.byBiosampleTypeBiosample.values():
+            for info in btnInfo.values():
+                info["exps"] = [exps[e] for e in info["expIDs"] if e in exps]
+
+    def superTrack(self, bt, btnFnps):
+        pri = self.superPriorities[bt]
+        totalExperiments = sum([len(info["expIDs"]) for info in btnFnps.values()])
+        shortLabel = self.btToNormal[bt]
+        longLabel = self.btToNormal[bt] + " (%s experiments)" % totalExperiments
+
+        if shortLabel == "induced pluripotent stem cell line":
+            shortLabel = "IPSC"
+
+        shortLabel = titlecase(shortLabel)
+        shortLabel = shortLabel.replace('Ipsc', 'IPSC')
+        shortLabel = shortLabel.replace('In Vitro Differentiated Cell',
+                                        'in vitro Diff Cell')
+        shortLabel = shortLabel + ' Experiments'
+
+        return """
 track super_{bt}
 superTrack on
 priority {priority}
@@ -140,28 +155,38 @@ description {longL}
 """.format(bt = bt,
            priority = pri,
            shortL=shortLabel,
-           longL=Helpers.makeLongLabel(longLabel)))
+           longL=Helpers.makeLongLabel(longLabel))
+
+    def superTracks(self):
+        return '\n'.join([self.superTrack(bt, btnFnps)
+                          for bt, btnFnps in self.byBiosampleTypeBiosample.iteritems()])
 
-        outF = StringIO.StringIO()
-        outF.write('\n'.join(mainTrackDb))
+    def shards(self):
+        # (super track, its stanza, its composite files), in trackDb order
         for bt, btnFnps in self.byBiosampleTypeBiosample.iteritems():
-            for btn, info in btnFnps.iteritems():
-                with open(info["fnp"]) as f:
-                    outF.write(f.read())
-                    outF.write('\n')
-        return outF.getvalue()
-
-def outputAllTracksByBiosampleType(priority, info):
-    subGroups = outputSubTrack(priority, **info)
-    info["subGroups"] = subGroups
-    outputCompositeTrackByBiosampleType(**info)
-
-def outputCompositeTrackByBiosampleType(assembly, bt, btn, expIDs, fnp, idx, total,
-                                        subGroups, biosample_type, biosample_term_name,
-                                        lookupByExp):
-    if not os.path.exists(fnp):
-        raise Exception("missing " + fnp)
+            yield ("super_" + bt, self.superTrack(bt, btnFnps),
+                   [info["fnp"] for info in btnFnps.values()])
 
+    def composites(self):
+        # composite files, in trackDb order
+        for bt, btnFnps in self.byBiosampleTypeBiosample.iteritems():
+            for btn, info in btnFnps.iteritems():
+                yield info["fnp"]
+
+def outputAllTracksByBiosampleType(cache, info):
+    fp = cache.fingerprint(info, [__file__])
+    restored = cache.restore(fp)
+    if restored:
+        return restored
+    tracks = makeTracks(**info)
+    info["subGroups"] = tracks.subgroups()
+    text = compositeTrackByBiosampleType(**info) + tracks.render()
+    cache.save(fp, text, tracks)
+    return tracks.count(), text
+
+def compositeTrackByBiosampleType(assembly, bt, btn, expIDs, exps, fnp, idx, total,
+                                  subGroups, biosample_type, biosample_term_name,
+                                  lookupByExp):
     subGroupsDict = {}
     for k in Helpers.SubGroupKeys:
         subGroupsDict[k] = {a[0]:a[1] for a in subGroups[k]}
@@ -186,20 +211,17 @@ def outputCompositeTrackByBiosampleType(assembly, bt, btn, expIDs, fnp, idx, tot
     if isActive:
         print("active biosample (composite):", btn)
 
-    with open(fnp) as f:
-        subtracks = f.read()
-
-    with open(fnp, 'w') as f:
-        f.write("""
+    header = []
+    header.append("""
 track {bt}_{btn}
 parent super_{bt}
 compositeTrack on
 centerLabelsDense on
 """.format(bt=bt,
            btn=btn))
-        if isActive:
-            f.write("visibility full\n")
-        f.write("""shortLabel {shortL}
+    if isActive:
+        header.append("visibility full\n")
+    header.append("""shortLabel {shortL}
 description {longL}
 longLabel {longL}
 type bigWig 9 +
@@ -222,15 +244,12 @@ darkerLabels on
            subGroup3key=subGroup3key,
            subGroup3=subGroup3
 ))
-        f.write('\n' + subtracks)
+    header.append('\n')
 
-    printWroteNumLines(fnp, idx, 'of', total)
-
-def outputSubTrack(priority, assembly, bt, btn, expIDs, fnp, idx, total,
-                   biosample_type, biosample_term_name, lookupByExp):
-    mw = MetadataWS(host=Host)
-    exps = mw.exps(expIDs)
+    return ''.join(header)
 
+def makeTracks(assembly, bt, btn, expIDs, exps, fnp, idx, total,
+               biosample_type, biosample_term_name, lookupByExp):
     actives = []
     for expID in expIDs:
         if expID in lookupByExp:
@@ -250,10 +269,4 @@ def outputSubTrack(priority, assembly, bt, btn, expIDs, fnp, idx, total,
             active = lookupByExp[expID].isActive()
             cREs = lookupByExp[expID].ccREs
         tracks.addExp(exp, True, cREs)
-
-    Utils.ensureDir(fnp)
-    with open(fnp, 'w') as f:
-        for line in tracks.lines(priority):
-            f.write(line)
-    printWroteNumLines(fnp, idx, 'of', total)
-    return tracks.subgroups()
+    return tracks
@@ -8,12 +8,11 @@ import argparse
 import requests
 from itertools import groupby
 from collections import OrderedDict, defaultdict
-from joblib import Parallel, delayed
-import StringIO
 
 from helpers.tracks import Tracks, Parent
 import helpers.helpers as Helpers
 from paths import Host, BaseWwwDir, BaseWwwTmpDir
+from assemblies import Assemblies
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../metadata/utils'))
 from files_and_paths import Dirs
@@ -123,12 +122,14 @@ def ccREexps(globalData, mw, assembly):
     return ret
 
 class TrackhubDbByCcREs:
-    def __init__(self, args, assembly, globalData, mw, priority):
+    def __init__(self, args, assembly, globalData, mw, registry, priority, cache):
         self.args = args
         self.assembly = assembly
         self.globalData = globalData
         self.mw = mw
+        self.registry = registry
         self.priority = priority
+        self.cache = cache
 
         self.expsByAssay= [("candidate cis-Regulatory Elements", "ccres",
                             ccREexps),
@@ -141,22 +142,16 @@ class TrackhubDbByCcREs:
 
         self.btToNormal = {}
 
-    def run(self):
+    def prepare(self):
         for title, assayAbbr, expsF in self.expsByAssay:
             exps = expsF(self.globalData, self.mw, self.assembly)
+            if self.registry.fileFilter:
+                # these come from globalData rather than the registry; check
+                #  their mirrored bigWigs all the same
+                self.registry.fileFilter(exps)
             self._build(title, assayAbbr, exps)
-        return self._makeMainTrackDb()
 
     def generalCres(self, assay_term_name, atn):
-        GeneralCres = {"5-group": {"hg19": "ENCFF658MYW",
-                                    "mm10": "ENCFF318XQA"},
-                        "9-state": {"H3K4me3": {"hg19": "ENCFF706MWD",
-                                                "mm10": "ENCFF549SJX"},
-                                    "H3K27ac": {"hg19": "ENCFF656QBL",
-                                                "mm10": "ENCFF776IAR"},
-                                    "CTCF": {"hg19": "ENCFF106AGR",
-                                             "mm10": "ENCFF506YHI"}}}
-
         biosample_type = "_GENERAL ccREs"
         bt = "_general_ccREs"
 
@@ -174,9 +169,9 @@ class TrackhubDbByCcREs:
         e.files = []
         e.active = True
 
-        ccREbigBeds = {"5group": GeneralCres["5-group"][self.assembly]}
-        for assay in ["H3K4me3", "H3K27ac", "CTCF"]:
-            ccREbigBeds["9state-" + assay] = GeneralCres["9-state"][assay][self.assembly]
+        ccREbigBeds = {}
+        for stateType, accession in Assemblies[self.assembly]["generalCres"]:
+            ccREbigBeds[stateType] = accession
         e.ccREbigBeds = ccREbigBeds
         exps = [e]
 
@@ -216,10 +211,7 @@ class TrackhubDbByCcREs:
                 "assembly": self.assembly
             }
 
-        printt("making tracks and subtracks...")
-        self._makeSubTracks()
-
-    def _makeSubTracks(self):
+    def jobs(self):
         jobs = []
         for atn, btAndInfo in self.byAssayBiosampleType.iteritems():
             for bt, info in btAndInfo.iteritems():
@@ -227,19 +219,26 @@ class TrackhubDbByCcREs:
                 jobs.append(merge_two_dicts(info,
                                             {"idx": len(jobs) + 1,
                                              "total": len(self.byAssayBiosampleType)}))
-
-        Parallel(n_jobs=self.args.j)(delayed(outputAllTracksByBiosampleType)
-                                     (self.priority, job) for job in jobs)
-
-    def _makeMainTrackDb(self):
-        mainTrackDb = []
-
-        for atn, btAndInfo in self.byAssayBiosampleType.iteritems():
-            pri = self.priority.increment(1)
-            totalExperiments = sum([len(info["exps"]) for info in btAndInfo.values()])
-            shortLabel = self.btToNormal[atn]
-            longLabel = self.btToNormal[atn] + " (%s experiments)" % totalExperiments
-            mainTrackDb.append("""
+        return jobs
+
+    def worker(self):
+        return outputAllTracksByBiosampleType
+
+    def superTrackOf(self, job):
+        return job["atn"]
+
+    def reserveSuperTracks(self):
+        # called right after this builder's composites got their priorities
+        self.superPriorities = {}
+        for atn in self.byAssayBiosampleType:
+            self.superPriorities[atn] = self.priority.increment(1)
+
+    def superTrack(self, atn, btAndInfo):
+        pri = self.superPriorities[atn]
+        totalExperiments = sum([len(info["exps"]) for info in btAndInfo.values()])
+        shortLabel = self.btToNormal[atn]
+        longLabel = self.btToNormal[atn] + " (%s experiments)" % totalExperiments
+        return """
 track super_{atn}
 superTrack on show
 priority {priority}
@@ -249,29 +248,39 @@ description {longL}
 """.format(atn = atn,
            priority = pri,
            shortL=shortLabel,
-           longL=Helpers.makeLongLabel(longLabel)))
+           longL=Helpers.makeLongLabel(longLabel))
+
+    def superTracks(self):
+        return '\n'.join([self.superTrack(atn, btAndInfo)
+                          for atn, btAndInfo in self.byAssayBiosampleType.iteritems()])
 
-        outF = StringIO.StringIO()
-        outF.write('\n'.join(mainTrackDb))
+    def shards(self):
+        # (super track, its stanza, its composite files), in trackDb order
         for atn, btAndInfo in self.byAssayBiosampleType.iteritems():
-            for bt, info in btAndInfo.iteritems():
-                with open(info["fnp"]) as f:
-                    outF.write(f.read())
-                    outF.write('\n')
-        return outF.getvalue()
-
-def outputAllTracksByBiosampleType(priority, info):
-    subGroups = outputSubTrack(priority, **info)
-    info["subGroups"] = subGroups
-    outputCompositeTrackByBiosampleType(**info)
-
-def outputCompositeTrackByBiosampleType(assembly, assay_term_name,
-                                        atn, biosample_type, bt,
-                                        exps, fnp, idx, total,
-                                        subGroups):
-    if not os.path.exists(fnp):
-        raise Exception("missing " + fnp)
+            yield ("super_" + atn, self.superTrack(atn, btAndInfo),
+                   [info["fnp"] for info in btAndInfo.values()])
 
+    def composites(self):
+        # composite files, in trackDb order
+        for atn, btAndInfo in self.byAssayBiosampleType.iteritems():
+            for bt, info in btAndInfo.iteritems():
+                yield info["fnp"]
+
+def outputAllTracksByBiosampleType(cache, info):
+    fp = cache.fingerprint(info, [__file__])
+    restored = cache.restore(fp)
+    if restored:
+        return restored
+    tracks = makeTracks(**info)
+    info["subGroups"] = tracks.subgroups()
+    text = compositeTrackByBiosampleType(**info) + tracks.render()
+    cache.save(fp, text, tracks)
+    return tracks.count(), text
+
+def compositeTrackByBiosampleType(assembly, assay_term_name,
+                                  atn, biosample_type, bt,
+                                  exps, fnp, idx, total,
+                                  subGroups):
     subGroupsDict = {}
     for k in Helpers.SubGroupKeys:
         subGroupsDict[k] = {a[0]:a[1] for a in subGroups[k]}
@@ -295,20 +304,17 @@ def outputCompositeTrackByBiosampleType(assembly, assay_term_name,
     if isActive:
         print("active biosample (composite):", bt)
 
-    with open(fnp) as f:
-        subtracks = f.read()
-
-    with open(fnp, 'w') as f:
-        f.write("""
+    header = []
+    header.append("""
 track {atn}_{bt}
 parent super_{atn}
 compositeTrack on
 centerLabelsDense on
 """.format(atn=atn,
            bt=bt))
-        if isActive:
-            f.write("visibility full\n")
-        f.write("""shortLabel {shortL}
+    if isActive:
+        header.append("visibility full\n")
+    header.append("""shortLabel {shortL}
 longLabel {longL}
 description {longL}
 type bigWig 9 +
@@ -331,12 +337,12 @@ darkerLabels on
            subGroup3key=subGroup3key,
            subGroup3=subGroup3
 ))
-        f.write('\n' + subtracks)
+    header.append('\n')
 
-    printWroteNumLines(fnp, idx, 'of', total)
+    return ''.join(header)
 
-def outputSubTrack(priority, assembly, assay_term_name, atn, biosample_type,
-                   bt, exps, fnp, idx, total):
+def makeTracks(assembly, assay_term_name, atn, biosample_type,
+               bt, exps, fnp, idx, total):
     isActive = bt in ActiveBiosamples
     if isActive:
         print("active biosample:", bt)
@@ -346,10 +352,4 @@ def outputSubTrack(priority, assembly, assay_term_name, atn, biosample_type,
     tracks = Tracks(assembly, parent, False)
     for exp in exps:
         tracks.addExp(exp, exp.active, exp.ccREbigBeds)
-
-    Utils.ensureDir(fnp)
-    with open(fnp, 'w') as f:
-        for line in tracks.lines(priority):
-            f.write(line)
-    printWroteNumLines(fnp, idx, 'of', total)
-    return tracks.subgroups()
+    return tracks
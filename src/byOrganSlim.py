@@ -8,8 +8,6 @@ import argparse
 import requests
 from itertools import groupby
 from collections import OrderedDict, defaultdict
-from joblib import Parallel, delayed
-import StringIO
 
 from helpers.tracks import Tracks, Parent, LookupActive
 import helpers.helpers as Helpers
@@ -35,15 +33,17 @@ def merge_two_dicts(x, y):
     return z
 
 class TrackhubDbByOrganSlim:
-    def __init__(self, args, assembly, globalData, mw, priority):
+    def __init__(self, args, assembly, globalData, mw, registry, priority, cache):
         self.args = args
         self.assembly = assembly
         self.globalData = globalData
         self.mw = mw
+        self.registry = registry
         self.priority = priority
+        self.cache = cache
 
         def wrap():
-            return self.mw.dnases_useful() + self.mw.chipseq_histones_useful() + self.mw.transcription_useful() + self.mw.chipseq_tfs_useful()
+            return self.registry.get("dnases_useful") + self.registry.get("chipseq_histones_useful") + self.registry.get("transcription_useful") + self.registry.get("chipseq_tfs_useful")
 
         self.expsByAssay= [("Exps by Organ Ontology",
                             "organ_ontology",
@@ -58,11 +58,10 @@ class TrackhubDbByOrganSlim:
         self.labelNToNormal = {}
         self.lookupByExp = {}
 
-    def run(self):
+    def prepare(self):
         for title, assayAbbr, expsF in self.expsByAssay:
             exps = expsF()
             self._build(title, assayAbbr, exps)
-        return self._makeMainTrackDb()
 
     def _build(self, assay_term_name, atn, exps):
         printt("building", assay_term_name, "...")
@@ -93,10 +92,7 @@ class TrackhubDbByOrganSlim:
                 "assembly": self.assembly
             }
 
-        printt("making tracks and subtracks...")
-        self._makeSubTracks()
-
-    def _makeSubTracks(self):
+    def jobs(self):
         jobs = []
         for atn, labelNAndInfo in self.byAssayBiosampleType.iteritems():
             for labelN, info in labelNAndInfo.iteritems():
@@ -104,20 +100,27 @@ class TrackhubDbByOrganSlim:
                                             {"lookupByExp": self.lookupByExp,
                                              "idx": len(jobs) + 1,
                                              "total": len(self.byAssayBiosampleType)}))
+        return jobs
 
-        Parallel(n_jobs=self.args.j)(delayed(outputAllTracksByBiosampleType)
-                                     (self.priority, job) for job in jobs)
+    def worker(self):
+        return outputAllTracksByBiosampleType
 
-    def _makeMainTrackDb(self):
-        mainTrackDb = []
+    def superTrackOf(self, job):
+        return job["atn"]
 
-        for atn, labelNAndInfo in self.byAssayBiosampleType.iteritems():
-            pri = self.priority.increment(1)
-            totalExperiments = sum([len(info["exps"]) for info in labelNAndInfo.values()])
-            shortLabel = self.labelNToNormal[atn]
-            longLabel = self.labelNToNormal[atn] + " (%s experiments)" % totalExperiments
+    def reserveSuperTracks(self):
+        # called right after this builder's composites got their priorities
+        self.superPriorities = {}
+        for atn in self.byAssayBiosampleType:
+            self.superPriorities[atn] = self.priority.increment(1)
+
+    def superTrack(self, atn, labelNAndInfo):
+        pri = self.superPriorities[atn]
+        totalExperiments = sum([len(info["exps"]) for info in labelNAndInfo.values()])
+        shortLabel = self.labelNToNormal[atn]
+        longLabel = self.labelNToNormal[atn] + " (%s experiments)" % totalExperiments
 
-            mainTrackDb.append("""
+        return """
 track super_{atn}
 superTrack on
 priority {priority}
@@ -127,27 +130,37 @@ description {longL}
 """.format(atn = atn,
            priority = pri,
            shortL=shortLabel,
-           longL=Helpers.makeLongLabel(longLabel)))
-
-        outF = StringIO.StringIO()
-        outF.write('\n'.join(mainTrackDb))
-        for atn, labelNAndInfo in self.byAssayBiosampleType.iteritems():
-            for labelN, info in labelNAndInfo.iteritems():
-                with open(info["fnp"]) as f:
-                    outF.write(f.read())
-                    outF.write('\n')
-        return outF.getvalue()
+           longL=Helpers.makeLongLabel(longLabel))
 
-def outputAllTracksByBiosampleType(priority, info):
-    subGroups = outputSubTrack(priority, **info)
-    info["subGroups"] = subGroups
-    outputCompositeTrackByBiosampleType(**info)
+    def superTracks(self):
+        return '\n'.join([self.superTrack(atn, labelNAndInfo)
+                          for atn, labelNAndInfo in self.byAssayBiosampleType.iteritems()])
 
-def outputCompositeTrackByBiosampleType(assembly, assay_term_name, atn, label, labelN,
-                                        exps, fnp, idx, total, subGroups, lookupByExp):
-    if not os.path.exists(fnp):
-        raise Exception("missing " + fnp)
+    def shards(self):
+        # (super track, its stanza, its composite files), in trackDb order
+        for atn, labelNAndInfo in self.byAssayBiosampleType.iteritems():
+            yield ("super_" + atn, self.superTrack(atn, labelNAndInfo),
+                   [info["fnp"] for info in labelNAndInfo.values()])
 
+    def composites(self):
+        # composite files, in trackDb order
+        for atn, labelNAndInfo in self.byAssayBiosampleType.iteritems():
+            for labelN, info in labelNAndInfo.iteritems():
+                yield info["fnp"]
+
+def outputAllTracksByBiosampleType(cache, info):
+    fp = cache.fingerprint(info, [__file__])
+    restored = cache.restore(fp)
+    if restored:
+        return restored
+    tracks = makeTracks(**info)
+    info["subGroups"] = tracks.subgroups()
+    text = compositeTrackByBiosampleType(**info) + tracks.render()
+    cache.save(fp, text, tracks)
+    return tracks.count(), text
+
+def compositeTrackByBiosampleType(assembly, assay_term_name, atn, label, labelN,
+                                  exps, fnp, idx, total, subGroups, lookupByExp):
     subGroupsDict = {}
     for k in Helpers.SubGroupKeys:
         subGroupsDict[k] = {a[0]:a[1] for a in subGroups[k]}
@@ -162,9 +175,6 @@ def outputCompositeTrackByBiosampleType(assembly, assay_term_name, atn, label, l
     subGroup2 = Helpers.unrollEquals(subGroupsDict[subGroup2key])
     subGroup3 = Helpers.unrollEquals(subGroupsDict[subGroup3key])
 
-    with open(fnp) as f:
-        subtracks = f.read()
-
     actives = []
     # for expID in expIDs:
     #     if expID in lookupByExp:
@@ -173,17 +183,17 @@ def outputCompositeTrackByBiosampleType(assembly, assay_term_name, atn, label, l
     # if isActive:
     #     print("active biosample (composite):", labelNn)
 
-    with open(fnp, 'w') as f:
-        f.write("""
+    header = []
+    header.append("""
 track {atn}_{labelN}
 parent super_{atn}
 compositeTrack on
 centerLabelsDense on
 """.format(atn=atn,
            labelN=labelN))
-        if isActive:
-            f.write("visibility full\n")
-        f.write("""shortLabel {shortL}
+    if isActive:
+        header.append("visibility full\n")
+    header.append("""shortLabel {shortL}
 description {longL}
 longLabel {longL}
 type bigWig 9 +
@@ -206,12 +216,12 @@ darkerLabels on
            subGroup3key=subGroup3key,
            subGroup3=subGroup3
 ))
-        f.write('\n' + subtracks)
+    header.append('\n')
 
-    printWroteNumLines(fnp, idx, 'of', total)
+    return ''.join(header)
 
-def outputSubTrack(priority, assembly, assay_term_name, atn, label, labelN,
-                   exps, fnp, idx, total, lookupByExp):
+def makeTracks(assembly, assay_term_name, atn, label, labelN,
+               exps, fnp, idx, total, lookupByExp):
     actives = []
     # for expID in expIDs:
     #     if expID in lookupByExp:
@@ -231,10 +241,4 @@ def outputSubTrack(priority, assembly, assay_term_name, atn, label, labelN,
             active = lookupByExp[expID].isActive()
             cREs = lookupByExp[expID].cREs
         tracks.addExp(exp, True, cREs)
-
-    Utils.ensureDir(fnp)
-    with open(fnp, 'w') as f:
-        for line in tracks.lines(priority):
-            f.write(line)
-    printWroteNumLines(fnp, idx, 'of', total)
-    return tracks.subgroups()
+    return tracks
@@ -0,0 +1,254 @@
+from __future__ import print_function
+
+import os
+import mmap
+import zlib
+import struct
+from contextlib import contextmanager
+
+# The parts of a bigWig/bigBed (the "bbi" format, Kent et al. 2010) needed to
+#  tell whether a file is whole and which chromosomes it covers: the 64 byte
+#  header, the zoom level headers behind it, and the chromosome B+ tree, plus
+#  the zoom summaries for whoever wants them. The file is mmap'd and the
+#  fields unpacked in place, so only the pages holding them are ever read, a
+#  few KB however large the file. Compressed zoom blocks are found through
+#  the level's R tree index, so each is inflated from just its own bytes.
+
+BigWigMagic = 0x888FFC26
+BigBedMagic = 0x8789F2EB
+ChromTreeMagic = 0x78CA8C91
+CirTreeMagic = 0x2468ACE0
+
+Kinds = {BigWigMagic: "bigWig", BigBedMagic: "bigBed"}
+
+# magic, version, zoomLevels, chromTreeOffset, fullDataOffset,
+#  fullIndexOffset, fieldCount, definedFieldCount, autoSqlOffset,
+#  totalSummaryOffset, uncompressBufSize, reserved
+Header = "IHHQQQHHQQIQ"
+# reductionLevel, reserved, dataOffset, indexOffset
+ZoomHeader = "IIQQ"
+# magic, blockSize, keySize, valSize, itemCount, reserved
+ChromTreeHeader = "IIIIQQ"
+# isLeaf, reserved, count
+ChromTreeNode = "BBH"
+# magic, blockSize, itemCount, startChromIx, startBase, endChromIx, endBase,
+#  endFileOffset, itemsPerSlot, reserved
+CirTreeHeader = "IIQIIIIQII"
+# its nodes start like the chromosome tree's, then hold leaf items of
+#  startChromIx, startBase, endChromIx, endBase, dataOffset, dataSize
+CirTreeLeafItem = "IIIIQQ"
+#  or items of startChromIx, startBase, endChromIx, endBase, childOffset
+CirTreeNodeItem = "IIIIQ"
+# one summary per zoom bin: chromId, chromStart, chromEnd, validCount,
+#  minVal, maxVal, sumData, sumSquares
+ZoomRecord = "IIIIffff"
+
+def _size(fmt):
+    # standard sizes, no native padding, as the file is laid out
+    return struct.calcsize('<' + fmt)
+
+class BBIError(Exception):
+    pass
+
+class BBIHeader(object):
+    __slots__ = ("kind", "version", "zoomLevels", "fieldCount", "definedFieldCount",
+                 "chroms", "size")
+
+    def __init__(self, kind, version, zoomLevels, fieldCount, definedFieldCount,
+                 chroms, size):
+        self.kind = kind
+        self.version = version
+        self.zoomLevels = zoomLevels
+        self.fieldCount = fieldCount
+        self.definedFieldCount = definedFieldCount
+        self.chroms = chroms # name -> size
+        self.size = size
+
+class _Reader(object):
+    def __init__(self, mm, size):
+        self.mm = mm
+        self.size = size
+        magic = struct.unpack_from("<I", mm, 0)[0]
+        self.order = '<'
+        if magic not in Kinds:
+            # written on a big-endian machine
+            magic = struct.unpack_from(">I", mm, 0)[0]
+            self.order = '>'
+        if magic not in Kinds:
+            raise BBIError("not a bigWig or bigBed (magic %08x)" % magic)
+        self.kind = Kinds[magic]
+        self.magic = magic
+        self.uncompressBufSize = 0
+        self.zooms = [] # (reductionLevel, dataOffset, indexOffset), finest first
+
+    def unpack(self, fmt, offset):
+        end = offset + _size(fmt)
+        if offset < 0 or end > self.size:
+            raise BBIError("truncated: %d bytes at %d past the end (%d bytes)" %
+                           (end - offset, offset, self.size))
+        return struct.unpack_from(self.order + fmt, self.mm, offset)
+
+    def offset(self, name, offset):
+        if offset >= self.size:
+            raise BBIError("truncated: %s at %d past the end (%d bytes)" %
+                           (name, offset, self.size))
+
+    def header(self):
+        (magic, version, zoomLevels, chromTreeOffset, fullDataOffset, fullIndexOffset,
+         fieldCount, definedFieldCount, autoSqlOffset, totalSummaryOffset,
+         uncompressBufSize, reserved) = self.unpack(Header, 0)
+        self.uncompressBufSize = uncompressBufSize
+
+        # bbi files end with their magic again; a cut-off copy does not
+        if self.unpack("I", self.size - 4)[0] != self.magic:
+            raise BBIError("truncated: no magic at the end of %d bytes" % self.size)
+
+        self.offset("chromosome tree", chromTreeOffset)
+        self.offset("data", fullDataOffset)
+        self.offset("index", fullIndexOffset)
+        zoomOffset = _size(Header)
+        for i in xrange(zoomLevels):
+            reduction, r, dataOffset, indexOffset = self.unpack(ZoomHeader, zoomOffset)
+            self.offset("zoom %d data" % i, dataOffset)
+            self.offset("zoom %d index" % i, indexOffset)
+            self.zooms.append((reduction, dataOffset, indexOffset))
+            zoomOffset += _size(ZoomHeader)
+
+        return BBIHeader(self.kind, version, zoomLevels, fieldCount, definedFieldCount,
+                         self.chroms(chromTreeOffset), self.size)
+
+    def chroms(self, offset):
+        magic, blockSize, keySize, valSize, itemCount, r = self.unpack(ChromTreeHeader, offset)
+        if ChromTreeMagic != magic:
+            raise BBIError("bad chromosome tree magic %08x" % magic)
+        if 8 != valSize:
+            raise BBIError("unexpected chromosome tree value size %d" % valSize)
+
+        leafItem = "%dsII" % keySize
+        nodeItem = "%dsQ" % keySize
+        nodeSize = _size(ChromTreeNode)
+        ret = {}
+        seen = set()
+        todo = [offset + _size(ChromTreeHeader)]
+        while todo:
+            node = todo.pop()
+            if node in seen:
+                raise BBIError("chromosome tree loops back to %d" % node)
+            seen.add(node)
+            isLeaf, r, count = self.unpack(ChromTreeNode, node)
+            if count > blockSize:
+                raise BBIError("chromosome tree node of %d items, block size %d" %
+                               (count, blockSize))
+            item = node + nodeSize
+            if isLeaf:
+                step = _size(leafItem)
+                for i in xrange(count):
+                    key, chromId, chromSize = self.unpack(leafItem, item)
+                    ret[key.rstrip('\0')] = chromSize
+                    item += step
+            else:
+                step = _size(nodeItem)
+                children = []
+                for i in xrange(count):
+                    key, child = self.unpack(nodeItem, item)
+                    children.append(child)
+                    item += step
+                # popped in file order
+                todo.extend(reversed(children))
+        if len(ret) != itemCount:
+            raise BBIError("chromosome tree holds %d chromosomes, header says %d" %
+                           (len(ret), itemCount))
+        return ret
+
+    def dataBlocks(self, offset):
+        # (offset, size) of each block an R tree index points to, in index order
+        magic, blockSize, itemCount = self.unpack(CirTreeHeader, offset)[:3]
+        if CirTreeMagic != magic:
+            raise BBIError("bad R tree index magic %08x" % magic)
+
+        nodeSize = _size(ChromTreeNode)
+        ret = []
+        seen = set()
+        todo = [offset + _size(CirTreeHeader)]
+        while todo:
+            node = todo.pop()
+            if node in seen:
+                raise BBIError("R tree index loops back to %d" % node)
+            seen.add(node)
+            isLeaf, r, count = self.unpack(ChromTreeNode, node)
+            if count > blockSize:
+                raise BBIError("R tree index node of %d items, block size %d" %
+                               (count, blockSize))
+            item = node + nodeSize
+            if isLeaf:
+                step = _size(CirTreeLeafItem)
+                for i in xrange(count):
+                    dataOffset, dataSize = self.unpack(CirTreeLeafItem, item)[4:]
+                    if dataOffset + dataSize > self.size:
+                        raise BBIError("truncated: block at %d past the end (%d bytes)" %
+                                       (dataOffset, self.size))
+                    ret.append((dataOffset, dataSize))
+                    item += step
+            else:
+                step = _size(CirTreeNodeItem)
+                children = []
+                for i in xrange(count):
+                    children.append(self.unpack(CirTreeNodeItem, item)[4])
+                    item += step
+                todo.extend(reversed(children))
+        if len(ret) != itemCount:
+            raise BBIError("R tree index holds %d blocks, header says %d" %
+                           (len(ret), itemCount))
+        return ret
+
+    def zoomBlocks(self, dataOffset, indexOffset):
+        # a zoom level's records as buffers: views of the map itself when the
+        #  file is uncompressed, else each zlib block its index points to,
+        #  inflated in turn
+        count = self.unpack("I", dataOffset)[0]
+        start = dataOffset + _size("I")
+        if not self.uncompressBufSize:
+            n = count * _size(ZoomRecord)
+            if start + n > self.size:
+                raise BBIError("truncated: zoom records past the end (%d bytes)" % self.size)
+            yield buffer(self.mm, start, n)
+            return
+        for offset, size in self.dataBlocks(indexOffset):
+            try:
+                block = zlib.decompress(buffer(self.mm, offset, size))
+            except zlib.error as e:
+                raise BBIError("bad zoom block at %d: %s" % (offset, e))
+            yield block
+
+@contextmanager
+def openBBI(fnp):
+    """A checked reader over the mmap'd file, for reading on past the header."""
+    with open(fnp, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _size(Header):
+            raise BBIError("truncated: only %d bytes" % size)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            r = _Reader(mm, size)
+            r.bbiHeader = r.header()
+            yield r
+        finally:
+            mm.close()
+
+def readHeader(fnp):
+    """The header and chromosome sizes of a bigWig/bigBed; BBIError if it is not one."""
+    with openBBI(fnp) as r:
+        return r.bbiHeader
+
+def compareChroms(chroms, chromLens):
+    # problems with a file's chromosomes against the assembly's; chromosomes
+    #  the assembly lacks (chrEBV, unplaced contigs) are left alone
+    problems = []
+    for chrom, size in sorted(chroms.iteritems()):
+        expected = chromLens.get(chrom)
+        if expected is not None and expected != size:
+            problems.append("%s is %d bp, not %d" % (chrom, size, expected))
+    if chroms and not any(c in chromLens for c in chroms):
+        problems.append("no chromosome of the assembly (has %s)" %
+                        ', '.join(sorted(chroms)[:5]))
+    return problems
@@ -0,0 +1,117 @@
+from __future__ import print_function
+
+import sys
+import os
+import re
+import json
+import hashlib
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils, eprint
+
+import helpers as Helpers
+from profiler import Profile
+from assemblies import Assemblies
+
+# bump to invalidate every stored composite, e.g. if the on-disk layout changes
+CacheVersion = 2
+
+# job fields that only affect progress output or where the file ends up
+IgnoredJobKeys = ["idx", "total", "fnp"]
+
+# modules whose code shapes the rendered stanzas, besides the builder itself
+RenderSources = [os.path.join(os.path.dirname(__file__), "helpers.py"),
+                 os.path.join(os.path.dirname(__file__), "selection.py"),
+                 os.path.join(os.path.dirname(__file__), "tracks.py"),
+                 os.path.join(os.path.dirname(__file__), "../byAll.py"),
+                 os.path.join(os.path.dirname(__file__), "../assemblies.py")]
+
+# per-assembly lists the stanzas are rendered from (tissue, color, shortLabel)
+RenderLists = ["cellTypeToTissue"]
+
+PriorityRe = re.compile(r'^(\t+priority )(\d+)\n', re.MULTILINE)
+
+_sourceDigests = {}
+
+def _sourceDigest(fnp):
+    fnp = re.sub(r'\.py[co]$', '.py', fnp)
+    if fnp not in _sourceDigests:
+        with open(fnp, 'rb') as f:
+            _sourceDigests[fnp] = hashlib.sha1(f.read()).hexdigest()
+    return _sourceDigests[fnp]
+
+def _canonical(o):
+    # exps, files and lookups are plain attribute bags; hash everything they
+    #  carry so whatever the track classes and file filters read is covered
+    if isinstance(o, (set, frozenset)):
+        return sorted(o)
+    if hasattr(o, '__dict__'):
+        return vars(o)
+    return repr(o)
+
+def shiftPriorities(text, delta):
+    # composites are rendered with priorities from 0; a track that lands on
+    #  priority 0 gets no priority line, as trackDbs have always had it
+    def shift(m):
+        priority = int(m.group(2)) + delta
+        if not priority:
+            return ''
+        return m.group(1) + str(priority) + '\n'
+    return PriorityRe.sub(shift, text)
+
+class BuildCache(object):
+    def __init__(self, cacheDir, enabled=True):
+        self.cacheDir = cacheDir
+        self.enabled = enabled
+
+    def fingerprint(self, info, sources):
+        if not self.enabled:
+            return None
+        job = {k: v for k, v in info.iteritems() if k not in IgnoredJobKeys}
+        try:
+            blob = json.dumps(job, sort_keys=True, default=_canonical)
+        except (TypeError, ValueError) as e:
+            eprint("build cache: could not fingerprint", info.get("fnp"), e)
+            return None
+        h = hashlib.sha1()
+        h.update(str(CacheVersion))
+        for fnp in RenderSources + sources:
+            h.update(_sourceDigest(fnp))
+        if info.get("assembly") in Assemblies:
+            for k in RenderLists:
+                h.update(_sourceDigest(Assemblies[info["assembly"]][k]))
+        h.update(blob)
+        return h.hexdigest()
+
+    def _fnps(self, fp):
+        base = os.path.join(self.cacheDir, fp[:2], fp)
+        return base + ".txt", base + ".json"
+
+    def lookup(self, fp):
+        if not fp:
+            return None
+        textFnp, metaFnp = self._fnps(fp)
+        if not os.path.exists(metaFnp):
+            return None
+        with open(metaFnp) as f:
+            return json.load(f)
+
+    def restore(self, fp):
+        # (numTracks, stanzas) on a hit, priorities from 0 as they were rendered
+        meta = self.lookup(fp)
+        if not meta:
+            return None
+        textFnp, metaFnp = self._fnps(fp)
+        with open(textFnp, 'rb') as f:
+            text = f.read()
+        Profile.count("composites from build cache")
+        return meta["numTracks"], text
+
+    def save(self, fp, text, tracks):
+        if not fp:
+            return
+        textFnp, metaFnp = self._fnps(fp)
+        Utils.ensureDir(textFnp)
+        # text first, so a visible .json always has its stanzas next to it
+        Helpers.atomicWrite(textFnp, text)
+        Helpers.atomicWrite(metaFnp, json.dumps({"numTracks": tracks.numTracks}))
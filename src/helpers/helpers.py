@@ -5,13 +5,19 @@ from __future__ import print_function
 import sys
 import os
 import re
+import string
+import threading
+from contextlib import contextmanager
 from collections import OrderedDict, defaultdict
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../metadata/utils'))
 from exp import Exp
-from utils import eprint
+from utils import Utils, eprint, printt
 from metadataws import MetadataWS
 
+from selection import FileSelector
+from profiler import Profile
+
 AssayColors = {"DNase": ["6,218,147", "#06DA93"],
                "RNA-seq": ["0,170,0", "", "#00aa00"],
                "RAMPAGE": ["214,66,202", "#D642CA"],
@@ -36,22 +42,55 @@ def viz(state, active):
         return state
     return "hide"
 
-def sanitize(s, replChar='_'):
-    return re.sub('[^0-9a-zA-Z]+', replChar, s)
+# every track re-normalizes the same handful of biosample names, ages,
+#  targets and labels, so results are memoized; the memos start over once
+#  full rather than growing without bound
+MemoSize = 1 << 16
 
-def unrollEquals(sUnsorted):
-    r = ''
-    s = OrderedDict(sorted(sUnsorted.items()))
-    for k, v in s.iteritems():
-        nk = k.replace(' ', '_')
-        nk = re.sub('[^0-9a-zA-Z_\-&#;]+', '', nk) # drop everything but alphanum and _-
+NonAlnumRe = re.compile('[^0-9a-zA-Z]+')
+NonTokenRe = re.compile('[^0-9a-zA-Z_\-&#;]+')
+TokenChars = string.ascii_letters + string.digits + "_-&#;"
+SpaceToUnderscore = string.maketrans(' ', '_')
+NonTokenBytes = ''.join(chr(c) for c in xrange(256) if chr(c) not in TokenChars + ' ')
+
+_sanitized = {}
+_tokens = {}
+_escaped = {}
 
-        nv = v.replace(' ', '_')
-        nv = re.sub('[^0-9a-zA-Z_\-&#;]+', '', nv) # drop everything but alphanum and _-
+def clearMemos():
+    # back to a cold start, e.g. for benchmarks/micro.py
+    _sanitized.clear()
+    _tokens.clear()
+    _escaped.clear()
+
+def sanitize(s, replChar='_'):
+    # keyed on type too: u'x' == 'x', but callers get back what they passed in
+    key = (type(s), s, replChar)
+    r = _sanitized.get(key)
+    if r is None:
+        if len(_sanitized) >= MemoSize:
+            _sanitized.clear()
+        r = _sanitized[key] = NonAlnumRe.sub(replChar, s)
+    return r
 
-        r += nk + '=' + nv + ' '
+def _token(s):
+    # spaces become _, then everything but alphanum and _-&#; is dropped
+    key = (type(s), s)
+    r = _tokens.get(key)
+    if r is None:
+        if len(_tokens) >= MemoSize:
+            _tokens.clear()
+        if type(s) is str:
+            r = s.translate(SpaceToUnderscore, NonTokenBytes)
+        else:
+            r = NonTokenRe.sub('', s.replace(' ', '_'))
+        _tokens[key] = r
     return r
 
+def unrollEquals(sUnsorted):
+    return ''.join([_token(k) + '=' + _token(v) + ' '
+                    for k, v in sorted(sUnsorted.items())])
+
 def getOrUnknown(s):
     if not s:
         return "unknown"
@@ -68,113 +107,22 @@ def makeShortLabel(*n):
 def makeLongLabel(*n):
     return ' '.join([x for x in n if x])[:80]
 
+# a SelectionCache, set up by MegaTrackHub before the workers fork
+SelectionMemo = None
+
 def bigWigFilters(assembly, exp):
-    def fileFilters():
-        for ot in ["fold change over control",
-                   "signal of unique reads",
-                   "signal of all reads",
-                   "raw signal",
-                   "wavelet-smoothed signal",
-                   "percentage normalized signal",
-                   "read-depth normalized signal"
-                   ]:
-            yield lambda x: x.output_type == ot and x.isPooled
-            for rep in xrange(0, 5):
-                yield lambda x: x.output_type == ot and rep in x.bio_rep and len(x.tech_rep) > 1
-                yield lambda x: x.output_type == ot and rep in x.bio_rep and (str(rep) + '_' + str(rep)) in x.tech_rep
-                yield lambda x: x.output_type == ot and rep in x.bio_rep
-            yield lambda x: x.output_type == ot and [] == x.bio_rep
-            yield lambda x: x.output_type == ot and {} == x.bio_rep
-
-    def rnaFilters():
-        for ot in ["plus strand signal of unique reads",
-                   "minus strand signal of unique reads",
-                   "plus strand signal of all reads",
-                   "minus strand signal of all reads",
-                   "plus strand signal",
-                   "minus strand signal",
-                   "signal of unique reads",
-                   "signal of all reads",
-                   ]:
-            yield lambda x: x.output_type == ot and x.isPooled and x.genome_annotation
-            for rep in xrange(0, 5):
-                yield lambda x: x.output_type == ot and rep in x.bio_rep and x.genome_annotation
-            yield lambda x: x.output_type == ot and [] == x.bio_rep and x.genome_annotation
-            yield lambda x: x.output_type == ot and {} == x.bio_rep and x.genome_annotation
-
-            yield lambda x: x.output_type == ot and x.isPooled
-            for rep in xrange(0, 5):
-                yield lambda x: x.output_type == ot and rep in x.bio_rep
-            yield lambda x: x.output_type == ot and [] == x.bio_rep
-            yield lambda x: x.output_type == ot and {} == x.bio_rep
-
-    def otherFilters():
-        return [lambda bw: bw.isRawSignal() and bw.bio_rep == 1,
-                lambda bw: bw.isRawSignal() and bw.bio_rep == 2,
-                lambda bw: bw.isSignal() and bw.bio_rep == 1,
-                lambda bw: bw.isSignal() and bw.bio_rep == 2,
-                lambda bw: bw.isSignal()
-        ]
-
-    files = sorted(filter(lambda x: x.isBigWig() and x.assembly == assembly and x.isReleased(),
-                          exp.files), key=lambda f: f.fileID, reverse=True)
-
-    if exp.isRnaSeqLike():
-        for bf in rnaFilters():
-            bigWigs = filter(bf, files)
-            if 1 == len(bigWigs):
-                return bigWigs
-            if len(bigWigs) > 1:
-                trybw = filter(lambda x: 'tophat' not in x.submitted_file_name, bigWigs)
-                if 1 == len(trybw):
-                    # was an RNA-seq experiment w/ both STAR and TOPHAT files...
-                    return trybw
-                return [sorted(bigWigs, key=lambda x: x.fileID)[0]] # just choose one...
+    if SelectionMemo:
+        bigWigs, bigBeds, depth = SelectionMemo.select(assembly, exp)
     else:
-        for bf in fileFilters():
-            bigWigs = filter(bf, files)
-            if bigWigs:
-                if len(bigWigs) > 1:
-                    for bw in bigWigs:
-                        print(bw.expID, bw)
-                return sorted(bigWigs, key=lambda x: x.fileID)
-
-    for bf in otherFilters():
-        bigWigs = filter(bf, files)
-        if bigWigs:
-            return [bigWigs[0]] # TODO: fixme!
-
-    eprint("error: no files found after filtering...")
-    for f in files:
-        eprint(exp)
-        eprint(f)
-
-    return []
+        depth, bigWigs = FileSelector(assembly).bigWigsDepth(exp)
+    if Profile.enabled:
+        Profile.count("bigWigFilters depth %d" % depth)
+    return bigWigs
 
 def bigBedFilters(assembly, exp):
-    files = sorted(filter(lambda x: x.isBigBed() and x.assembly == assembly and x.isReleased(),
-                          exp.files), key=lambda f: f.fileID, reverse=True)
-
-    if exp.isRnaSeqLike():
-        return []
-
-    def fileFilters():
-        yield lambda x: x.isReplicatedPeaks()
-        yield lambda x: x.isBigBedNarrowPeak() and x.isIDRoptimal()
-        yield lambda x: x.isBigBedNarrowPeak() and x.isIDR()
-        yield lambda x: x.isBigBedNarrowPeak() and x.isReplicatedPeaks()
-        for rep in xrange(0, 5):
-            yield lambda x: x.isBigBedNarrowPeak() and rep in x.bio_rep
-        yield lambda x: x.isBigBedNarrowPeak()
-        yield lambda x: x.isBigBedBroadPeak()
-        yield lambda x: x.isPeaks()
-
-    for bf in fileFilters():
-        beds = filter(bf, files)
-        beds = filter(lambda x: x.assembly == assembly, beds)
-        if beds:
-            return beds
-    return []
+    if SelectionMemo:
+        return SelectionMemo.select(assembly, exp)[1]
+    return FileSelector(assembly).bigBeds(exp)
 
 html_escape_table = {
     "&": "&amp;",
@@ -188,7 +136,50 @@ html_escape_table = {
 
 def html_escape(text):
     """Produce entities within text."""
-    return "".join(html_escape_table.get(c,c) for c in text)
+    key = (type(text), text)
+    r = _escaped.get(key)
+    if r is None:
+        if len(_escaped) >= MemoSize:
+            _escaped.clear()
+        if type(text) is str:
+            # & first, so the entities added after it are left alone
+            r = text.replace("&", html_escape_table["&"])
+            for c in ['"', "'", ">", "<", ".", " "]:
+                r = r.replace(c, html_escape_table[c])
+        else:
+            r = "".join(html_escape_table.get(c,c) for c in text)
+        _escaped[key] = r
+    return r
+
+@contextmanager
+def atomicOpen(fnp):
+    # readers only ever see the old file or the complete new one; the tmp
+    #  name is unique per process and thread so concurrent writers never share it
+    tmp = "%s.%d.%d.tmp" % (fnp, os.getpid(), threading.current_thread().ident)
+    try:
+        with open(tmp, 'wb') as f:
+            yield f
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.rename(tmp, fnp)
+
+def atomicWrite(fnp, data):
+    with atomicOpen(fnp) as f:
+        f.write(data)
+
+def writeText(fnp, text):
+    # a composite is rendered in memory and written once; returns its line
+    #  count so nothing has to read the file back
+    Utils.ensureDir(fnp)
+    with open(fnp, 'wb') as f:
+        f.write(text)
+    Profile.count("bytes written", len(text))
+    return text.count('\n')
+
+def printWroteLines(fnp, numLines, *args):
+    printt("\twrote", fnp, '(' + "{:,}".format(numLines) + ' lines)', *args)
 
 def colorize(exp):
     c = "227,184,136"
@@ -0,0 +1,120 @@
+from __future__ import print_function
+
+import sys
+import os
+import json
+import marshal
+import hashlib
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils, eprint, printt
+
+import helpers as Helpers
+from assemblies import Assemblies
+
+# bump if what is stored changes shape
+CacheVersion = 1
+
+# the parts of globalData.<assembly>.json the builders read; the rest
+#  (creHistBins, chromCounts, helpKeys, ...) is never loaded
+GlobalDataFields = ["byCellType", "creBigBedsByCellType", "chromLens"]
+
+def _dicts(o):
+    # objects are stored as tuples of (key, value) in file order and rebuilt
+    #  by inserting in that order, as json.load does, so dicts iterate the
+    #  same as they would straight from the json (ccREexps depends on it)
+    t = type(o)
+    if t is tuple:
+        return dict([(k, _dicts(v)) for k, v in o])
+    if t is list:
+        return [_dicts(v) for v in o]
+    return o
+
+def _sha1(fnp):
+    h = hashlib.sha1()
+    with open(fnp, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), ''):
+            h.update(block)
+    return h.hexdigest()
+
+class ListsCache(object):
+    """The json files under lists/, parsed once and kept as marshal files.
+
+    Each cache file starts with a small header naming its source file's
+    mtime, size and sha1; a changed mtime only costs a rehash, a changed
+    hash a re-parse. Loads happen on first use and are remembered for the
+    life of the process, so forked workers inherit whatever was loaded.
+    """
+    def __init__(self, cacheDir):
+        self.cacheDir = cacheDir
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def globalData(self, assembly):
+        return self._get("globalData." + assembly, Assemblies[assembly]["globalData"],
+                         GlobalDataFields)
+
+    def cellTypeToTissue(self, assembly):
+        return self._get("cellTypeToTissue." + assembly,
+                         Assemblies[assembly]["cellTypeToTissue"], None)
+
+    def _get(self, name, srcFnp, fields):
+        with self.lock:
+            if name not in self.loaded:
+                self.loaded[name] = self._load(name, srcFnp, fields)
+            return self.loaded[name]
+
+    def _fnp(self, name):
+        return os.path.join(self.cacheDir, name + ".marshal")
+
+    def _load(self, name, srcFnp, fields):
+        st = os.stat(srcFnp)
+        fnp = self._fnp(name)
+        header = {"version": CacheVersion,
+                  "source": os.path.abspath(srcFnp),
+                  "fields": fields,
+                  "mtime": st.st_mtime,
+                  "size": st.st_size}
+
+        stored, data = self._read(fnp)
+        if stored:
+            same = all(stored.get(k) == v for k, v in header.iteritems())
+            if same:
+                return _dicts(data)
+            if all(stored.get(k) == header[k] for k in ["version", "source", "fields", "size"]):
+                # touched but maybe not changed; the hash decides
+                header["sha1"] = _sha1(srcFnp)
+                if stored.get("sha1") == header["sha1"]:
+                    self._write(fnp, header, data)
+                    return _dicts(data)
+
+        printt("parsing", srcFnp)
+        with open(srcFnp) as f:
+            data = json.load(f, object_pairs_hook=tuple)
+        if fields:
+            data = tuple((k, v) for k, v in data if k in fields)
+        if "sha1" not in header:
+            header["sha1"] = _sha1(srcFnp)
+        self._write(fnp, header, data)
+        return _dicts(data)
+
+    def _read(self, fnp):
+        if not os.path.exists(fnp):
+            return None, None
+        try:
+            with open(fnp, 'rb') as f:
+                header = marshal.load(f)
+                # a header from another cache version may not even be a dict
+                if not isinstance(header, dict) or header.get("version") != CacheVersion:
+                    return None, None
+                return header, marshal.load(f)
+        except (EOFError, ValueError, TypeError) as e:
+            eprint("lists cache: ignoring", fnp, e)
+            return None, None
+
+    def _write(self, fnp, header, data):
+        Utils.ensureDir(fnp)
+        with Helpers.atomicOpen(fnp) as f:
+            marshal.dump(header, f)
+            marshal.dump(data, f)
@@ -0,0 +1,140 @@
+from __future__ import print_function
+
+import sys
+import os
+import urlparse
+import threading
+from multiprocessing import Pool
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import eprint
+
+from bbi import readHeader, compareChroms, BBIError
+from viewlimits import lowestZoom, viewLimits, fileKey
+from profiler import Profile
+
+_chromLens = None
+
+def _init(chromLens):
+    global _chromLens
+    _chromLens = chromLens
+
+def _check(job):
+    # (fnp, problems, viewLimits); problems are None for a file that is not
+    #  in the mirror
+    fnp, kind, summarize = job
+    if not os.path.exists(fnp):
+        return fnp, None, None
+    try:
+        header = readHeader(fnp)
+        if header.kind != kind:
+            return fnp, ["a %s, expected a %s" % (header.kind, kind)], None
+        problems = compareChroms(header.chroms, _chromLens)
+        limits = None
+        if summarize and not problems:
+            records = lowestZoom(fnp)
+            if records is not None:
+                limits = viewLimits(records)
+        return fnp, problems, limits
+    except (BBIError, IOError, OSError, ValueError) as e:
+        return fnp, [str(e)], None
+
+class LocalFiles(object):
+    """Checks the mirrored copies of experiments' bigWigs and bigBeds.
+
+    A copy lives in mirrorDir under the name its url ends in. Headers and
+    chromosome trees are read on a pool of processes; a file whose copy is
+    not a whole bigWig/bigBed, or disagrees with the assembly's chromLens,
+    is dropped from its experiment so no stanza is written for it. Files
+    without a copy are kept. Given a ViewLimitsCache, each good bigWig is
+    also summarized from its coarsest zoom level, once per accession and
+    md5, into f.viewLimits. The pool is started here, so construct this
+    before any threads.
+    """
+    def __init__(self, mirrorDir, assembly, chromLens, j, limitsCache=None):
+        self.mirrorDir = mirrorDir
+        self.assembly = assembly
+        self.limitsCache = limitsCache
+        self.pool = Pool(j, initializer=_init, initargs=(chromLens,))
+        self.problems = {} # fnp -> problems, None if not mirrored
+        self.lock = threading.Lock()
+
+    def fnp(self, f):
+        return os.path.join(self.mirrorDir, os.path.basename(urlparse.urlsplit(f.url).path))
+
+    def _kind(self, f):
+        if f.assembly != self.assembly:
+            return None
+        if f.isBigWig():
+            return "bigWig"
+        if f.isBigBed():
+            return "bigBed"
+        return None
+
+    def _summarize(self, f, kind, fnp):
+        # whether a bigWig still needs summarizing; (accession, key) if so
+        if not self.limitsCache or "bigWig" != kind or not os.path.exists(fnp):
+            return None
+        key = fileKey(f, fnp)
+        if self.limitsCache.get(f.fileID, key)[0]:
+            return None
+        return f.fileID, key
+
+    def filter(self, exps):
+        jobs = {}
+        with self.lock:
+            for exp in exps:
+                for f in exp.files:
+                    kind = self._kind(f)
+                    fnp = kind and self.fnp(f)
+                    if kind and fnp not in self.problems and fnp not in jobs:
+                        jobs[fnp] = (kind, self._summarize(f, kind, fnp))
+        if jobs:
+            with Profile.stage(self.assembly + " check local files"):
+                results = self.pool.map(_check, [(fnp, kind, bool(summarize))
+                                                 for fnp, (kind, summarize)
+                                                 in sorted(jobs.iteritems())], 64)
+            with self.lock:
+                for fnp, problems, limits in results:
+                    self.problems[fnp] = problems
+                    summarize = jobs[fnp][1]
+                    if summarize and problems is not None and not problems:
+                        self.limitsCache.put(summarize[0], summarize[1], limits)
+                        Profile.count("bigWigs summarized")
+            Profile.count("local files checked",
+                          sum(1 for fnp, p, l in results if p is not None))
+
+        for exp in exps:
+            keep = [f for f in exp.files if not self._bad(exp, f)]
+            if len(keep) != len(exp.files):
+                exp.files = keep
+            if self.limitsCache:
+                for f in keep:
+                    self._setViewLimits(f)
+        return exps
+
+    def _setViewLimits(self, f):
+        if "bigWig" != self._kind(f):
+            return
+        fnp = self.fnp(f)
+        if self.problems.get(fnp) != []:
+            return
+        found, limits = self.limitsCache.get(f.fileID, fileKey(f, fnp))
+        if found and limits:
+            f.viewLimits = limits
+
+    def _bad(self, exp, f):
+        if not self._kind(f):
+            return False
+        problems = self.problems.get(self.fnp(f))
+        if not problems:
+            return False
+        eprint("dropping", exp.encodeID, f.fileID + ":", "; ".join(problems))
+        Profile.count("local files dropped")
+        return True
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        if self.limitsCache:
+            self.limitsCache.save()
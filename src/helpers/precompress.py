@@ -0,0 +1,134 @@
+from __future__ import print_function
+
+import sys
+import os
+import json
+import gzip
+import shutil
+import hashlib
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import eprint, printt
+
+import helpers as Helpers
+from profiler import Profile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# <release>/manifest.json: every served text file's sha1, size and mtime, plus
+#  the sizes of its .gz (and .br) siblings
+ManifestName = "manifest.json"
+ManifestVersion = 1
+
+def _sha1(fnp):
+    h = hashlib.sha1()
+    with open(fnp, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), ''):
+            h.update(block)
+    return h.hexdigest()
+
+def gzipFile(fnp, outFnp):
+    # no name and a zero timestamp in the header, so the same input always
+    #  gives the same bytes
+    with open(fnp, 'rb') as src:
+        with Helpers.atomicOpen(outFnp) as f:
+            with gzip.GzipFile(filename='', mode='wb', fileobj=f,
+                               compresslevel=9, mtime=0) as z:
+                shutil.copyfileobj(src, z, 1024 * 1024)
+
+def brotliFile(fnp, outFnp):
+    with open(fnp, 'rb') as src:
+        data = brotli.compress(src.read(), mode=brotli.MODE_TEXT)
+    Helpers.atomicWrite(outFnp, data)
+
+class Precompressor(object):
+    """Writes .gz (and with brotli, .br) siblings of a release's text files
+    for nginx's gzip_static, and a manifest of their content hashes.
+
+    nginx's ETag is the file's mtime and size, so a file whose hash matches
+    the previous release keeps that release's mtime, and its siblings are
+    linked from there rather than recompressed; an unchanged trackDb then
+    revalidates with a 304 across a publish.
+    """
+    def __init__(self, releaseDir, previousDir, useBrotli=False):
+        self.releaseDir = releaseDir
+        self.previousDir = previousDir
+        self.exts = [(".gz", gzipFile)]
+        if useBrotli:
+            self.exts.append((".br", brotliFile))
+        self.previous = self._loadManifest()
+
+    def _loadManifest(self):
+        if not self.previousDir:
+            return {}
+        fnp = os.path.join(self.previousDir, ManifestName)
+        if not os.path.exists(fnp):
+            return {}
+        try:
+            with open(fnp) as f:
+                manifest = json.load(f)
+        except ValueError as e:
+            eprint("precompress: ignoring", fnp, e)
+            return {}
+        if manifest.get("version") != ManifestVersion:
+            return {}
+        return manifest["files"]
+
+    def _texts(self):
+        # hub.txt, genomes.txt, trackDbs and shards, as paths under the release
+        for root, dirs, files in os.walk(self.releaseDir):
+            dirs.sort()
+            for fn in sorted(files):
+                if fn.endswith(".txt"):
+                    fnp = os.path.join(root, fn)
+                    yield os.path.relpath(fnp, self.releaseDir), fnp
+
+    def _link(self, prevFnp, fnp):
+        if os.path.exists(fnp):
+            os.remove(fnp)
+        try:
+            os.link(prevFnp, fnp)
+        except OSError:
+            shutil.copy2(prevFnp, fnp)
+
+    def _entry(self, rel, fnp):
+        entry = {"sha1": _sha1(fnp)}
+        prev = self.previous.get(rel)
+        unchanged = prev and prev["sha1"] == entry["sha1"]
+        if unchanged:
+            # same bytes as before: same mtime, so the same ETag
+            os.utime(fnp, (prev["mtime"], prev["mtime"]))
+        st = os.stat(fnp)
+        entry["size"] = st.st_size
+        entry["mtime"] = int(st.st_mtime)
+
+        for ext, compress in self.exts:
+            outFnp = fnp + ext
+            prevFnp = os.path.join(self.previousDir or '', rel + ext)
+            if unchanged and ext[1:] in prev and os.path.exists(prevFnp):
+                self._link(prevFnp, outFnp)
+                Profile.count("precompressed linked")
+            else:
+                compress(fnp, outFnp)
+                Profile.count("precompressed written")
+                Profile.count("bytes written", os.path.getsize(outFnp))
+            # gzip_static answers with the sibling's mtime; keep it the source's
+            os.utime(outFnp, (st.st_mtime, st.st_mtime))
+            entry[ext[1:]] = os.path.getsize(outFnp)
+        return entry
+
+    def run(self):
+        files = {}
+        with Profile.stage("precompress"):
+            for rel, fnp in self._texts():
+                files[rel] = self._entry(rel, fnp)
+        fnp = os.path.join(self.releaseDir, ManifestName)
+        Helpers.atomicWrite(fnp, json.dumps({"version": ManifestVersion, "files": files},
+                                            indent=2, sort_keys=True) + '\n')
+        plain = sum(e["size"] for e in files.values())
+        gz = sum(e["gz"] for e in files.values())
+        printt("\twrote", fnp, "(%d files, %s bytes, %s gzipped)" % (
+            len(files), "{:,}".format(plain), "{:,}".format(gz)))
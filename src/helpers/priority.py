@@ -0,0 +1,45 @@
+from __future__ import print_function
+
+class PriorityPlanner(object):
+    """trackDb priorities, handed out by the parent process in a fixed order.
+
+    Workers render each composite with priorities from 0 and report how many
+    tracks it has; the parent reserve()s a contiguous range per composite, in
+    job order, and shifts the composite's priorities into it.
+    """
+    def __init__(self, initval=0):
+        self.val = initval
+
+    # pre-fix add a given val
+    def increment(self, val=1):
+        self.val += val
+        return self.val
+
+    # start of a block of count priorities; one counter serves every super track
+    def reserve(self, count, superTrack=None):
+        start = self.val
+        self.val += count
+        return start
+
+    def value(self):
+        return self.val
+
+class ShardPriorityPlanner(object):
+    """trackDb priorities for --shard, where each super track is its own file.
+
+    UCSC only compares priorities between siblings, so each super track
+    numbers its composites' tracks from 1 by itself and the super tracks
+    are numbered among themselves. Adding or dropping a track then changes
+    the bytes of its own shard only, not of every shard after it.
+    """
+    def __init__(self):
+        self.superTracks = PriorityPlanner()
+        self.shards = {}
+
+    def increment(self, val=1):
+        return self.superTracks.increment(val)
+
+    def reserve(self, count, superTrack=None):
+        if superTrack not in self.shards:
+            self.shards[superTrack] = PriorityPlanner(1)
+        return self.shards[superTrack].reserve(count)
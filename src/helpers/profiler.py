@@ -0,0 +1,107 @@
+from __future__ import print_function
+
+import sys
+import os
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils
+
+# python 2 lacks the constant; 1 on Linux
+RusageThread = getattr(resource, "RUSAGE_THREAD", 1)
+
+def cpuTime():
+    # this thread's CPU seconds, so stages on concurrent threads don't
+    #  charge each other; the whole process where threads can't be told apart
+    try:
+        r = resource.getrusage(RusageThread)
+    except (ValueError, resource.error):
+        r = resource.getrusage(resource.RUSAGE_SELF)
+    return r.ru_utime + r.ru_stime
+
+class Profiler(object):
+    """Wall and CPU seconds per stage plus event counters, for --profile.
+
+    Does nothing until enabled. Pool workers inherit it when forked, record
+    into their own copy and hand what they recorded back with each result
+    (see scheduler), so the main process ends up with the whole run.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # also run by each pool worker as it starts, so it only hands back
+        #  what it recorded itself, not what it inherited from the fork
+        self.stages = defaultdict(lambda: [0, 0.0, 0.0]) # calls, wall, cpu
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.time(), cpuTime()
+        try:
+            yield
+        finally:
+            wall, cpu = time.time() - wall, cpuTime() - cpu
+            with self.lock:
+                s = self.stages[name]
+                s[0] += 1
+                s[1] += wall
+                s[2] += cpu
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += n
+
+    def drain(self):
+        # what was recorded since the last drain, e.g. by one pool job
+        if not self.enabled:
+            return None
+        with self.lock:
+            ret = {"stages": dict(self.stages), "counters": dict(self.counters)}
+            self.reset()
+        return ret
+
+    def merge(self, recorded):
+        if not recorded:
+            return
+        with self.lock:
+            for name, (calls, wall, cpu) in recorded["stages"].iteritems():
+                s = self.stages[name]
+                s[0] += calls
+                s[1] += wall
+                s[2] += cpu
+            for name, n in recorded["counters"].iteritems():
+                self.counters[name] += n
+
+    def load(self, fnp):
+        # a report saved by another process, e.g. one assembly's build
+        with open(fnp) as f:
+            report = json.load(f)
+        self.merge({"stages": {name: (s["calls"], s["wall"], s["cpu"])
+                               for name, s in report["stages"].iteritems()},
+                    "counters": report["counters"]})
+
+    def save(self, fnp, **extra):
+        with self.lock:
+            stages = {name: {"calls": calls, "wall": wall, "cpu": cpu}
+                      for name, (calls, wall, cpu) in self.stages.iteritems()}
+            report = dict(extra)
+            report.update({"stages": stages,
+                           "counters": dict(self.counters)})
+        Utils.ensureDir(fnp)
+        with open(fnp, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+Profile = Profiler()
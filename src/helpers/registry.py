@@ -0,0 +1,74 @@
+from __future__ import print_function
+
+import sys
+import os
+import threading
+from multiprocessing.pool import ThreadPool
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import eprint, printt
+
+class ExperimentRegistry(object):
+    """Experiments of one assembly, each MetadataWS collection fetched at most once.
+
+    Builders get a fresh list per call (they sort in place), but the Exp
+    objects in it are shared: one instance per accession across collections.
+    Hydrated experiments always come from mw.exps, never from a collection,
+    so what the by-biosample view sees does not depend on which collections
+    other builders happened to load first. A fileFilter, e.g.
+    LocalFiles.filter, sees each experiment as it arrives, before any other
+    builder can get hold of it.
+    """
+    def __init__(self, mw, fileFilter=None):
+        self.mw = mw
+        self.fileFilter = fileFilter
+        self.byAccession = {}
+        self.collections = {}
+        self.hydrated = {}
+        self.lock = threading.Lock()
+        self.fetchLocks = {}
+
+    def get(self, name):
+        with self.lock:
+            fetchLock = self.fetchLocks.setdefault(name, threading.Lock())
+        with fetchLock:
+            if name not in self.collections:
+                printt("fetching", name, "...")
+                exps = getattr(self.mw, name)()
+                if self.fileFilter:
+                    self.fileFilter(exps)
+                with self.lock:
+                    self.collections[name] = self._canonical(exps)
+        return list(self.collections[name])
+
+    def hydrate(self, expIDs, batchSize=200, threads=8):
+        # accessions not hydrated yet go over the wire, in sorted batches so
+        #  cached responses line up from run to run
+        with self.lock:
+            missing = sorted(set(e for e in expIDs if e not in self.hydrated))
+        batches = [missing[i:i + batchSize] for i in xrange(0, len(missing), batchSize)]
+        if batches:
+            printt("hydrating", len(missing), "exps in", len(batches), "batches...")
+            pool = ThreadPool(min(threads, len(batches)))
+            try:
+                results = pool.map(self.mw.exps, batches)
+            finally:
+                pool.close()
+                pool.join()
+            if self.fileFilter:
+                self.fileFilter([exp for exps in results for exp in exps])
+            with self.lock:
+                for exps in results:
+                    for exp in exps:
+                        self.hydrated.setdefault(exp.encodeID, exp)
+
+        ret = {}
+        for expID in expIDs:
+            if expID in self.hydrated:
+                ret[expID] = self.hydrated[expID]
+            else:
+                eprint("missing exp", expID)
+        return ret
+
+    def _canonical(self, exps):
+        return [self.byAccession.setdefault(exp.encodeID, exp) for exp in exps]
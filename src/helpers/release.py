@@ -0,0 +1,104 @@
+from __future__ import print_function
+
+import sys
+import os
+import time
+import fcntl
+import shutil
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils, printt
+
+# www-releases/
+#   .staging/<RunID>/   a build in progress, private to that run
+#   <RunID>/            a published build
+#   current -> <RunID>  what nginx serves
+#   previous -> <RunID> what current pointed at before the last publish
+Current = "current"
+Previous = "previous"
+StagingDir = ".staging"
+LockFile = ".lock"
+# a staged build this old was left by a run that died or did not publish
+StaleStagingHours = 48
+
+class Releases(object):
+    def __init__(self, releasesDir):
+        self.releasesDir = releasesDir
+
+    def staging(self, runID):
+        return os.path.join(self.releasesDir, StagingDir, runID)
+
+    def target(self, link):
+        fnp = os.path.join(self.releasesDir, link)
+        if not os.path.islink(fnp):
+            return None
+        return os.readlink(fnp)
+
+    @contextmanager
+    def _locked(self):
+        # publishes and rollbacks from overlapping runs take turns; builds
+        #  themselves never need the lock
+        fnp = os.path.join(self.releasesDir, LockFile)
+        Utils.ensureDir(fnp)
+        with open(fnp, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _link(self, link, runID):
+        # rename(2) over the old symlink, so readers see either release,
+        #  never a missing one; relative so it resolves inside containers too
+        fnp = os.path.join(self.releasesDir, link)
+        tmp = "%s.%d.tmp" % (fnp, os.getpid())
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(runID, tmp)
+        os.rename(tmp, fnp)
+
+    def _prune(self):
+        keep = set([self.target(Current), self.target(Previous)])
+        for runID in os.listdir(self.releasesDir):
+            fnp = os.path.join(self.releasesDir, runID)
+            if runID.startswith('.') or runID in keep or os.path.islink(fnp):
+                continue
+            if os.path.isdir(fnp):
+                printt("removing old release", runID)
+                shutil.rmtree(fnp)
+
+        stagingDir = os.path.join(self.releasesDir, StagingDir)
+        if not os.path.isdir(stagingDir):
+            return
+        cutoff = time.time() - StaleStagingHours * 3600
+        for runID in os.listdir(stagingDir):
+            fnp = os.path.join(stagingDir, runID)
+            if os.path.isdir(fnp) and os.path.getmtime(fnp) < cutoff:
+                printt("removing stale staged build", runID)
+                shutil.rmtree(fnp, ignore_errors=True)
+
+    def publish(self, runID):
+        with self._locked():
+            os.rename(self.staging(runID), os.path.join(self.releasesDir, runID))
+            old = self.target(Current)
+            if old:
+                self._link(Previous, old)
+            self._link(Current, runID)
+            self._prune()
+        printt("published", runID, "(previous:", str(old) + ")")
+
+    def rollback(self):
+        with self._locked():
+            old, prev = self.target(Current), self.target(Previous)
+            if not prev:
+                raise Exception("no previous release to roll back to")
+            self._link(Current, prev)
+            if old:
+                self._link(Previous, old)
+        printt("rolled back to", prev, "(previous:", str(old) + ")")
+
+    def discard(self, runID):
+        fnp = self.staging(runID)
+        if os.path.exists(fnp):
+            shutil.rmtree(fnp)
@@ -0,0 +1,86 @@
+from __future__ import print_function
+
+import sys
+import os
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import printt
+
+import helpers as Helpers
+from profiler import Profile
+from buildcache import shiftPriorities
+
+def work(stage, f, args):
+    # runs on a pool worker; what the worker's profiler recorded and the file
+    #  picks it made for this job travel back with the result
+    with Profile.stage(stage):
+        ret = f(*args)
+    picks = Helpers.SelectionMemo.drain() if Helpers.SelectionMemo else None
+    return ret, Profile.drain(), picks
+
+def write(job, text):
+    numLines = Helpers.writeText(job["fnp"], text)
+    Helpers.printWroteLines(job["fnp"], numLines, job["idx"], 'of', job["total"])
+
+class TaskGraph(object):
+    """Runs the composite jobs of several builders on one shared pool of j processes.
+
+    Per builder the nodes are: prepare (metadata fetch, on a thread) ->
+    render each job, priorities from 0 -> reserve priorities, renumber and
+    write each composite in the parent. Builders prepare concurrently and
+    their render nodes are queued the moment they are ready, so later
+    builders' fetches overlap earlier builders' rendering. Priorities are
+    still reserved in builder order, which keeps the output independent of
+    what finished first.
+    """
+    def __init__(self, j):
+        self.j = j
+
+    def run(self, builders):
+        if not builders:
+            return
+
+        # fork the workers before any threads exist
+        pool = Pool(self.j, initializer=Profile.reset)
+        threads = ThreadPool(len(builders))
+
+        def stage(builder, step):
+            return "%s %s %s" % (builder.assembly, step, builder.__class__.__name__)
+
+        def prepare(builder):
+            with Profile.stage(stage(builder, "prepare")):
+                builder.prepare()
+            renderF = builder.worker()
+            jobs = builder.jobs()
+            renders = [pool.apply_async(work, (stage(builder, "render"), renderF,
+                                               (builder.cache, job)))
+                       for job in jobs]
+            return jobs, renders
+
+        try:
+            prepared = [threads.apply_async(prepare, (b,)) for b in builders]
+
+            for builder, p in zip(builders, prepared):
+                jobs, renders = p.get()
+                printt("making tracks and subtracks for",
+                       builder.__class__.__name__, "...")
+                for job, r in zip(jobs, renders):
+                    (numTracks, text), recorded, picks = r.get()
+                    Profile.merge(recorded)
+                    if picks:
+                        Helpers.SelectionMemo.merge(picks)
+                    start = builder.priority.reserve(numTracks,
+                                                     (builder.__class__.__name__,
+                                                      builder.superTrackOf(job)))
+                    write(job, shiftPriorities(text, start))
+                builder.reserveSuperTracks()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            threads.close()
+            threads.join()
+        pool.close()
+        pool.join()
@@ -0,0 +1,202 @@
+from __future__ import print_function
+
+import sys
+import os
+from collections import OrderedDict, defaultdict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import eprint
+
+# Picks the bigWig(s) and bigBed(s) to show for an experiment. The order of
+#  preference is the one the old filter cascades spelled out lambda by lambda:
+#  output type first, then pooled/replicate/tech-rep within it. Each file is
+#  ranked once against that order instead of the file list being re-scanned
+#  per rule; whatever shares the best rank is what the first matching rule
+#  would have returned.
+
+SignalOutputTypes = ["fold change over control",
+                     "signal of unique reads",
+                     "signal of all reads",
+                     "raw signal",
+                     "wavelet-smoothed signal",
+                     "percentage normalized signal",
+                     "read-depth normalized signal"]
+
+RnaSignalOutputTypes = ["plus strand signal of unique reads",
+                        "minus strand signal of unique reads",
+                        "plus strand signal of all reads",
+                        "minus strand signal of all reads",
+                        "plus strand signal",
+                        "minus strand signal",
+                        "signal of unique reads",
+                        "signal of all reads"]
+
+NumReps = 5
+
+def signalRank(f):
+    # pooled; per replicate: tech reps merged, rep_rep, any; no replicate
+    if f.isPooled:
+        return 0
+    for rep in xrange(0, NumReps):
+        if rep in f.bio_rep:
+            if len(f.tech_rep) > 1:
+                return 1 + 3 * rep
+            if (str(rep) + '_' + str(rep)) in f.tech_rep:
+                return 2 + 3 * rep
+            return 3 + 3 * rep
+    if [] == f.bio_rep:
+        return 1 + 3 * NumReps
+    if {} == f.bio_rep:
+        return 2 + 3 * NumReps
+    return None
+
+def rnaSignalRank(f):
+    # the same replicate order, files with a genome annotation ahead of those without
+    rank = None
+    if f.isPooled:
+        rank = 0
+    else:
+        for rep in xrange(0, NumReps):
+            if rep in f.bio_rep:
+                rank = 1 + rep
+                break
+        else:
+            if [] == f.bio_rep:
+                rank = 1 + NumReps
+            elif {} == f.bio_rep:
+                rank = 2 + NumReps
+    if rank is None or f.genome_annotation:
+        return rank
+    return rank + 3 + NumReps
+
+def fallbackSignalRank(f):
+    if f.isRawSignal() and f.bio_rep == 1:
+        return 0
+    if f.isRawSignal() and f.bio_rep == 2:
+        return 1
+    if f.isSignal() and f.bio_rep == 1:
+        return 2
+    if f.isSignal() and f.bio_rep == 2:
+        return 3
+    if f.isSignal():
+        return 4
+    return None
+
+def bigBedRank(f):
+    if f.isReplicatedPeaks():
+        return 0
+    if f.isBigBedNarrowPeak():
+        if f.isIDRoptimal():
+            return 1
+        if f.isIDR():
+            return 2
+        for rep in xrange(0, NumReps):
+            if rep in f.bio_rep:
+                return 3 + rep
+        return 3 + NumReps
+    if f.isBigBedBroadPeak():
+        return 4 + NumReps
+    if f.isPeaks():
+        return 5 + NumReps
+    return None
+
+def best(files, rankF):
+    # files sharing the lowest rank, in their original order
+    ranks = [rankF(f) for f in files]
+    ranked = [r for r in ranks if r is not None]
+    if not ranked:
+        return []
+    top = min(ranked)
+    return [f for f, r in zip(files, ranks) if r == top]
+
+class ExpFiles(object):
+    # an experiment's released files for one assembly, indexed once
+    def __init__(self, assembly, exp):
+        self.bigWigs = []
+        self.bigBeds = []
+        for f in exp.files:
+            if f.assembly != assembly or not f.isReleased():
+                continue
+            if f.isBigWig():
+                self.bigWigs.append(f)
+            elif f.isBigBed():
+                self.bigBeds.append(f)
+        self.bigWigs.sort(key=lambda f: f.fileID, reverse=True)
+        self.bigBeds.sort(key=lambda f: f.fileID, reverse=True)
+
+        self.bigWigsByOutputType = defaultdict(list)
+        for f in self.bigWigs:
+            self.bigWigsByOutputType[f.output_type].append(f)
+
+class FileSelector(object):
+    def __init__(self, assembly):
+        self.assembly = assembly
+
+    def select(self, exps):
+        # encodeID -> (bigWigs, bigBeds, depth) for a whole batch of
+        #  experiments; depth is the bigWig rule that matched, 0 for none
+        ret = OrderedDict()
+        for exp in exps:
+            files = ExpFiles(self.assembly, exp)
+            depth, bigWigs = self._bigWigs(exp, files)
+            self.report(exp, bigWigs, depth, files)
+            ret[exp.encodeID] = (bigWigs, self._bigBeds(exp, files), depth)
+        return ret
+
+    def bigWigsDepth(self, exp):
+        files = ExpFiles(self.assembly, exp)
+        depth, bigWigs = self._bigWigs(exp, files)
+        self.report(exp, bigWigs, depth, files)
+        return depth, bigWigs
+
+    def bigWigs(self, exp):
+        return self.bigWigsDepth(exp)[1]
+
+    def bigBeds(self, exp):
+        return self._bigBeds(exp, ExpFiles(self.assembly, exp))
+
+    def _bigWigs(self, exp, files):
+        # (depth, bigWigs): 1-based position of the output type that matched,
+        #  one past them for the fallback, 0 if nothing did
+        if exp.isRnaSeqLike():
+            outputTypes = RnaSignalOutputTypes
+            for depth, ot in enumerate(outputTypes, 1):
+                bigWigs = best(files.bigWigsByOutputType.get(ot, []), rnaSignalRank)
+                if 1 == len(bigWigs):
+                    return depth, bigWigs
+                if len(bigWigs) > 1:
+                    trybw = filter(lambda x: 'tophat' not in x.submitted_file_name, bigWigs)
+                    if 1 == len(trybw):
+                        # was an RNA-seq experiment w/ both STAR and TOPHAT files...
+                        return depth, trybw
+                    return depth, [sorted(bigWigs, key=lambda x: x.fileID)[0]] # just choose one...
+        else:
+            outputTypes = SignalOutputTypes
+            for depth, ot in enumerate(outputTypes, 1):
+                bigWigs = best(files.bigWigsByOutputType.get(ot, []), signalRank)
+                if bigWigs:
+                    return depth, sorted(bigWigs, key=lambda x: x.fileID)
+
+        bigWigs = best(files.bigWigs, fallbackSignalRank)
+        if bigWigs:
+            return len(outputTypes) + 1, [bigWigs[0]] # TODO: fixme!
+
+        return 0, []
+
+    def report(self, exp, bigWigs, depth, files=None):
+        # what picking an experiment's bigWigs prints; SelectionCache repeats
+        #  it for picks it remembered
+        if len(bigWigs) > 1:
+            for bw in bigWigs:
+                print(bw.expID, bw)
+        if not depth:
+            files = files or ExpFiles(self.assembly, exp)
+            eprint("error: no files found after filtering...")
+            for f in files.bigWigs:
+                eprint(exp)
+                eprint(f)
+
+    def _bigBeds(self, exp, files):
+        if exp.isRnaSeqLike():
+            return []
+        return best(files.bigBeds, bigBedRank)
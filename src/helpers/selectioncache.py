@@ -0,0 +1,117 @@
+from __future__ import print_function
+
+import sys
+import os
+import json
+import hashlib
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils, eprint
+
+import helpers as Helpers
+from selection import FileSelector
+
+# what FileSelector reads of a file, directly or through its is*() methods
+SelectionFields = ("fileID", "assembly", "status", "file_type", "output_type",
+                   "isPooled", "bio_rep", "tech_rep", "genome_annotation",
+                   "submitted_file_name", "md5sum")
+
+def _sourceDigest():
+    fnp = os.path.join(os.path.dirname(__file__), "selection.py")
+    with open(fnp, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class SelectionCache(object):
+    """Best bigWig/bigBed picks per (assembly, accession, file list).
+
+    Every view selects files for the same experiments; the first one to get
+    there remembers the picks, as indices into exp.files. Workers hand the
+    picks they made back to the parent with drain(), which merges them and
+    save()s one json per assembly once the views are built; later runs
+    reuse them until the experiment's files or the selection rules change.
+    When disabled, picks are only remembered within a process.
+    """
+    def __init__(self, cacheDir, enabled=True):
+        self.cacheDir = cacheDir
+        self.enabled = enabled
+        self.version = _sourceDigest()
+        self.stored = {} # assembly -> accession -> picks
+        self.new = {}    # the same, made since the last drain()
+        self.last = None
+
+    def key(self, exp):
+        h = hashlib.sha1(self.version)
+        h.update(str(exp.isRnaSeqLike()))
+        for f in exp.files:
+            h.update(repr(tuple(getattr(f, k, None) for k in SelectionFields)))
+        return h.hexdigest()
+
+    def _fnp(self, assembly):
+        return os.path.join(self.cacheDir, assembly + ".json")
+
+    def _stored(self, assembly):
+        if assembly in self.stored:
+            return self.stored[assembly]
+        entries = {}
+        fnp = self._fnp(assembly)
+        if self.enabled and os.path.exists(fnp):
+            try:
+                with open(fnp) as f:
+                    stored = json.load(f)
+                if stored.get("version") == self.version:
+                    entries = stored["exps"]
+            except ValueError as e:
+                eprint("selection cache: ignoring", fnp, e)
+        self.stored[assembly] = entries
+        return entries
+
+    def drain(self):
+        # picks made here since the last call, for the parent to merge
+        ret, self.new = self.new, {}
+        return ret
+
+    def merge(self, picks):
+        for assembly, entries in picks.iteritems():
+            self._stored(assembly).update(entries)
+            self.new.setdefault(assembly, {}).update(entries)
+
+    def save(self):
+        # the parent, once every view is built
+        if not self.enabled:
+            return
+        for assembly in self.drain():
+            fnp = self._fnp(assembly)
+            Utils.ensureDir(fnp)
+            Helpers.atomicWrite(fnp, json.dumps({"version": self.version,
+                                                 "exps": self._stored(assembly)},
+                                                sort_keys=True))
+
+    def _pick(self, assembly, exp):
+        key = self.key(exp)
+        entries = self._stored(assembly)
+        entry = entries.get(exp.encodeID)
+        if entry and entry["key"] == key:
+            bigWigs = [exp.files[i] for i in entry["bigWigs"]]
+            FileSelector(assembly).report(exp, bigWigs, entry["depth"])
+            return entry
+        bigWigs, bigBeds, depth = FileSelector(assembly).select([exp])[exp.encodeID]
+        idx = {id(f): i for i, f in enumerate(exp.files)}
+        entry = {"key": key,
+                 "bigWigs": [idx[id(f)] for f in bigWigs],
+                 "bigBeds": [idx[id(f)] for f in bigBeds],
+                 "depth": depth}
+        entries[exp.encodeID] = entry
+        if self.enabled:
+            self.new.setdefault(assembly, {})[exp.encodeID] = entry
+        return entry
+
+    def select(self, assembly, exp):
+        # tracks ask for the bigWigs and then the bigBeds of the same exp
+        if self.last and self.last[0] is exp and self.last[1] == assembly:
+            return self.last[2]
+        entry = self._pick(assembly, exp)
+        ret = ([exp.files[i] for i in entry["bigWigs"]],
+               [exp.files[i] for i in entry["bigBeds"]],
+               entry["depth"])
+        self.last = (exp, assembly, ret)
+        return ret
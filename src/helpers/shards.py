@@ -0,0 +1,122 @@
+from __future__ import print_function
+
+import sys
+import os
+import json
+import shutil
+import hashlib
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils, eprint, printt
+
+import helpers as Helpers
+from profiler import Profile
+
+# <assembly>/
+#   trackDb.txt                       include lines only, in trackDb order
+#   shards.json                       shard -> sha1 of its bytes
+#   shards/<view>/super_<key>.txt     one super track and its composites
+ShardsDir = "shards"
+ManifestName = "shards.json"
+ManifestVersion = 1
+
+class ShardWriter(object):
+    """Writes an assembly's trackDb as one include file per super track.
+
+    Every shard is hashed before it is written; one whose hash matches the
+    same shard in the previous release is hard-linked from there instead,
+    so a rebuild only writes the shards that changed and unchanged ones keep
+    their inode and mtime.
+    """
+    def __init__(self, assemblyDir, previousDir):
+        self.assemblyDir = assemblyDir
+        self.previousDir = previousDir
+        self.previous = self._loadManifest()
+
+    def _loadManifest(self):
+        if not self.previousDir:
+            return {}
+        fnp = os.path.join(self.previousDir, ManifestName)
+        if not os.path.exists(fnp):
+            return {}
+        try:
+            with open(fnp) as f:
+                manifest = json.load(f)
+        except ValueError as e:
+            eprint("shards: ignoring", fnp, e)
+            return {}
+        if manifest.get("version") != ManifestVersion:
+            return {}
+        return manifest["shards"]
+
+    def _parts(self, stanza, compositeFnps):
+        # the shard's bytes, a block at a time
+        yield stanza
+        for compositeFnp in compositeFnps:
+            with open(compositeFnp, 'rb') as c:
+                for block in iter(lambda: c.read(1024 * 1024), ''):
+                    yield block
+            yield '\n'
+
+    def _reuse(self, rel, sha1, fnp):
+        if self.previous.get(rel) != sha1:
+            return False
+        prevFnp = os.path.join(self.previousDir, rel)
+        if not os.path.exists(prevFnp):
+            return False
+        try:
+            os.link(prevFnp, fnp)
+        except OSError:
+            # another filesystem; a copy still keeps the old mtime
+            shutil.copy2(prevFnp, fnp)
+        return True
+
+    def write(self, builders):
+        shards = OrderedDict()
+        written = 0
+        for typ, b in builders:
+            for name, stanza, compositeFnps in b.shards():
+                rel = os.path.join(ShardsDir, typ, name + ".txt")
+                fnp = os.path.join(self.assemblyDir, rel)
+                Utils.ensureDir(fnp)
+
+                h = hashlib.sha1()
+                for part in self._parts(stanza, compositeFnps):
+                    h.update(part)
+                shards[rel] = h.hexdigest()
+
+                if self._reuse(rel, shards[rel], fnp):
+                    Profile.count("shards linked")
+                    continue
+                with Helpers.atomicOpen(fnp) as f:
+                    for part in self._parts(stanza, compositeFnps):
+                        f.write(part)
+                Profile.count("shards written")
+                Profile.count("bytes written", os.path.getsize(fnp))
+                written += 1
+
+        Helpers.atomicWrite(os.path.join(self.assemblyDir, ManifestName),
+                            json.dumps({"version": ManifestVersion, "shards": shards},
+                                       indent=2) + '\n')
+        fnp = os.path.join(self.assemblyDir, 'trackDb.txt')
+        Helpers.atomicWrite(fnp, ''.join(["include %s\n" % rel for rel in shards]))
+        printt("\twrote", fnp, "(%d of %d shards changed)" % (written, len(shards)))
+
+def rehash(releaseDir, fnps):
+    # shards rewritten after ShardWriter hashed them, e.g. by --direct-urls,
+    #  get the hash of their bytes as published, so a later build only links
+    #  a shard whose published bytes match what it generates
+    byAssembly = {}
+    for fnp in fnps:
+        parts = os.path.relpath(fnp, releaseDir).split(os.sep)
+        if len(parts) > 2 and ShardsDir == parts[1]:
+            byAssembly.setdefault(parts[0], []).append(os.path.join(*parts[1:]))
+    for assembly, rels in byAssembly.iteritems():
+        fnp = os.path.join(releaseDir, assembly, ManifestName)
+        with open(fnp) as f:
+            manifest = json.load(f, object_pairs_hook=OrderedDict)
+        for rel in rels:
+            with open(os.path.join(releaseDir, assembly, rel), 'rb') as f:
+                manifest["shards"][rel] = hashlib.sha1(f.read()).hexdigest()
+        Helpers.atomicWrite(fnp, json.dumps(manifest, indent=2) + '\n')
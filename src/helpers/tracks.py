@@ -9,6 +9,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils
 from utils import Utils, eprint, AddPath, printt, printWroteNumLines
 
 import helpers as Helpers
+from profiler import Profile
 from byAll import GetTissue, ColorByTissue
 
 class LookupActive:
@@ -34,57 +35,101 @@ class LookupActiveForCcREs:
                           "B_cell_adult"]
         return r
 
-def outputLines(d, indentLevel, extras = {}):
-    prefix = '\t' * indentLevel
-    for k, v in d.iteritems():
-        if v:
-            yield prefix + k + " " + str(v) + '\n'
-    for k, v in extras.iteritems():
-        if v:
-            yield prefix + k + " " + str(v) + '\n'
-    yield '\n'
+class StanzaTemplate(object):
+    """One trackDb stanza layout, compiled once per track class.
+
+    Tracks keep their settings as a flat list in keys order; render() fills
+    them into a single format string. Settings with an empty value are left
+    out of the stanza, so those (rare) stanzas take the slower per-key path.
+    """
+    def __init__(self, keys, indentLevel):
+        prefix = '\t' * indentLevel
+        self.keys = keys
+        self.index = {k: i for i, k in enumerate(keys)}
+        self.heads = [prefix + k + " " for k in keys]
+        self.priorityHead = prefix + "priority "
+        body = ''.join(h + "%s\n" for h in self.heads)
+        self.fmt = body + '\n'
+        self.fmtPriority = body + self.priorityHead + "%s\n\n"
+
+    def render(self, values, priority=None):
+        if all(values):
+            values = tuple(str(v) for v in values)
+            if priority is not None:
+                return self.fmtPriority % (values + (priority,))
+            return self.fmt % values
+        ret = [h + str(v) + '\n' for h, v in zip(self.heads, values) if v]
+        if priority is not None:
+            ret.append(self.priorityHead + str(priority) + '\n')
+        ret.append('\n')
+        return ''.join(ret)
+
+def share(s):
+    # one copy of a value repeated on many tracks of a composite
+    if type(s) is str:
+        return intern(s)
+    return s
 
 class Parent:
     def __init__(self, parent, on):
         self.parent = parent
         self.on = on
+        self.params = (share(parent + ' off'), share(parent + ' on'))
 
     def param(self, active):
-        if active:
-            return self.parent + ' on'
-        return self.parent + ' off'
+        return self.params[bool(active)]
 
     def initials(self):
         return self.parent[:3] + '_'
 
+def collect(subGroups, presentation):
+    for k, v in presentation.iteritems():
+        subGroups[k].add(v)
+
 class BigWigTrack(object):
-    def __init__(self, assembly, exp, f, parent, active):
+    __slots__ = ("assembly", "exp", "f", "parent", "active", "p")
+    view = "bigWig"
+
+    Template = StanzaTemplate(("track", "parent", "subGroups", "bigDataUrl",
+                               "visibility", "type", "color", "height",
+                               "shortLabel", "longLabel", "itemRgb",
+                               "darkerLabels", "metadata", "view"), 1)
+    # files summarized by --view-limits get a fixed scale instead of the
+    #  composite's autoScale; their height is left alone: UCSC takes it from
+    #  the composite's maxHeightPixels (the "height" line here is not a
+    #  setting it reads), and one height per composite keeps its subtracks
+    #  comparable side by side
+    TemplateLimits = StanzaTemplate(Template.keys + ("autoScale", "viewLimits"), 1)
+
+    def __init__(self, assembly, exp, f, parent, active, subGroups=None):
         self.assembly = assembly
         self.exp = exp
         self.f = f
         self.parent = parent
         self.active = active
-        self.view = "bigWig"
-        self.presentation = {}
-        self.p = self._init()
-
-    def _init(self):
-        p = OrderedDict()
-        p["track"] = self.parent.initials() + Helpers.sanitize(self.f.expID + '_' + self.f.fileID)
-        p["parent"] = self.parent.param(self.active)
-        p["subGroups"] = Helpers.unrollEquals(self._subgroups())
-        p["bigDataUrl"] = self._url()
-        p["visibility"] = Helpers.viz("full", self.active)
-        p["type"] = "bigWig"
-        p["color"] = Helpers.colorize(self.exp)
-        p["height"] = "maxHeightPixels 64:12:8"
-        p["shortLabel"] = Helpers.makeShortLabel(self.exp.assay_term_name, self.exp.biosample_term_name)
-        p["longLabel"] = Helpers.makeLongLabel(self.exp.assay_term_name + ' ' + self._desc())
-        p["itemRgb"] = "On"
-        p["darkerLabels"] = "on"
-        p["metadata"] = Helpers.unrollEquals(self._metadata())
-        p["view"] = self.view
-        return p
+        self.p = self._init(subGroups)
+        limits = getattr(f, "viewLimits", None)
+        if limits:
+            self.p += ["off", limits]
+
+    def _init(self, subGroups):
+        s = self._subgroups()
+        if subGroups is not None:
+            collect(subGroups, self._presentation(s))
+        return [self.parent.initials() + Helpers.sanitize(self.f.expID + '_' + self.f.fileID),
+                self.parent.param(self.active),
+                Helpers.unrollEquals(s),
+                self._url(),
+                Helpers.viz("full", self.active),
+                "bigWig",
+                share(Helpers.colorize(self.exp)),
+                "maxHeightPixels 64:12:8",
+                Helpers.makeShortLabel(self.exp.assay_term_name, self.exp.biosample_term_name),
+                Helpers.makeLongLabel(self.exp.assay_term_name + ' ' + self._desc()),
+                "On",
+                "on",
+                Helpers.unrollEquals(self._metadata()),
+                self.view]
 
     def _metadata(self):
         s = {}
@@ -113,21 +158,29 @@ class BigWigTrack(object):
         age_sex = ' '.join([e for e in [self.exp.age_display, self.exp.donor_sex] if e]).strip()
         s["age_sex"] = Helpers.getOrUnknown(age_sex)
         s["view"] = self.view
-        self.presentation["label"] = (s["label"],
-                                   Helpers.html_escape(Helpers.getOrUnknown(self.exp.tf)))
-        self.presentation["assay"] = (s["assay"], s["assay"])
-        self.presentation["donor"] = (s["donor"], s["donor"])
-        self.presentation["target_label"] = (s["target_label"], s["target_label"])
-        self.presentation["age"] = (s["age"],
-                                    Helpers.html_escape(Helpers.getOrUnknown(self.exp.age_display)))
-        self.presentation["view"] = (s["view"], s["view"])
-        self.presentation["sex"] = (s["sex"], s["sex"])
-        self.presentation["age_sex"] = (s["age_sex"], s["age_sex"])
-        self.presentation["biosample"] = (s["biosample"], s["biosample"])
-        self.presentation["biosample_summary"] = (s["biosample_summary"], s["biosample_summary"])
-        self.presentation["tissue"] = self.presentation["biosample"]
         return s
 
+    def _presentation(self, s):
+        presentation = {}
+        presentation["label"] = (s["label"],
+                                 Helpers.html_escape(Helpers.getOrUnknown(self.exp.tf)))
+        presentation["assay"] = (s["assay"], s["assay"])
+        presentation["donor"] = (s["donor"], s["donor"])
+        presentation["target_label"] = (s["target_label"], s["target_label"])
+        presentation["age"] = (s["age"],
+                               Helpers.html_escape(Helpers.getOrUnknown(self.exp.age_display)))
+        presentation["view"] = (s["view"], s["view"])
+        presentation["sex"] = (s["sex"], s["sex"])
+        presentation["age_sex"] = (s["age_sex"], s["age_sex"])
+        presentation["biosample"] = (s["biosample"], s["biosample"])
+        presentation["biosample_summary"] = (s["biosample_summary"], s["biosample_summary"])
+        presentation["tissue"] = presentation["biosample"]
+        return presentation
+
+    def presentation(self):
+        # (subgroup value, label) per SubGroupKeys entry, built on demand
+        return self._presentation(self._subgroups())
+
     def _url(self):
         u = self.f.url
         if 'www.encodeproject.org' in u:
@@ -152,48 +205,63 @@ class BigWigTrack(object):
         desc.append('(%s)' % self.f.output_type)
         return " ".join(desc)
 
-    def lines(self, idx):
-        extras = {}
-        if self.active:
-            extras["priority"] = idx
-        return outputLines(self.p, 1, extras)
+    def stanza(self, idx):
+        template = self.Template
+        if len(self.p) > len(template.keys):
+            template = self.TemplateLimits
+        return template.render(self.p, idx if self.active else None)
 
 class BigWigTrackAll(BigWigTrack):
-    def __init__(self, assembly, exp, f, parent, active, tissue):
-        BigWigTrack.__init__(self, assembly, exp, f, parent, active)
+    __slots__ = ("tissue",)
+
+    def __init__(self, assembly, exp, f, parent, active, tissue, subGroups=None):
+        self.tissue = tissue
+        BigWigTrack.__init__(self, assembly, exp, f, parent, active, subGroups)
 
-        self.p["color"] = ColorByTissue(tissue)
-        self.p["track"] = "all_" + self.p["track"]
-        self.p["height"] = "maxHeightPixels 32:12:8"
-        self.p["shortLabel"] = Helpers.makeShortLabel(tissue)
+        idx = self.Template.index
+        self.p[idx["color"]] = ColorByTissue(tissue)
+        self.p[idx["track"]] = "all_" + self.p[idx["track"]]
+        self.p[idx["height"]] = "maxHeightPixels 32:12:8"
+        self.p[idx["shortLabel"]] = Helpers.makeShortLabel(tissue)
 
-        self.presentation["tissue"] = (tissue, tissue)
+    def _presentation(self, s):
+        presentation = BigWigTrack._presentation(self, s)
+        presentation["tissue"] = (self.tissue, self.tissue)
+        return presentation
 
 class BigBedTrack(object):
-    def __init__(self, assembly, exp, f, parent, active):
+    __slots__ = ("assembly", "exp", "f", "parent", "active", "p")
+
+    Template = StanzaTemplate(("track", "parent", "subGroups", "bigDataUrl",
+                               "visibility", "type", "shortLabel", "longLabel",
+                               "itemRgb", "color", "darkerLabels", "metadata",
+                               "view"), 2)
+
+    def __init__(self, assembly, exp, f, parent, active, subGroups=None):
         self.assembly = assembly
         self.exp = exp
         self.f = f
         self.parent = parent
         self.active = active
-        self.p = self._init()
-
-    def _init(self):
-        p = OrderedDict()
-        p["track"] = self.parent.initials() + Helpers.sanitize(self.f.expID + '_' + self.f.fileID)
-        p["parent"] = self.parent.param(self.parent.on)
-        p["subGroups"] = Helpers.unrollEquals(self._subgroups())
-        p["bigDataUrl"] = self._url()
-        p["visibility"] = Helpers.viz("dense", self.active)
-        p["type"] = "bigBed"
-        p["shortLabel"] = Helpers.makeShortLabel(self.exp.assay_term_name, self.exp.tf)
-        p["longLabel"] = Helpers.makeLongLabel(self._desc())
-        p["itemRgb"] = "On"
-        p["color"] = Helpers.colorize(self.exp)
-        p["darkerLabels"] = "on"
-        p["metadata"] = Helpers.unrollEquals(self._metadata())
-        p["view"] = self.exp.encodeID
-        return p
+        self.p = self._init(subGroups)
+
+    def _init(self, subGroups):
+        s = self._subgroups()
+        if subGroups is not None:
+            collect(subGroups, self._presentation(s))
+        return [self.parent.initials() + Helpers.sanitize(self.f.expID + '_' + self.f.fileID),
+                self.parent.param(self.parent.on),
+                Helpers.unrollEquals(s),
+                self._url(),
+                Helpers.viz("dense", self.active),
+                "bigBed",
+                Helpers.makeShortLabel(self.exp.assay_term_name, self.exp.tf),
+                Helpers.makeLongLabel(self._desc()),
+                "On",
+                share(Helpers.colorize(self.exp)),
+                "on",
+                Helpers.unrollEquals(self._metadata()),
+                self.exp.encodeID]
 
     def _url(self):
         u = self.f.url
@@ -246,30 +314,40 @@ class BigBedTrack(object):
         age_sex = ' '.join([e for e in [self.exp.age_display, self.exp.donor_sex] if e]).strip()
         s["age_sex"] = Helpers.getOrUnknown(age_sex)
         s["view"] = self.exp.encodeID
-        self.presentation = {}
-        self.presentation["label"] = (s["label"],
-                                   Helpers.html_escape(Helpers.getOrUnknown(self.exp.tf)))
-        self.presentation["assay"] = (s["assay"], s["assay"])
-        self.presentation["target_label"] = (s["target_label"], s["target_label"])
-        self.presentation["donor"] = (s["donor"], s["donor"])
-        self.presentation["age"] = (s["age"],
-                                    Helpers.html_escape(Helpers.getOrUnknown(self.exp.age_display)))
-        self.presentation["view"] = (s["view"], s["view"])
-        self.presentation["sex"] = (s["sex"], s["sex"])
-        self.presentation["age_sex"] = (s["age_sex"], s["age_sex"])
-        self.presentation["biosample"] = (s["biosample"], s["biosample"])
-        self.presentation["biosample_summary"] = (s["biosample_summary"], s["biosample_summary"])
-        self.presentation["tissue"] = self.presentation["biosample"]
         return s
 
-    def lines(self, idx):
-        extras = {}
-        if self.active:
-            extras["priority"] = idx
-        return outputLines(self.p, 2, extras)
+    def _presentation(self, s):
+        presentation = {}
+        presentation["label"] = (s["label"],
+                                 Helpers.html_escape(Helpers.getOrUnknown(self.exp.tf)))
+        presentation["assay"] = (s["assay"], s["assay"])
+        presentation["target_label"] = (s["target_label"], s["target_label"])
+        presentation["donor"] = (s["donor"], s["donor"])
+        presentation["age"] = (s["age"],
+                               Helpers.html_escape(Helpers.getOrUnknown(self.exp.age_display)))
+        presentation["view"] = (s["view"], s["view"])
+        presentation["sex"] = (s["sex"], s["sex"])
+        presentation["age_sex"] = (s["age_sex"], s["age_sex"])
+        presentation["biosample"] = (s["biosample"], s["biosample"])
+        presentation["biosample_summary"] = (s["biosample_summary"], s["biosample_summary"])
+        presentation["tissue"] = presentation["biosample"]
+        return presentation
+
+    def presentation(self):
+        # (subgroup value, label) per SubGroupKeys entry, built on demand
+        return self._presentation(self._subgroups())
+
+    def stanza(self, idx):
+        return self.Template.render(self.p, idx if self.active else None)
 
 class ccRETrack(object):
-    def __init__(self, assembly, exp, stateType, ccREaccession, parent, active):
+    __slots__ = ("assembly", "exp", "stateType", "ccREaccession", "parent", "active", "p")
+
+    Template = StanzaTemplate(("track", "parent", "subGroups", "bigDataUrl",
+                               "visibility", "type", "shortLabel", "longLabel",
+                               "itemRgb", "darkerLabels", "metadata", "view"), 2)
+
+    def __init__(self, assembly, exp, stateType, ccREaccession, parent, active, subGroups=None):
         self.assembly = assembly
         self.exp = exp
         self.stateType = stateType
@@ -279,7 +357,7 @@ class ccRETrack(object):
         if active and "5group" == stateType:
             a = True
         self.active = a
-        self.p = self._init()
+        self.p = self._init(subGroups)
 
     def _labels(self):
         assay = self.stateType.replace("9state-", '')
@@ -301,29 +379,31 @@ class ccRETrack(object):
                               assay, '(9 state)']
         return Helpers.makeShortLabel(*shortLabel), Helpers.makeLongLabel(*longLabel)
 
-    def _init(self):
-        p = OrderedDict()
-        p["track"] = self.parent.initials() + Helpers.sanitize(self.exp.encodeID + '_' + self.ccREaccession)
-        p["parent"] = self.parent.param(self.parent.on)
-        p["subGroups"] = Helpers.unrollEquals(self._subgroups())
-        p["bigDataUrl"] = self._url()
-        p["visibility"] = Helpers.viz("dense", self.active)
-        p["type"] = "bigBed 9"
+    def _init(self, subGroups):
+        s = self._subgroups()
+        if subGroups is not None:
+            collect(subGroups, self._presentation(s))
 
         if 0:
             shortLabel = Helpers.makeShortLabel(self.stateType)
             if "5group" == self.stateType:
                 shortLabel = Helpers.makeShortLabel("ccRE 5 groups")
-            p["shortLabel"] = shortLabel
-            p["longLabel"] = Helpers.makeLongLabel(self._desc())
+            longLabel = Helpers.makeLongLabel(self._desc())
         else:
-            p["shortLabel"], p["longLabel"] = self._labels()
-
-        p["itemRgb"] = "On"
-        p["darkerLabels"] = "on"
-        p["metadata"] = Helpers.unrollEquals(self._metadata())
-        p["view"] = self.exp.encodeID
-        return p
+            shortLabel, longLabel = self._labels()
+
+        return [self.parent.initials() + Helpers.sanitize(self.exp.encodeID + '_' + self.ccREaccession),
+                self.parent.param(self.parent.on),
+                Helpers.unrollEquals(s),
+                self._url(),
+                Helpers.viz("dense", self.active),
+                "bigBed 9",
+                shortLabel,
+                longLabel,
+                "On",
+                "on",
+                Helpers.unrollEquals(self._metadata()),
+                self.exp.encodeID]
 
     def _url(self):
         return os.path.join("https://www.encodeproject.org/files/",
@@ -353,34 +433,43 @@ class ccRETrack(object):
         s["biosample"] = Helpers.getOrUnknown(self.exp.biosample_term_name)
         s["age"] = 'a' + Helpers.sanitize(Helpers.getOrUnknown(self.exp.age_display))
         s["view"] = self.exp.encodeID
-        self.presentation = {}
-        self.presentation["label"] = (s["label"],
-                                   Helpers.html_escape(Helpers.getOrUnknown(self.exp.tf)))
-        self.presentation["assay"] = (s["assay"], s["assay"])
-        self.presentation["donor"] = (s["donor"], s["donor"])
-        self.presentation["age"] = (s["age"],
-                                    Helpers.html_escape(Helpers.getOrUnknown(self.exp.age_display)))
-        self.presentation["view"] = (s["view"], s["view"])
-        self.presentation["biosample"] = (s["biosample"], s["biosample"])
-        self.presentation["sex"] = ('', '')
-        self.presentation["age_sex"] = ('', '')
-        self.presentation["target_label"] = (s["assay"], s["assay"])
-        self.presentation["biosample_summary"] = (s["biosample"], s["biosample"])
-        self.presentation["tissue"] = self.presentation["biosample"]
         return s
 
-    def lines(self, idx):
-        extras = {}
-        if self.active:
-            extras["priority"] = idx
-        return outputLines(self.p, 2, extras)
+    def _presentation(self, s):
+        presentation = {}
+        presentation["label"] = (s["label"],
+                                 Helpers.html_escape(Helpers.getOrUnknown(self.exp.tf)))
+        presentation["assay"] = (s["assay"], s["assay"])
+        presentation["donor"] = (s["donor"], s["donor"])
+        presentation["age"] = (s["age"],
+                               Helpers.html_escape(Helpers.getOrUnknown(self.exp.age_display)))
+        presentation["view"] = (s["view"], s["view"])
+        presentation["biosample"] = (s["biosample"], s["biosample"])
+        presentation["sex"] = ('', '')
+        presentation["age_sex"] = ('', '')
+        presentation["target_label"] = (s["assay"], s["assay"])
+        presentation["biosample_summary"] = (s["biosample"], s["biosample"])
+        presentation["tissue"] = presentation["biosample"]
+        return presentation
+
+    def presentation(self):
+        # (subgroup value, label) per SubGroupKeys entry, built on demand
+        return self._presentation(self._subgroups())
+
+    def stanza(self, idx):
+        return self.Template.render(self.p, idx if self.active else None)
 
 class CompositeExpTrack(object):
-    def __init__(self, assembly, parent, exp, active):
+    __slots__ = ("assembly", "parent", "exp", "active", "subGroups", "bedParent",
+                 "beds", "bigWigs", "ccREs", "tissue")
+    ViewTemplate = StanzaTemplate(("track", "parent", "view", "visibility", "type"), 1)
+
+    def __init__(self, assembly, parent, exp, active, subGroups=None):
         self.assembly = assembly
         self.parent = parent
         self.exp = exp
         self.active = active
+        self.subGroups = subGroups
         self.bedParent = Parent(parent.parent + '_view_' + exp.encodeID, parent.on)
         self.beds = []
         self.bigWigs = []
@@ -393,9 +482,11 @@ class CompositeExpTrack(object):
         ret = []
         if not files:
             eprint("missing bigwig for", expID)
+            Profile.count("missing bigWig")
         else:
             for f in files:
-                t = BigWigTrack(self.assembly, exp, f, self.parent, active)
+                t = BigWigTrack(self.assembly, exp, f, self.parent, active,
+                                self.subGroups)
                 ret.append(t)
         return ret
 
@@ -407,10 +498,11 @@ class CompositeExpTrack(object):
         ret = []
         if not files:
             eprint("missing bigwig for", expID)
+            Profile.count("missing bigWig")
         else:
             for f in files:
                 t = BigWigTrackAll(self.assembly, exp, f, self.parent, active,
-                                   self.tissue)
+                                   self.tissue, self.subGroups)
                 ret.append(t)
         return ret
 
@@ -420,11 +512,13 @@ class CompositeExpTrack(object):
 
         if not files:
             eprint("missing bed for", expID)
+            Profile.count("missing bigBed")
             #raise Exception("expected a file...", exp)
             return []
         ret = []
         for f in files:
-            t = BigBedTrack(self.assembly, exp, f, self.bedParent, active)
+            t = BigBedTrack(self.assembly, exp, f, self.bedParent, active,
+                            self.subGroups)
             ret.append(t)
             break # TODO allow multiple bigBeds, if needed
         return ret
@@ -432,9 +526,11 @@ class CompositeExpTrack(object):
     def _addcREs(self, exp, active, ccREs):
         ret = []
         ccREaccessions = set()
-        for stateType, accession in ccREs.iteritems():
+        # sorted: a dict's order can change once it is pickled to a worker
+        for stateType, accession in sorted(ccREs.iteritems()):
             if accession not in ccREaccessions:
-                t = ccRETrack(self.assembly, exp, stateType, accession, self.bedParent, active)
+                t = ccRETrack(self.assembly, exp, stateType, accession, self.bedParent,
+                              active, self.subGroups)
                 ret.append(t)
                 ccREaccessions.add(accession)
         return ret
@@ -448,13 +544,11 @@ class CompositeExpTrack(object):
         self.bigWigs = self._addExpBestBigWigAll(self.exp, self.active)
 
     def view(self):
-        p = OrderedDict()
-        p["track"] = self.bedParent.parent
-        p["parent"] = self.parent.param(self.active)
-        p["view"] = self.exp.encodeID
-        p["visibility"] = "dense"
-        p["type"] = "bigBed"
-        return p
+        return self.ViewTemplate.render([self.bedParent.parent,
+                                         self.parent.param(self.active),
+                                         self.exp.encodeID,
+                                         "dense",
+                                         "bigBed"])
 
     def tracks(self):
         for t in self.beds + self.ccREs + self.bigWigs:
@@ -466,48 +560,50 @@ class Tracks(object):
         self.parent = parent
         self.tracks = []
         self.isAll = isAll
+        self.numTracks = 0
+        # subgroup (value, label) sets, filled in as tracks are added
+        self.subGroups = defaultdict(set)
+
+    def _add(self, ct):
+        self.tracks.append(ct)
+        self.numTracks += len(ct.bigWigs) + len(ct.beds) + len(ct.ccREs)
 
     def addExp(self, exp, active, ccREs):
-        ct = CompositeExpTrack(self.assembly, self.parent, exp, active)
+        ct = CompositeExpTrack(self.assembly, self.parent, exp, active, self.subGroups)
         ct.addExp(ccREs)
-        self.tracks.append(ct)
+        self._add(ct)
 
     def addExpAll(self, exp, active, ccREs):
-        ct = CompositeExpTrack(self.assembly, self.parent, exp, active)
+        ct = CompositeExpTrack(self.assembly, self.parent, exp, active, self.subGroups)
         ct.addExpAll(ccREs)
-        self.tracks.append(ct)
+        self._add(ct)
+
+    def count(self):
+        return self.numTracks
 
-    def lines(self, priority):
+    def render(self):
+        # the whole composite's stanzas as one string, priorities numbered
+        #  from 0; the parent shifts them into the range it reserves
         if self.isAll:
             tracks = self._sortAllTracks()
         else:
             tracks = self._sortedTracks()
 
-        # count number of tracks, and atomically inc priority to accomodate
-        #  all tracks
+        out = []
         counter = 0
         for ct in tracks:
             for t in ct.bigWigs:
-                counter += 1
-            if len(ct.beds + ct.ccREs) > 0:
-                for t in ct.beds + ct.ccREs:
-                    counter += 1
-        priorityStart = priority.increment(counter) - counter
-
-        counter = 0
-        for ct in tracks:
-            for t in ct.bigWigs:
-                for line in t.lines(priorityStart + counter):
-                    yield line
+                out.append(t.stanza(counter))
                 counter += 1
             if len(ct.beds + ct.ccREs) > 0:
                 # empty view not allowed
-                for line in outputLines(ct.view(), 1):
-                    yield line
+                out.append(ct.view())
                 for t in ct.beds + ct.ccREs:
-                    for line in t.lines(priorityStart + counter):
-                        yield line
+                    out.append(t.stanza(counter))
                     counter += 1
+        Profile.count("exps", len(tracks))
+        Profile.count("tracks", counter)
+        return ''.join(out)
 
     def _sortAllTracks(self):
         tracks = self.tracks
@@ -536,9 +632,4 @@ class Tracks(object):
         return sorted(tracks, key = lambda t: preferredSortOrder(t.exp))
 
     def subgroups(self):
-        r = defaultdict(set)
-        for tracks in self.tracks:
-            for t in tracks.tracks():
-                for k in Helpers.SubGroupKeys:
-                    r[k].add(t.presentation[k])
-        return r
+        return self.subGroups
@@ -0,0 +1,259 @@
+from __future__ import print_function
+
+import sys
+import os
+import re
+import json
+import time
+import Queue
+import urlparse
+import threading
+
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils, eprint, printt
+
+import helpers as Helpers
+from profiler import Profile
+from shards import rehash
+
+Proxy = "?proxy=true"
+MaxRedirects = 5
+
+BigDataUrlRe = re.compile(r'^(\s*bigDataUrl )(\S+)$')
+
+def plainUrl(u):
+    # the file itself, without the portal's proxy flag
+    if u.endswith(Proxy):
+        return u[:-len(Proxy)]
+    return u
+
+def bigDataUrls(fnp):
+    with open(fnp) as f:
+        for line in f:
+            m = BigDataUrlRe.match(line.rstrip('\n'))
+            if m:
+                yield m.group(2)
+
+def _fileSize(r):
+    # "bytes 0-0/12345" from a range request, else the whole body's length
+    total = r.headers.get("content-range", "").rpartition('/')[2]
+    if total.isdigit():
+        return int(total)
+    n = r.headers.get("content-length")
+    if n and n.isdigit() and 200 == r.status_code:
+        return int(n)
+    return None
+
+def _release(r):
+    # a short body is read so the connection goes back to the pool; a server
+    #  ignoring the range would send the whole file, so that one is dropped
+    n = r.headers.get("content-length")
+    if n and n.isdigit() and int(n) <= 64 * 1024:
+        r.content
+    r.close()
+
+class RateLimiter(object):
+    """At most `rate` requests a second across all threads, in bursts of up to `burst`."""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+class UrlCache(object):
+    """What each bigDataUrl resolved to when last checked, kept in one json file.
+
+    url -> {"status", "error", "final", "size", "ranges", "direct", "checked"}
+    """
+    def __init__(self, cacheDir):
+        self.fnp = os.path.join(cacheDir, "urls.json")
+        self.entries = {}
+        if os.path.exists(self.fnp):
+            try:
+                with open(self.fnp) as f:
+                    self.entries = json.load(f)
+            except ValueError as e:
+                eprint("url cache: ignoring", self.fnp, e)
+
+    def save(self):
+        Utils.ensureDir(self.fnp)
+        Helpers.atomicWrite(self.fnp, json.dumps(self.entries, indent=1, sort_keys=True))
+
+class UrlChecker(object):
+    """Checks bigDataUrls on a pool of threads, each with its own keep-alive session.
+
+    Every URL is fetched the way a genome browser would: a one-byte range
+    request, following redirects hop by hop, so dead and revoked files, and
+    servers without range support, show up before a release does. `host`, if
+    set, receives every first request in place of the URL's own host, e.g. a
+    local benchmarks/wsstandin.py. Entries younger than `ttl` seconds are
+    taken from the cache; failed ones are always checked again.
+    """
+    def __init__(self, cache, j=16, rate=20, timeout=30, ttl=7 * 24 * 3600,
+                 host=None, direct=False):
+        self.cache = cache
+        self.j = j
+        self.limiter = RateLimiter(rate)
+        self.timeout = timeout
+        self.ttl = ttl
+        self.host = host
+        self.direct = direct
+        self.local = threading.local()
+
+    def _session(self):
+        if not hasattr(self.local, "session"):
+            s = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            self.local.session = s
+        return self.local.session
+
+    def _target(self, url):
+        if not self.host:
+            return url
+        u = urlparse.urlsplit(url)
+        h = urlparse.urlsplit(self.host)
+        return urlparse.urlunsplit((h.scheme, h.netloc, u.path, u.query, u.fragment))
+
+    def _fetch(self, url):
+        # (status, final url, response) after following redirects
+        session = self._session()
+        for hop in xrange(MaxRedirects + 1):
+            self.limiter.wait()
+            r = session.get(url, headers={"Range": "bytes=0-0"}, stream=True,
+                            allow_redirects=False, timeout=self.timeout)
+            _release(r)
+            Profile.count("url requests")
+            if not r.is_redirect:
+                return r.status_code, url, r
+            url = urlparse.urljoin(url, r.headers["location"])
+        return r.status_code, url, r
+
+    def _check(self, url):
+        entry = {"checked": time.time(), "status": None, "error": None,
+                 "final": None, "size": None, "ranges": False}
+        try:
+            status, final, r = self._fetch(self._target(url))
+            entry.update({"status": status,
+                          "final": final,
+                          "size": _fileSize(r),
+                          "ranges": 206 == status})
+            if self.direct:
+                entry["direct"] = self._directUrl(final) if self.ok(entry) else None
+        except requests.RequestException as e:
+            entry["error"] = str(e)
+        return entry
+
+    def _directUrl(self, final):
+        # a signed redirect target expires; its unsigned form is only usable
+        #  if the bucket is public, which a second request tells
+        u = urlparse.urlsplit(final)
+        if not u.query:
+            return final
+        unsigned = urlparse.urlunsplit((u.scheme, u.netloc, u.path, '', ''))
+        status, final, r = self._fetch(unsigned)
+        if status in (200, 206) and final == unsigned:
+            return unsigned
+        return None
+
+    def ok(self, entry):
+        return entry["status"] in (200, 206)
+
+    def _fresh(self, entry):
+        if not entry or not self.ok(entry):
+            return False
+        if self.direct and "direct" not in entry:
+            return False
+        return time.time() - entry["checked"] < self.ttl
+
+    def check(self, urls):
+        # url -> entry for every url given; the cache is updated and saved
+        todo = Queue.Queue()
+        pending = sorted(set(u for u in urls if not self._fresh(self.cache.entries.get(u))))
+        for u in pending:
+            todo.put(u)
+        Profile.count("urls from cache", len(set(urls)) - len(pending))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    u = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                entry = self._check(u)
+                with lock:
+                    self.cache.entries[u] = entry
+
+        threads = [threading.Thread(target=worker) for i in xrange(min(self.j, len(pending)))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+
+        Profile.count("urls checked", len(pending))
+        if pending:
+            self.cache.save()
+        return {u: self.cache.entries[u] for u in urls}
+
+def rewriteDirect(fnp, results):
+    # bigDataUrl lines whose file has a direct url point there instead
+    changed = [False]
+    def direct(m):
+        entry = results.get(plainUrl(m.group(2)))
+        if entry and entry.get("direct"):
+            changed[0] = True
+            return m.group(1) + entry["direct"]
+        return m.group(0)
+    with open(fnp) as f:
+        lines = f.read().splitlines(True)
+    for i, line in enumerate(lines):
+        # keep each line's own ending, or the lack of one on the last line
+        body = line.rstrip('\r\n')
+        lines[i] = BigDataUrlRe.sub(direct, body) + line[len(body):]
+    if changed[0]:
+        Helpers.atomicWrite(fnp, ''.join(lines))
+    return changed[0]
+
+def checkRelease(releaseDir, checker, rewrite=False):
+    # every bigDataUrl in the release's trackDbs and shards; returns the dead ones
+    fnps = []
+    for root, dirs, files in os.walk(releaseDir):
+        fnps += [os.path.join(root, fn) for fn in files if fn.endswith(".txt")]
+    urls = set()
+    for fnp in fnps:
+        urls.update(plainUrl(u) for u in bigDataUrls(fnp))
+
+    with Profile.stage("check urls"):
+        results = checker.check(urls)
+    dead = sorted(u for u, entry in results.iteritems() if not checker.ok(entry))
+    Profile.count("urls dead", len(dead))
+    printt("checked", len(urls), "bigDataUrls:", len(dead), "dead")
+    for u in dead[:20]:
+        entry = results[u]
+        eprint("\tdead:", u, entry["status"] or entry["error"])
+
+    if rewrite:
+        rewritten = [fnp for fnp in fnps if rewriteDirect(fnp, results)]
+        rehash(releaseDir, rewritten)
+        printt("pointed bigDataUrls at direct urls in", len(rewritten), "files")
+    return dead
@@ -0,0 +1,120 @@
+from __future__ import print_function
+
+import sys
+import os
+import json
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils, eprint
+
+import helpers as Helpers
+from bbi import openBBI
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# bump if the limits are computed differently
+CacheVersion = 1
+
+# quantiles, over bases covered, of each zoom bin's low and high values
+LowQuantile = 0.05
+HighQuantile = 0.95
+
+def _recordDtype(order):
+    # bbi.ZoomRecord as numpy sees it
+    return numpy.dtype([("chromId", order + "u4"), ("start", order + "u4"),
+                        ("end", order + "u4"), ("validCount", order + "u4"),
+                        ("min", order + "f4"), ("max", order + "f4"),
+                        ("sum", order + "f4"), ("sumSquares", order + "f4")])
+
+def _weightedQuantile(values, weights, q):
+    order = numpy.argsort(values)
+    cum = numpy.cumsum(weights[order])
+    return values[order][min(numpy.searchsorted(cum, q * cum[-1]), len(values) - 1)]
+
+def lowestZoom(fnp):
+    # the coarsest zoom level's records of a bigWig, None if it has no zooms
+    with openBBI(fnp) as r:
+        if "bigWig" != r.kind or not r.zooms:
+            return None
+        reduction, dataOffset, indexOffset = max(r.zooms)
+        dtype = _recordDtype(r.order)
+        # concatenate copies, so nothing points into the map once it closes
+        parts = [numpy.frombuffer(b, dtype) for b in r.zoomBlocks(dataOffset, indexOffset)]
+        if not parts:
+            return None
+        return numpy.concatenate(parts)
+
+def viewLimits(records):
+    """"lower:upper" for a track's y axis from its zoom records, None if empty.
+
+    Each bin's values are taken as its mean give or take two standard
+    deviations, kept within the bin's own min and max; the limits are
+    quantiles of those over the bases covered, so a handful of spikes or a
+    mostly empty genome does not set the scale. The lower limit is 0 unless
+    the signal goes negative.
+    """
+    records = records[records["validCount"] > 0]
+    if not len(records):
+        return None
+    n = records["validCount"].astype(numpy.float64)
+    mean = records["sum"] / n
+    sd = numpy.sqrt(numpy.maximum(records["sumSquares"] / n - mean * mean, 0))
+    low = numpy.maximum(mean - 2 * sd, records["min"])
+    high = numpy.minimum(mean + 2 * sd, records["max"])
+    lower = min(0.0, float(_weightedQuantile(low, n, LowQuantile)))
+    upper = float(_weightedQuantile(high, n, HighQuantile))
+    if not numpy.isfinite(upper) or upper <= lower:
+        return None
+    return "%.4g:%.4g" % (lower, upper)
+
+def fileKey(f, fnp):
+    # the md5 the portal lists for the file, else the mirrored copy's size and mtime
+    md5 = getattr(f, "md5sum", None)
+    if md5:
+        return md5
+    st = os.stat(fnp)
+    return "%d-%d" % (st.st_size, int(st.st_mtime))
+
+class ViewLimitsCache(object):
+    """viewLimits per file accession and md5, kept in one json file, so a
+    bigWig is only summarized once however many runs and views show it."""
+    def __init__(self, cacheDir):
+        self.fnp = os.path.join(cacheDir, "viewlimits.json")
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        if os.path.exists(self.fnp):
+            try:
+                with open(self.fnp) as f:
+                    stored = json.load(f)
+                if stored.get("version") == CacheVersion:
+                    self.entries = stored["files"]
+            except ValueError as e:
+                eprint("view limits cache: ignoring", self.fnp, e)
+
+    def get(self, accession, key):
+        # (found, limits); limits may be None for a file with nothing to scale
+        with self.lock:
+            entry = self.entries.get(accession)
+        if entry and entry["key"] == key:
+            return True, entry["viewLimits"]
+        return False, None
+
+    def put(self, accession, key, limits):
+        with self.lock:
+            self.entries[accession] = {"key": key, "viewLimits": limits}
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            Utils.ensureDir(self.fnp)
+            Helpers.atomicWrite(self.fnp, json.dumps({"version": CacheVersion,
+                                                      "files": self.entries},
+                                                     indent=1, sort_keys=True))
+            self.dirty = False
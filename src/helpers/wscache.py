@@ -0,0 +1,104 @@
+from __future__ import print_function
+
+import sys
+import os
+import json
+import time
+import hashlib
+import cPickle as pickle
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../../metadata/utils'))
+from utils import Utils, eprint
+
+import helpers as Helpers
+from profiler import Profile
+
+# off:    always ask the web service, keep nothing
+# cache:  serve stored responses younger than the ttl; refetch older ones
+# record: always ask the web service, store every response
+# replay: only serve stored responses, never touch the network
+Modes = ["off", "cache", "record", "replay"]
+
+class MetadataCache(object):
+    def __init__(self, cacheDir, host, mode="cache", ttl=24 * 3600):
+        if mode not in Modes:
+            raise Exception("unknown metadata cache mode " + mode)
+        self.cacheDir = cacheDir
+        self.host = host
+        self.mode = mode
+        self.ttl = ttl
+
+    def wrap(self, mw, namespace):
+        return CachedMetadataWS(mw, self, namespace)
+
+    def _key(self, namespace, name, args, kwargs):
+        h = hashlib.sha1()
+        h.update(repr((self.host, namespace, name, args, sorted(kwargs.items()))))
+        return h.hexdigest()
+
+    def _fnps(self, namespace, name, key):
+        base = os.path.join(self.cacheDir, namespace, name, key)
+        return base + ".pickle", base + ".json"
+
+    def call(self, namespace, name, f, args, kwargs):
+        if "off" == self.mode:
+            return f(*args, **kwargs)
+
+        key = self._key(namespace, name, args, kwargs)
+        dataFnp, metaFnp = self._fnps(namespace, name, key)
+
+        meta = None
+        if os.path.exists(metaFnp):
+            with open(metaFnp) as fd:
+                meta = json.load(fd)
+
+        if "replay" == self.mode:
+            if not meta:
+                raise Exception("replay: no recorded response for %s.%s %s" %
+                                (namespace, name, repr(args)[:200]))
+            return self._load(dataFnp)
+
+        if "cache" == self.mode and meta:
+            if time.time() - meta["fetched"] < self.ttl:
+                return self._load(dataFnp)
+
+        try:
+            ret = f(*args, **kwargs)
+        except Exception as e:
+            if not meta:
+                raise
+            eprint("metadata cache: serving stale %s.%s after error:" % (namespace, name), e)
+            return self._load(dataFnp)
+
+        data = pickle.dumps(ret, pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha1(data).hexdigest()
+        Utils.ensureDir(dataFnp)
+        if not meta or meta["digest"] != digest:
+            Helpers.atomicWrite(dataFnp, data)
+        # a refetch whose payload is unchanged only refreshes the timestamp;
+        #  MetadataWS hides its requests, so there is no conditional GET
+        Helpers.atomicWrite(metaFnp, json.dumps({"fetched": time.time(),
+                                                 "digest": digest,
+                                                 "call": name}))
+        return ret
+
+    def _load(self, dataFnp):
+        with open(dataFnp, 'rb') as f:
+            return pickle.load(f)
+
+class CachedMetadataWS(object):
+    """MetadataWS stand-in that routes every method call through a MetadataCache."""
+    def __init__(self, mw, wsCache, namespace):
+        self.mw = mw
+        self.wsCache = wsCache
+        self.namespace = namespace
+
+    def __getattr__(self, name):
+        attr = getattr(self.mw, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with Profile.stage("%s ws %s" % (self.namespace, name)):
+                return self.wsCache.call(self.namespace, name, attr, args, kwargs)
+        return call
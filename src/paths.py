@@ -2,11 +2,34 @@ from __future__ import print_function
 
 import sys
 import os
+import time
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../metadata/utils'))
 from files_and_paths import Urls
 
 #Host = Urls.metadataWebService
-Host = "http://192.168.1.46:9008/"
-BaseWwwTmpDir = os.path.join(os.path.dirname(__file__), '../www-tmp')
-BaseWwwDir = os.path.join(os.path.dirname(__file__), '../www')
+# e.g. a local benchmarks/wsstandin.py instead of the real service
+Host = os.environ.get("TRACKHUB_METADATA_HOST") or "http://192.168.1.46:9008/"
+# where bigDataUrl checks are sent instead of each url's own host, e.g. a
+#  local benchmarks/wsstandin.py --files; unset checks the real files
+FilesHost = os.environ.get("TRACKHUB_FILES_HOST")
+# every build stages privately under its own id, so overlapping runs never
+#  touch each other's files; exported so worker processes agree on it
+RunID = os.environ.get("TRACKHUB_RUN_ID") or \
+        "%s-%d" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+os.environ["TRACKHUB_RUN_ID"] = RunID
+
+# everything a build writes lives under here; benchmarks point it elsewhere
+OutputRoot = os.environ.get("TRACKHUB_OUTPUT_ROOT") or \
+             os.path.join(os.path.dirname(__file__), '..')
+
+WwwReleasesDir = os.path.join(OutputRoot, 'www-releases')
+BaseWwwTmpDir = os.path.join(OutputRoot, 'www-tmp', RunID)
+BaseWwwDir = os.path.join(WwwReleasesDir, '.staging', RunID)
+BuildCacheDir = os.path.join(OutputRoot, 'build-cache')
+MetadataCacheDir = os.path.join(OutputRoot, 'metadata-cache')
+SelectionCacheDir = os.path.join(OutputRoot, 'selection-cache')
+ProfileDir = os.path.join(OutputRoot, 'profiles')
+ListsCacheDir = os.path.join(OutputRoot, 'lists-cache')
+UrlCacheDir = os.path.join(OutputRoot, 'url-cache')
+ViewLimitsCacheDir = os.path.join(OutputRoot, 'viewlimits-cache')